@@ -0,0 +1,385 @@
+"""
+JSON REST API（/api/v1）
+與 HTML 路由共用 queries 查詢層與快取；序列化只輸出需要的欄位，支援 ?fields= 欄位選擇、
+keyset 分頁與 gzip 壓縮。認證沿用網站的 session cookie（POST /api/v1/login 取得）
+"""
+
+import gzip
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, jsonify, request, session, stream_with_context
+from sqlalchemy import update
+from werkzeug.exceptions import HTTPException
+
+import cache
+import catalog
+import images
+import intake
+import passwords
+import pubsub
+import queries
+import search
+import stats
+import auth
+from auth import authenticate, login_user, LoginThrottled
+from models import db, Product, GroupBuying
+from ordering import JoinRejected
+from routing import pin_to_primary, read_only
+
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# 小於此大小的回應不壓縮（壓縮省下的流量不足以抵銷 CPU 成本）
+GZIP_MIN_SIZE = 500
+GZIP_LEVEL = 6
+
+# 各資源可選的欄位（?fields=id,name,...），未指定時輸出全部
+GROUP_FIELDS = (
+    'id', 'name', 'description', 'status', 'product', 'leader',
+    'target_quantity', 'current_quantity', 'remaining_slots', 'progress_percentage',
+    'deadline', 'created_at', 'updated_at',
+)
+ORDER_FIELDS = (
+    'id', 'quantity', 'total_price', 'payment_status', 'created_at', 'group', 'product_name',
+)
+PRODUCT_FIELDS = ('id', 'name', 'price', 'description')
+
+JOIN_ERRORS = {
+    'closed': '此團購已關閉',
+    'expired': '此團購已過期',
+    'invalid_quantity': '購買數量至少為 1',
+    'sold_out': '剩餘名額不足',
+}
+
+
+# --- 錯誤與認證 ---
+def error(status, code, message, **extra):
+    """JSON 錯誤回應"""
+    response = jsonify({'error': code, 'message': message, **extra})
+    response.status_code = status
+    return response
+
+
+@api.errorhandler(HTTPException)
+def handle_http_error(e):
+    return error(e.code, e.name.lower().replace(' ', '_'), e.description)
+
+
+def _unauthorized():
+    return error(401, 'unauthorized', '請先登入')
+
+
+def _forbidden(message):
+    return lambda: error(403, 'forbidden', message)
+
+
+api_login_required = auth.requires(None, _unauthorized, None)
+api_admin_required = auth.requires(auth.is_admin, _unauthorized, _forbidden('需要管理員權限'))
+api_group_manager_required = auth.requires(auth.admin_or_group_leader, _unauthorized,
+                                           _forbidden('你沒有權限關閉此團購'))
+
+
+# --- 序列化 ---
+def selected_fields(allowed):
+    """解析 ?fields=，未知欄位回傳 400"""
+    raw = request.args.get('fields')
+    if not raw:
+        return allowed
+    fields = tuple(field.strip() for field in raw.split(',') if field.strip())
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        abort(400, f"未知的欄位：{', '.join(unknown)}")
+    return fields
+
+
+def pick(data, fields):
+    return {field: data[field] for field in fields}
+
+
+def serialize_group(card, fields=GROUP_FIELDS):
+    """團購（來自 queries.group_cards 的快取卡片）"""
+    return pick(card.data, fields)
+
+
+def serialize_order(row, fields=ORDER_FIELDS):
+    """訂單（來自 queries.order_rows_for_user 的欄位列）"""
+    data = {
+        'id': row.id,
+        'quantity': row.quantity,
+        'total_price': row.total_price,
+        'payment_status': row.payment_status,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'group': {
+            'id': row.group_id,
+            'name': row.group_name,
+            'status': row.group_status,
+            'deadline': row.group_deadline.isoformat(),
+        },
+        'product_name': row.product_name,
+    }
+    return pick(data, fields)
+
+
+def serialize_product(product, fields=PRODUCT_FIELDS):
+    """商品（商品目錄的 dict 或 Product）"""
+    if isinstance(product, Product):
+        product = {'id': product.id, 'name': product.name,
+                   'price': product.price, 'description': product.description}
+    return pick(product, fields)
+
+
+def _page(items, next_cursor):
+    return jsonify({'data': items, 'next_cursor': next_cursor})
+
+
+def _json_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, '請以 JSON 物件傳送資料')
+    return body
+
+
+# --- 壓縮 ---
+@api.after_request
+def compress(response):
+    """Accept-Encoding 含 gzip 時壓縮 JSON 回應"""
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.accept_encodings):
+        return response
+
+    body = response.get_data()
+    if len(body) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(body, GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# --- 認證 ---
+@api.route('/login', methods=['POST'])
+def login():
+    """以 JSON {username, password} 登入，回傳用戶資料並設定 session cookie"""
+    body = _json_body()
+    try:
+        user = authenticate(body.get('username'), body.get('password'))
+    except LoginThrottled as e:
+        response = error(429, 'too_many_attempts', '嘗試次數過多', retry_after=e.retry_after)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    except passwords.PasswordPoolBusy:
+        response = error(503, 'busy', '系統忙碌，請稍後再試')
+        response.headers['Retry-After'] = '1'
+        return response
+    if user is None:
+        return error(401, 'invalid_credentials', '用戶名或密碼錯誤')
+
+    login_user(user)
+    return jsonify({'id': user.id, 'username': user.username, 'name': user.name, 'role': user.role})
+
+
+# --- 團購 ---
+@api.route('/groups')
+@read_only
+def list_groups():
+    """團購列表，參數與 /browse.json 相同（預設只列出進行中且未過期）"""
+    fields = selected_fields(GROUP_FIELDS)
+    filters = queries.parse_group_filters(request.args)
+    try:
+        page, next_cursor = queries.active_group_page(filters)
+    except ValueError:
+        abort(400, '游標格式錯誤')
+    return _page([serialize_group(card, fields) for card in queries.group_cards(page)], next_cursor)
+
+
+@api.route('/groups/<int:group_id>')
+@read_only
+def get_group(group_id):
+    fields = selected_fields(GROUP_FIELDS)
+    version = queries.group_version_or_404(group_id)
+    return jsonify(serialize_group(queries.group_cards([version])[0], fields))
+
+
+@api.route('/groups/<int:group_id>/join', methods=['POST'])
+@api_login_required
+def join_group(group_id):
+    """跟團，JSON {quantity}；名額不足等情況回傳 409
+
+    帶 Idempotency-Key 標頭時可安全重送：相同 key 回傳原本的訂單（200 而非 201）
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        quantity = int(body.get('quantity', 1))
+    except (TypeError, ValueError):
+        quantity = 0
+
+    idempotency_key = request.headers.get('Idempotency-Key') or None
+    if idempotency_key and len(idempotency_key) > 64:
+        abort(400, 'Idempotency-Key 最長 64 字元')
+
+    try:
+        order = intake.submit_join(group_id, session['user_id'], quantity, idempotency_key)
+    except JoinRejected as e:
+        if e.reason == 'not_found':
+            abort(404)
+        status = 400 if e.reason == 'invalid_quantity' else 409
+        return error(status, e.reason, JOIN_ERRORS[e.reason], remaining_slots=e.remaining)
+
+    # 訂單可能由同一批的 leader 在另一個請求中寫入，本請求的 g.db_wrote 不一定會被設定
+    pin_to_primary()
+    return jsonify({
+        'id': order.id,
+        'group_id': order.group_id,
+        'quantity': order.quantity,
+        'total_price': order.total_price,
+        'payment_status': order.payment_status,
+    }), 200 if order.replayed else 201
+
+
+@api.route('/groups/<int:group_id>/close', methods=['POST'])
+@api_group_manager_required
+def close_group(group_id):
+    """關閉團購（團長或管理員）"""
+    group = db.session.get(GroupBuying, group_id) or abort(404)
+
+    group.status = 'CLOSED'
+    db.session.commit()
+    stats.clear_cache()
+    cache.invalidate_groups(group_id)
+    pubsub.publish_group_progress(group)
+    return jsonify(group.to_progress_dict())
+
+
+# --- 訂單 ---
+@api.route('/orders')
+@api_login_required
+@read_only
+def list_orders():
+    """我的訂單（keyset 分頁，?cursor=&limit=）"""
+    fields = selected_fields(ORDER_FIELDS)
+    filters = queries.parse_group_filters(request.args)
+    try:
+        rows, next_cursor = queries.order_rows_for_user(session['user_id'], filters['cursor'], filters['limit'])
+    except ValueError:
+        abort(400, '游標格式錯誤')
+    return _page([serialize_order(row, fields) for row in rows], next_cursor)
+
+
+# --- 商品 ---
+@api.route('/products')
+@read_only
+def list_products():
+    """商品目錄（依 id 的 keyset 分頁，?cursor=&limit=）"""
+    fields = selected_fields(PRODUCT_FIELDS)
+    filters = queries.parse_group_filters(request.args)
+    try:
+        rows, next_cursor = queries.product_page(filters['cursor'], filters['limit'])
+    except ValueError:
+        abort(400, '游標格式錯誤')
+    return _page([serialize_product(row._asdict(), fields) for row in rows], next_cursor)
+
+
+@api.route('/products/typeahead')
+@read_only
+def product_typeahead():
+    """商品自動完成（開團表單），?q= 搜尋名稱與描述，依相關度排序，最多 ?limit= 筆"""
+    query = search.parse_query(request.args.get('q'))
+    if query is None:
+        return _page([], None)
+    limit = max(1, min(request.args.get('limit', search.TYPEAHEAD_LIMIT, type=int), search.MAX_TYPEAHEAD_LIMIT))
+    rows = search.typeahead_products(query, limit)
+    return _page([{'id': row.id, 'name': row.name, 'price': row.price} for row in rows], None)
+
+
+def _product_values(body, partial=False):
+    """驗證商品欄位，回傳要寫入的值"""
+    try:
+        return catalog.validate_product(body, partial)
+    except ValueError as e:
+        abort(400, str(e))
+
+
+@api.route('/products', methods=['POST'])
+@api_admin_required
+def create_product():
+    product = Product(**_product_values(_json_body()))
+    db.session.add(product)
+    db.session.commit()
+    return jsonify(serialize_product(product)), 201
+
+
+@api.route('/products/import', methods=['POST'])
+@api_admin_required
+def import_products():
+    """批次匯入商品：multipart 的 file 欄位或直接以請求本文上傳 CSV / JSON Lines
+
+    格式由 ?format=、檔名或 Content-Type 判斷；回傳新增、更新與失敗筆數及錯誤的行號
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, fmt = upload.stream, catalog.format_for(upload.filename, upload.mimetype)
+    else:
+        stream, fmt = request.stream, catalog.format_for(content_type=request.mimetype)
+    fmt = request.args.get('format') or fmt
+    if fmt not in catalog.FORMATS:
+        abort(400, '請指定格式 csv 或 jsonl')
+
+    report = catalog.import_products(stream, fmt)
+    return jsonify(report.to_dict())
+
+
+@api.route('/products/export')
+@api_admin_required
+@read_only
+def export_products():
+    """串流匯出整個商品目錄（?format=csv 或 jsonl，預設 jsonl）"""
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in catalog.FORMATS:
+        abort(400, '請指定格式 csv 或 jsonl')
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(catalog.export_products(fmt)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=products.{fmt}'
+    return response
+
+
+@api.route('/products/<int:product_id>', methods=['PATCH'])
+@api_admin_required
+def update_product(product_id):
+    product = db.session.get(Product, product_id) or abort(404)
+    for field, value in _product_values(_json_body(), partial=True).items():
+        setattr(product, field, value)
+
+    # 團購卡片內含商品資料：更新相關團購的版本戳記，讓快取與 ETag 失效
+    db.session.execute(
+        update(GroupBuying)
+        .where(GroupBuying.product_id == product_id)
+        .values(updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return jsonify(serialize_product(product))
+
+
+@api.route('/products/<int:product_id>/image', methods=['PUT'])
+@api_admin_required
+def upload_product_image(product_id):
+    """上傳商品圖片：multipart 的 file 欄位或直接以請求本文上傳 JPEG / PNG / GIF / WebP
+
+    上傳後 image_url 清空，不再從外部下載；回傳各尺寸與格式的網址
+    """
+    db.session.get(Product, product_id) or abort(404)
+    try:
+        key = images.store_upload(request.files.get('file') or request.stream)
+    except images.ImageError as e:
+        abort(400, str(e))
+    images.set_product_image(product_id, key)
+    return jsonify({
+        'image_key': key,
+        'images': {
+            variant: {fmt: images.image_url(key, variant, fmt) for fmt in images.FORMATS}
+            for variant in images.VARIANTS
+        },
+    })
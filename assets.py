@@ -0,0 +1,336 @@
+"""
+靜態資源打包
+`flask build-assets` 將 base.html 載入的 CSS / JS 各合併成一個檔案並輸出到 static/dist：
+- CSS 去除註解與空白；Font Awesome 只保留樣板與 JS 中用到的圖示（安裝 fontTools 時字型檔也只保留這些字符）
+- 檔名加上內容雜湊（app.3f2a9c1d7e4b.css），可設定一年的 immutable 快取，內容改變時網址跟著改變
+- 預先壓縮成 .gz（安裝 brotli 時另有 .br），/assets 依 Accept-Encoding 直接回傳壓縮檔，不在請求中壓縮
+- static/fonts 中的 <字型>-<字重>[-italic].woff2 產生 @font-face 一起打包，不再向 Google Fonts 請求；
+  缺少 REQUIRED_FONTS 中的字型檔時打包失敗，不會默默改用系統字型
+沒有 manifest（尚未打包）時樣板改為逐一載入原始檔案，開發時不需要先打包
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+
+from flask import abort, current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # 選用：沒有時只產生 gzip
+    brotli = None
+
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+FONT_DIR = os.path.join(STATIC_DIR, 'fonts')
+MANIFEST = 'manifest.json'
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+HASH_LENGTH = 12
+COMPRESSIBLE = ('.css', '.js', '.svg')
+
+# 打包名稱 -> 依序合併的原始檔（相對於 static）
+BUNDLES = {
+    'app.css': (
+        'vendor/fontawesome-free/css/fontawesome.min.css',
+        'vendor/fontawesome-free/css/solid.min.css',
+        'css/sb-admin-2.min.css',
+        'css/custom.css',
+    ),
+    'app.js': (
+        'vendor/jquery/jquery.min.js',
+        'vendor/bootstrap/js/bootstrap.bundle.min.js',
+        'vendor/jquery-easing/jquery.easing.min.js',
+        'js/sb-admin-2.min.js',
+    ),
+}
+
+FONT_AWESOME_CSS = 'vendor/fontawesome-free/css/fontawesome.min.css'
+FONT_AWESOME_SOLID = 'vendor/fontawesome-free/css/solid.min.css'
+
+# sb-admin-2 用到的 Nunito 字重（font-weight 300 / 400 / 700 / 800 / 900，<em> 為 400 italic）
+REQUIRED_FONTS = (
+    'nunito-300.woff2',
+    'nunito-400.woff2',
+    'nunito-400-italic.woff2',
+    'nunito-700.woff2',
+    'nunito-800.woff2',
+    'nunito-900.woff2',
+)
+
+MIMETYPES = {'.woff2': 'font/woff2', '.woff': 'font/woff'}
+
+_ICON_RULE = re.compile(r'\.fa-([a-z0-9-]+):before\{content:"\\([0-9a-f]+)"\}')
+_ICON_NAME = re.compile(r'\bfa-[a-z0-9-]+')
+_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_CSS_TOKENS = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*!.*?\*/|/\*.*?\*/', re.S)
+_FONT_FILE = re.compile(r'^([a-z0-9]+)-(\d{3})(-italic)?\.woff2$')
+
+
+# --- CSS ---
+def minify_css(css):
+    """去除註解（保留 /*! 授權聲明）與多餘空白，字串內容不變"""
+    kept = []
+
+    def protect(match):
+        token = match.group()
+        if token.startswith('/*') and not token.startswith('/*!'):
+            return ' '
+        kept.append(token + '\n' if token.startswith('/*!') else token)
+        return f'\x00{len(kept) - 1}\x00'
+
+    text = re.sub(r'\s+', ' ', _CSS_TOKENS.sub(protect, css))
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    # 冒號前的空白在選擇器中有意義（div :first-child），只移除冒號後的空白
+    text = re.sub(r':\s+', ':', text).replace(';}', '}')
+    return re.sub(r'\x00(\d+)\x00', lambda match: kept[int(match.group(1))], text).strip()
+
+
+def used_icons(paths=None):
+    """樣板與打包的 JS 中出現的 fa-* 類別名稱"""
+    if paths is None:
+        paths = [os.path.join(root, name)
+                 for root, _, names in os.walk(TEMPLATE_DIR) for name in names if name.endswith('.html')]
+        paths += [os.path.join(STATIC_DIR, source) for source in BUNDLES['app.js']]
+    names = set()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            names.update(name[3:] for name in _ICON_NAME.findall(f.read()))
+    return names
+
+
+def subset_icon_rules(css, icons):
+    """移除未使用圖示的 .fa-x:before 規則，回傳 (css, 保留圖示的 codepoint)"""
+    codepoints = set()
+
+    def keep(match):
+        if match.group(1) in icons:
+            codepoints.add(int(match.group(2), 16))
+            return match.group()
+        return ''
+    return _ICON_RULE.sub(keep, css), codepoints
+
+
+def _modern_font_sources(css):
+    """@font-face 只保留 woff2 / woff（eot、ttf、svg 是給舊瀏覽器的備援）"""
+    def replace(match):
+        base = match.group(1)
+        return f'src:url({base}.woff2) format("woff2"),url({base}.woff) format("woff")'
+    return re.sub(r'src:url\(([^)]+?)\.eot\);src:[^}]*', replace, css)
+
+
+class MissingFonts(Exception):
+    """static/fonts 缺少 REQUIRED_FONTS 中的字型檔"""
+
+    def __init__(self, missing):
+        super().__init__(f"static/fonts 缺少字型檔：{', '.join(missing)}")
+        self.missing = missing
+
+
+def missing_fonts():
+    """REQUIRED_FONTS 中不在 static/fonts 的檔名"""
+    present = set(os.listdir(FONT_DIR)) if os.path.isdir(FONT_DIR) else set()
+    return [name for name in REQUIRED_FONTS if name not in present]
+
+
+def self_hosted_fonts_css():
+    """static/fonts 中的 woff2 產生 @font-face（檔名格式 <字型>-<字重>[-italic].woff2）"""
+    if not os.path.isdir(FONT_DIR):
+        return ''
+    rules = []
+    for name in sorted(os.listdir(FONT_DIR)):
+        match = _FONT_FILE.match(name)
+        if not match:
+            continue
+        family, weight, italic = match.groups()
+        rules.append(
+            f'@font-face{{font-family:"{family.capitalize()}";font-style:{"italic" if italic else "normal"};'
+            f'font-weight:{weight};font-display:swap;src:url(../fonts/{name}) format("woff2")}}'
+        )
+    return ''.join(rules)
+
+
+# --- 輸出 ---
+class _Build:
+    """一次打包的輸出：寫入 DIST_DIR 並記錄 邏輯名稱 -> 雜湊檔名"""
+
+    def __init__(self, font_codepoints=None):
+        self.manifest = {}
+        self.written = set()
+        self.font_codepoints = font_codepoints
+
+    def emit(self, name, data):
+        stem, ext = os.path.splitext(os.path.basename(name))
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        hashed = f'{stem}.{digest}{ext}'
+        path = os.path.join(DIST_DIR, hashed)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.written.add(hashed)
+        if ext in COMPRESSIBLE:
+            # mtime=0 讓相同內容的 .gz 每次打包都一樣
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            self.written.add(hashed + '.gz')
+            if brotli is not None:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+                self.written.add(hashed + '.br')
+        self.manifest[name] = hashed
+        return hashed
+
+    def emit_file(self, source_path):
+        """CSS 引用的檔案（字型、圖片），回傳輸出的檔名"""
+        relative = os.path.relpath(source_path, STATIC_DIR).replace(os.sep, '/')
+        if relative in self.manifest:
+            return self.manifest[relative]
+        with open(source_path, 'rb') as f:
+            data = f.read()
+        if self.font_codepoints and 'fontawesome-free/webfonts/' in relative:
+            data = _subset_font(data, self.font_codepoints, os.path.splitext(source_path)[1])
+        return self.emit(relative, data)
+
+    def rewrite_urls(self, css, source):
+        """CSS 中的相對網址改為輸出的雜湊檔名（所有輸出都在同一個目錄）"""
+        base = os.path.dirname(os.path.join(STATIC_DIR, source))
+
+        def replace(match):
+            url = match.group(2)
+            if url.startswith(('data:', 'http:', 'https:', '//', '#')):
+                return match.group()
+            path = os.path.normpath(os.path.join(base, re.split(r'[?#]', url)[0]))
+            if not os.path.isfile(path):
+                return match.group()
+            return f'url({self.emit_file(path)})'
+        return _URL.sub(replace, css)
+
+
+def _subset_font(data, codepoints, ext):
+    """以 fontTools 只保留用到的字符；未安裝或失敗時回傳原檔"""
+    try:
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        return data
+    try:
+        font = TTFont(io.BytesIO(data))
+        options = subset.Options()
+        options.flavor = {'.woff2': 'woff2', '.woff': 'woff'}.get(ext)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        output = io.BytesIO()
+        font.flavor = options.flavor
+        font.save(output)
+        return output.getvalue()
+    except Exception:
+        return data
+
+
+def _read(source):
+    with open(os.path.join(STATIC_DIR, source), encoding='utf-8') as f:
+        return f.read()
+
+
+def build_assets(clean=False, echo=print):
+    """打包所有 BUNDLES，寫入 manifest，回傳 manifest
+
+    clean=False 時保留舊的雜湊檔案，滾動部署期間舊版頁面引用的檔案仍然存在；
+    static/fonts 缺少 REQUIRED_FONTS 時拋出 MissingFonts
+    """
+    missing = missing_fonts()
+    if missing:
+        raise MissingFonts(missing)
+    os.makedirs(DIST_DIR, exist_ok=True)
+    icons = used_icons()
+    fa_css, codepoints = subset_icon_rules(_read(FONT_AWESOME_CSS), icons)
+    build = _Build(font_codepoints=codepoints)
+
+    css_parts = []
+    fonts = self_hosted_fonts_css()
+    if fonts:
+        css_parts.append(build.rewrite_urls(fonts, 'fonts/fonts.css'))
+    for source in BUNDLES['app.css']:
+        css = fa_css if source == FONT_AWESOME_CSS else _read(source)
+        if source == FONT_AWESOME_SOLID:
+            css = _modern_font_sources(css)
+        css_parts.append(build.rewrite_urls(minify_css(css), source))
+    build.emit('app.css', '\n'.join(css_parts).encode('utf-8'))
+
+    js_parts = []
+    for source in BUNDLES['app.js']:
+        # 原始檔已是 .min.js；source map 沒有一起輸出，移除其引用
+        js = re.sub(r'^//# sourceMappingURL=.*$', '', _read(source), flags=re.M)
+        js_parts.append(js.strip())
+    build.emit('app.js', '\n;\n'.join(js_parts).encode('utf-8'))
+
+    with open(os.path.join(DIST_DIR, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(build.manifest, f, indent=2, sort_keys=True)
+
+    if clean:
+        for name in os.listdir(DIST_DIR):
+            if name != MANIFEST and name not in build.written:
+                os.remove(os.path.join(DIST_DIR, name))
+
+    echo(f'圖示 {len(codepoints)} 個，自架字型 {fonts.count("@font-face")} 個'
+         + ('' if brotli else '（未安裝 brotli，只產生 gzip）'))
+    for name in BUNDLES:
+        path = os.path.join(DIST_DIR, build.manifest[name])
+        echo(f'{name} -> {build.manifest[name]}：{os.path.getsize(path)} bytes，'
+             f'gzip {os.path.getsize(path + ".gz")} bytes')
+    return build.manifest
+
+
+def load_manifest():
+    """讀取打包的 manifest，尚未打包時回傳 None"""
+    try:
+        with open(os.path.join(DIST_DIR, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# --- 服務 ---
+def asset_urls(bundle):
+    """樣板用：打包後為單一雜湊網址，未打包時為各原始檔"""
+    manifest = current_app.extensions.get('assets')
+    if manifest and bundle in manifest:
+        return [url_for('asset', filename=manifest[bundle])]
+    return [url_for('static', filename=source) for source in BUNDLES[bundle]]
+
+
+def serve_asset(filename):
+    """雜湊檔名的資源：一年 immutable 快取，有預先壓縮的版本時依 Accept-Encoding 回傳"""
+    path = safe_join(DIST_DIR, filename)
+    if path is None or filename == MANIFEST or not os.path.isfile(path):
+        abort(404)
+    mimetype = MIMETYPES.get(os.path.splitext(filename)[1]) or mimetypes.guess_type(filename)[0]
+
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in request.accept_encodings and os.path.isfile(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+
+    response = send_file(path, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    """載入 manifest（ASSETS_BUNDLED=0 時不使用打包檔案）並註冊 /assets 與樣板函式"""
+    if str(app.config.get('ASSETS_BUNDLED', '1')).lower() not in ('0', 'false', 'no'):
+        app.extensions['assets'] = load_manifest()
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.jinja_env.globals['asset_urls'] = asset_urls
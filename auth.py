@@ -0,0 +1,159 @@
+"""
+登入驗證與授權
+- authenticate：先檢查嘗試次數，再把密碼驗證交給 passwords 的執行緒池；雜湊參數過時則在登入成功時重新雜湊
+- current_identity：每個請求最多解析一次登入身分。角色取自已簽章的 session，
+  並比對 users.auth_version（經快取）：角色變更或撤銷登入時遞增版本，舊 session 即失效
+- 權限檢查（is_admin、admin_or_group_leader …）以宣告方式套用在路由上，不需每次查詢用戶
+"""
+
+from collections import namedtuple
+from functools import wraps
+
+from flask import abort, g, session
+from sqlalchemy import select, update
+
+import cache
+import passwords
+from models import db, GroupBuying, User
+
+
+# auth_version 快取秒數：使用程序內快取時，其他 worker 最晚在此時間後看到撤銷
+AUTH_VERSION_TTL = 30
+
+
+class LoginThrottled(Exception):
+    """同一帳號嘗試次數過多"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+def authenticate(username, password):
+    """驗證帳號密碼，成功回傳 User，失敗回傳 None
+
+    嘗試過多時拋出 LoginThrottled，雜湊執行緒池已滿時拋出 passwords.PasswordPoolBusy
+    """
+    username = username or ''
+    limiter = passwords.get_limiter()
+    if not limiter.allow(username):
+        raise LoginThrottled(limiter.retry_after(username))
+
+    user = User.query.filter_by(username=username).first()
+    if user is None or not passwords.verify_password_offloaded(user.password_hash, password or ''):
+        limiter.record_failure(username)
+        return None
+
+    limiter.reset(username)
+    if passwords.needs_rehash(user.password_hash):
+        user.password_hash = passwords.hash_password_offloaded(password)
+        db.session.commit()
+    return user
+
+
+def login_user(user):
+    """把登入的用戶與 auth_version 寫入 session"""
+    session['user_id'] = user.id
+    session['username'] = user.username
+    session['name'] = user.name
+    session['role'] = user.role
+    session['auth_version'] = user.auth_version or 0
+    g.pop('identity', None)
+
+
+# --- 身分 ---
+class Identity(namedtuple('Identity', 'user_id role name')):
+    """目前請求的登入身分（取自 session，不查詢資料庫）"""
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+
+def _auth_version_key(user_id):
+    return f'auth_version:{user_id}'
+
+
+def auth_version(user_id):
+    """用戶目前的 auth_version（用戶不存在時為 None）"""
+    return cache.get_or_set(
+        _auth_version_key(user_id),
+        lambda: db.session.execute(select(User.auth_version).where(User.id == user_id)).scalar(),
+        ttl=AUTH_VERSION_TTL
+    )
+
+
+def revoke_sessions(user_id):
+    """遞增 auth_version，讓該用戶所有既有的 session 失效（角色變更、停權時呼叫）"""
+    db.session.execute(
+        update(User).where(User.id == user_id).values(auth_version=User.auth_version + 1)
+    )
+    db.session.commit()
+    cache.get_backend().delete(_auth_version_key(user_id))
+
+
+def current_identity():
+    """目前請求的 Identity，未登入或 session 已被撤銷時回傳 None（每個請求只解析一次）"""
+    if 'identity' in g:
+        return g.identity
+
+    identity = None
+    user_id = session.get('user_id')
+    if user_id is not None:
+        if session.get('auth_version', 0) == auth_version(user_id):
+            identity = Identity(user_id, session.get('role'), session.get('name'))
+        else:
+            session.clear()
+    g.identity = identity
+    return identity
+
+
+def current_user():
+    """目前登入的 User（需要完整資料時才查詢，每個請求最多一次）"""
+    if 'user' not in g:
+        identity = current_identity()
+        g.user = db.session.get(User, identity.user_id) if identity else None
+    return g.user
+
+
+# --- 權限 ---
+# 權限為 (identity, view_args) -> bool 的函式，view_args 為路由參數
+def is_admin(identity, view_args):
+    return identity.is_admin
+
+
+def is_group_leader(identity, view_args):
+    """路由參數 group_id 的團長（團購不存在時回傳 404）
+
+    團購會載入到 session 的 identity map，路由再以 get_or_404 讀取時不會重複查詢
+    （identity map 是弱參照，因此在 g 保留一份參照直到請求結束）
+    """
+    group = db.session.get(GroupBuying, view_args['group_id'])
+    if group is None:
+        abort(404)
+    g.setdefault('authorized_groups', []).append(group)
+    return group.leader_id == identity.user_id
+
+
+def any_of(*permissions):
+    def permission(identity, view_args):
+        return any(check(identity, view_args) for check in permissions)
+    return permission
+
+
+admin_or_group_leader = any_of(is_admin, is_group_leader)
+
+
+def requires(permission, unauthenticated, forbidden):
+    """裝飾器工廠：未登入時回傳 unauthenticated()，權限不足時回傳 forbidden()"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            identity = current_identity()
+            if identity is None:
+                return unauthenticated()
+            if permission is not None and not permission(identity, kwargs):
+                return forbidden()
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -0,0 +1,538 @@
+"""
+基準測試
+- API 延遲：以 Flask test client 對目前設定的資料庫重複請求各端點，計算 p50 / p99 並與目標比較
+  （不經過網路與 WSGI 伺服器，量到的是應用程式本身的處理時間）
+- 登入吞吐量：不同雜湊執行緒池大小下每秒可驗證的密碼數
+- HTTP 吞吐量：對實際執行中的伺服器（例如 gunicorn）以不同併發數送出請求
+- 冷啟動：以全新的程序匯入應用程式並送出第一個請求，比較有無預熱（warmup.py）的首個請求延遲
+- 路由基準測試：以批次 INSERT 產生指定規模的合成資料，逐一量測 app.py 各路由的吞吐量、
+  延遲百分位數與每個請求的查詢數，並與儲存的基準線比較（會寫入資料，請使用專用資料庫）
+"""
+
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from sqlalchemy import event, func, insert, select, text
+
+import passwords
+from models import db, User, Product, GroupBuying, Order
+
+
+# 端點 -> (p50, p99) 目標，單位毫秒
+API_LATENCY_TARGETS = {
+    '/api/v1/groups': (25, 100),
+    '/api/v1/groups?fields=id,name,progress_percentage': (20, 80),
+    '/api/v1/groups/{group_id}': (10, 50),
+    '/api/v1/products': (5, 30),
+    '/api/v1/orders': (25, 100),  # 需要登入
+    '/api/v1/products/typeahead?q=' + quote('咖啡豆'): (10, 20),
+    '/api/v1/products/typeahead?q=' + quote('有機 綠茶'): (10, 20),
+    '/api/v1/products/typeahead?q=' + quote('綠茶'): (10, 20),  # 少於三個字，走名稱前綴
+}
+
+# 合成商品名稱的組成詞（讓搜尋的命中數接近真實目錄，而不是每個商品都相同）
+SEED_ADJECTIVES = ('有機', '冷壓', '手工', '日本', '台灣', '進口', '限定', '經典', '特級', '家庭號')
+SEED_ITEMS = ('咖啡豆', '綠茶', '蘋果汁', '牛肉麵', '巧克力', '洗髮精', '藍牙耳機', '行動電源',
+              '保溫瓶', '筆記本', '橄欖油', '衛生紙', '洗衣球', '燕麥片', '氣泡水', '蛋捲',
+              '面膜', '運動襪', '鳳梨酥', '烏龍茶')
+
+# 合成資料用戶的密碼與管理員帳號
+BENCH_PASSWORD = 'benchmark-password'
+BENCH_ADMIN = 'bench_admin'
+
+
+def percentile(samples, pct):
+    """最近秩法百分位數"""
+    ordered = sorted(samples)
+    index = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def _open(client, *args, **kwargs):
+    """在獨立的 app context 中送出請求
+
+    CLI 指令執行時已有 app context，test client 的請求會沿用它，g 與 db.session 在請求之間
+    共用（identity map 留著上一個請求載入的資料），量到的查詢數與延遲會偏低
+    """
+    with client.application.app_context():
+        return client.open(*args, **kwargs)
+
+
+def measure(client, path, requests=200, warmup=10, headers=None):
+    """回傳 (p50, p99, 狀態碼) 毫秒；先送 warmup 次讓快取就緒"""
+    for _ in range(warmup):
+        _open(client, path, headers=headers)
+
+    samples = []
+    status = None
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = _open(client, path, headers=headers)
+        samples.append((time.perf_counter() - started) * 1000)
+        status = response.status_code
+    return percentile(samples, 50), percentile(samples, 99), status
+
+
+def run_api_benchmark(app, requests=200, credentials=None, targets=None):
+    """執行 API 基準測試，回傳 [(path, p50, p99, 目標, 是否達標)]
+
+    credentials 為 (username, password) 時會先登入，否則略過需要登入的端點
+    """
+    targets = targets or API_LATENCY_TARGETS
+    client = app.test_client()
+    headers = {'Accept-Encoding': 'gzip'}
+
+    if credentials:
+        username, password = credentials
+        response = _open(client, '/api/v1/login', method='POST', json={'username': username, 'password': password})
+        if response.status_code != 200:
+            raise RuntimeError('基準測試登入失敗')
+
+    first = _open(client, '/api/v1/groups?fields=id&limit=1').get_json()['data']
+    group_id = first[0]['id'] if first else None
+
+    results = []
+    for template, target in targets.items():
+        if '{group_id}' in template and group_id is None:
+            continue
+        if template.startswith('/api/v1/orders') and not credentials:
+            continue
+        path = template.format(group_id=group_id)
+        p50, p99, status = measure(client, path, requests, headers=headers)
+        ok = status == 200 and p50 <= target[0] and p99 <= target[1]
+        results.append((path, p50, p99, target, ok))
+    return results
+
+
+def run_login_benchmark(worker_counts, logins=200, concurrency=16, password=BENCH_PASSWORD):
+    """回傳 [(執行緒數, 每秒登入數, 忙碌拒絕次數)]；concurrency 個請求同時驗證，模擬登入尖峰"""
+    password_hash = passwords.hash_password(password)
+    results = []
+    for workers in worker_counts:
+        pool = passwords.HashPool(workers=workers, max_pending=concurrency)
+        rejected = 0
+        lock = threading.Lock()
+
+        def login(_):
+            nonlocal rejected
+            try:
+                pool.run(passwords.verify_password, password_hash, password)
+            except passwords.PasswordPoolBusy:
+                with lock:
+                    rejected += 1
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as clients:
+                list(clients.map(login, range(logins)))
+            elapsed = time.perf_counter() - started
+        finally:
+            pool.shutdown()
+        results.append((workers, (logins - rejected) / elapsed, rejected))
+    return results
+
+
+def run_http_load(url, concurrency, requests=500, timeout=10):
+    """以 concurrency 個連線對 url 送出 requests 次 GET，回傳 (每秒請求數, p50, p99, 錯誤數)"""
+    import urllib.request  # 只有 http-bench 使用，不在 worker 啟動時載入
+    samples = []
+    errors = 0
+    lock = threading.Lock()
+
+    def fetch(_):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read()
+        except OSError:
+            with lock:
+                errors += 1
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            samples.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        list(clients.map(fetch, range(requests)))
+    elapsed = time.perf_counter() - started
+    if not samples:
+        return 0.0, 0.0, 0.0, errors
+    return len(samples) / elapsed, percentile(samples, 50), percentile(samples, 99), errors
+
+
+# --- 冷啟動 ---
+ColdStart = namedtuple('ColdStart', 'import_ms warmup_ms first_request_ms total_ms status')
+
+_COLD_START_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+if sys.argv[2] == '1':
+    import warmup
+    warmup.warm(app.app)
+warmed = time.perf_counter()
+status = app.app.test_client().get(sys.argv[1]).status_code
+done = time.perf_counter()
+print(json.dumps([imported - started, warmed - imported, done - warmed, done - started, status]))
+'''
+
+
+def measure_cold_start(path='/browse', runs=5, warm=False):
+    """以全新的 Python 程序匯入 app 並送出第一個請求，回傳各階段（毫秒）取中位數的 ColdStart
+
+    warm=True 時先執行 warmup.warm()（gunicorn 在 worker 接受請求前的流程），first_request_ms
+    即為新 worker 第一個使用者感受到的延遲；樣板 bytecode cache 在各次執行之間共用
+    """
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', _COLD_START_SCRIPT, path, '1' if warm else '0'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    phases = [percentile([result[i] * 1000 for result in results], 50) for i in range(4)]
+    return ColdStart(*phases, status=results[-1][4])
+
+
+# --- 合成資料 ---
+def _bulk_insert(table, rows, batch_size):
+    """以 executemany 分批寫入（每批一個交易），不經過 ORM flush，回傳筆數"""
+    total = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return total
+        with db.engine.begin() as conn:
+            conn.execute(insert(table), batch)
+        total += len(batch)
+
+
+def _sync_sequence(table):
+    """明確指定 id 寫入後，PostgreSQL 的序列不會前進；調整到目前最大值，避免之後的 INSERT 衝突"""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {table.name}))"
+            ))
+
+
+def _next_id(model):
+    return (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def seed_product_name(product_id):
+    adjective = SEED_ADJECTIVES[product_id % len(SEED_ADJECTIVES)]
+    item = SEED_ITEMS[product_id // len(SEED_ADJECTIVES) % len(SEED_ITEMS)]
+    return f'{adjective}{item} {product_id}'
+
+
+def seed_dataset(products=1000, groups=10000, orders=100000, users=1000, batch_size=5000, echo=print, now=None):
+    """產生合成資料，回傳各表新增筆數
+
+    - 用戶：bench_user_<id>，前 10% 為團長，另有管理員 BENCH_ADMIN；密碼皆為 BENCH_PASSWORD（只雜湊一次）
+    - 團購：每 10 筆有 1 筆已截止成團，其餘進行中且仍有名額
+    - 訂單：依序輪流分配到各團購與用戶，團購的 current_quantity 直接寫入一致的值，不需對帳；
+      訂單時間都晚於所屬團購的建立時間（詳情頁以開團時間作為訂單查詢的下限）
+    """
+    now = now or datetime.utcnow()
+    users, products, groups = max(users, 1), max(products, 1), max(groups, 1)
+    user_base, product_base = _next_id(User), _next_id(Product)
+    group_base, order_base = _next_id(GroupBuying), _next_id(Order)
+    leaders = max(users // 10, 1)
+    password_hash = passwords.hash_password(BENCH_PASSWORD)
+
+    def price(g):
+        return 10.0 + (g % products) % 100
+
+    def joined(g):
+        return orders // groups + (1 if g < orders % groups else 0)
+
+    counts = {}
+    if db.session.execute(select(User.id).where(User.username == BENCH_ADMIN)).first() is None:
+        db.session.add(User(username=BENCH_ADMIN, email=f'{BENCH_ADMIN}@example.com', name='測試管理員',
+                            password_hash=password_hash, role='admin'))
+        db.session.commit()
+        user_base = _next_id(User)
+    echo(f'用戶 {users} 筆')
+    counts['users'] = _bulk_insert(User.__table__, (
+        {'id': user_base + i, 'username': f'bench_user_{user_base + i}',
+         'email': f'bench_user_{user_base + i}@example.com', 'name': f'測試用戶 {user_base + i}',
+         'password_hash': password_hash, 'role': 'leader' if i < leaders else 'member',
+         'auth_version': 0, 'created_at': now}
+        for i in range(users)
+    ), batch_size)
+
+    echo(f'商品 {products} 筆')
+    counts['products'] = _bulk_insert(Product.__table__, (
+        {'id': product_base + i, 'name': seed_product_name(product_base + i), 'price': price(i),
+         'stock_quantity': 1000, 'description': '基準測試用商品', 'created_at': now}
+        for i in range(products)
+    ), batch_size)
+
+    echo(f'團購 {groups} 筆')
+    counts['groups'] = _bulk_insert(GroupBuying.__table__, (
+        {'id': group_base + g, 'name': f'測試團購 {group_base + g}', 'description': '基準測試用團購',
+         'product_id': product_base + g % products, 'leader_id': user_base + g % leaders,
+         'current_quantity': joined(g),
+         'target_quantity': joined(g) if g % 10 == 0 else joined(g) + 1000,
+         'status': 'SUCCESS' if g % 10 == 0 else 'ACTIVE',
+         'deadline': now - timedelta(days=1) if g % 10 == 0 else now + timedelta(days=7),
+         'created_at': now - timedelta(seconds=orders + groups - g),
+         'updated_at': now - timedelta(seconds=orders + groups - g)}
+        for g in range(groups)
+    ), batch_size)
+
+    echo(f'訂單 {orders} 筆')
+    counts['orders'] = _bulk_insert(Order.__table__, (
+        {'id': order_base + i, 'user_id': user_base + i % users, 'group_buying_id': group_base + i % groups,
+         'quantity': 1, 'total_price': price(i % groups), 'payment_status': 'PENDING',
+         'created_at': now - timedelta(seconds=orders - i)}
+        for i in range(orders)
+    ), batch_size)
+
+    for model in (User, Product, GroupBuying, Order):
+        _sync_sequence(model.__table__)
+    return counts
+
+
+def dataset_scale():
+    """目前資料庫各表筆數（記錄在基準線中，規模不同的結果不能直接比較）"""
+    return {
+        name: db.session.execute(select(func.count()).select_from(model)).scalar()
+        for name, model in (('users', User), ('products', Product), ('groups', GroupBuying), ('orders', Order))
+    }
+
+
+# --- 路由基準測試 ---
+# 路由 -> (預期狀態碼, 預期重新導向位置)
+ROUTE_EXPECTATIONS = {
+    'register': (302, '/login'),
+    'login': (302, '/browse'),
+    'browse': (200, None),
+    'group_detail': (200, None),
+    'join': (302, '/my-orders'),
+    'my_orders': (200, None),
+    'admin': (200, None),
+    'close': (302, '/admin'),
+    'delete': (302, '/admin'),
+}
+
+# concurrency：同時送出請求的 client 數
+RouteResult = namedtuple('RouteResult', 'route requests rps p50 p95 p99 queries errors concurrency')
+
+
+def _login(client, username, password=BENCH_PASSWORD):
+    response = _open(client, '/login', method='POST', data={'username': username, 'password': password})
+    if response.status_code != 302:
+        raise RuntimeError(f'基準測試無法以 {username} 登入')
+    return client
+
+
+def _route_fixture(app, routes, count):
+    """準備各路由使用的 client 與團購編號：close / delete 每次請求用掉一個進行中的團購"""
+    with app.app_context():
+        member = db.session.execute(
+            select(User.username).where(User.username.like('bench_user_%'), User.role == 'member')
+            .order_by(User.id).limit(1)
+        ).scalar()
+        admin = db.session.execute(select(User.username).where(User.username == BENCH_ADMIN)).scalar()
+        active = db.session.execute(
+            select(GroupBuying.id).where(GroupBuying.status == 'ACTIVE', GroupBuying.deadline > datetime.utcnow())
+            .order_by(GroupBuying.id)
+        ).scalars().all()
+
+    consumed = sum(count for route in ('close', 'delete') if route in routes)
+    if member is None or admin is None or len(active) < consumed + 1:
+        raise RuntimeError('資料不足，請先執行 flask --app app bench-seed')
+
+    hot = active[:max(min(50, len(active) - consumed), 1)]
+    victims = iter(active[len(active) - consumed:])
+    return {
+        'anonymous': app.test_client(),
+        'member': _login(app.test_client(), member),
+        'admin': _login(app.test_client(), admin),
+        'member_name': member,
+        'hot': hot,
+        'victims': victims,
+        'token': uuid.uuid4().hex[:8],
+    }
+
+
+def _route_request(fixture, route, i):
+    """回傳 (client, method, path, form)"""
+    group_id = fixture['hot'][i % len(fixture['hot'])]
+    if route == 'register':
+        name = f"bench_reg_{fixture['token']}_{i}"
+        return fixture['anonymous'], 'POST', '/register', {
+            'username': name, 'email': f'{name}@example.com', 'password': BENCH_PASSWORD, 'name': name}
+    if route == 'login':
+        return fixture['anonymous'], 'POST', '/login', {
+            'username': fixture['member_name'], 'password': BENCH_PASSWORD}
+    if route == 'browse':
+        return fixture['anonymous'], 'GET', '/browse', None
+    if route == 'group_detail':
+        return fixture['anonymous'], 'GET', f'/group/{group_id}', None
+    if route == 'join':
+        return fixture['member'], 'POST', f'/join_group/{group_id}', {
+            'quantity': '1', 'idempotency_key': uuid.uuid4().hex}
+    if route == 'my_orders':
+        return fixture['member'], 'GET', '/my-orders', None
+    if route == 'admin':
+        return fixture['admin'], 'GET', '/admin', None
+    if route == 'close':
+        return fixture['admin'], 'POST', f"/admin/close_group/{next(fixture['victims'])}", None
+    if route == 'delete':
+        return fixture['admin'], 'POST', f"/admin/delete_group/{next(fixture['victims'])}", None
+    raise ValueError(f'未知的路由 {route}')
+
+
+def _client_fixture(app, fixture):
+    """fixture 的副本，換成各自登入的 client（併發量測時每個執行緒一組，session cookie 不互相干擾）
+
+    團購編號共用：victims 是 list iterator，多個執行緒呼叫 next() 也不會拿到同一個團購
+    """
+    return dict(fixture, anonymous=app.test_client(), member=_login(app.test_client(), fixture['member_name']),
+                admin=_login(app.test_client(), BENCH_ADMIN))
+
+
+def _send_route_request(fixture, route, i):
+    """送出第 i 個請求，回傳 (延遲毫秒, 是否為預期的回應)"""
+    expected_status, expected_location = ROUTE_EXPECTATIONS[route]
+    client, method, path, form = _route_request(fixture, route, i)
+    request_started = time.perf_counter()
+    response = _open(client, path, method=method, data=form)
+    elapsed = (time.perf_counter() - request_started) * 1000
+    if method == 'POST':
+        # 重新導向後沒有頁面消耗 flash 訊息，清掉避免 session cookie 越來越大
+        with client.session_transaction() as session:
+            session.pop('_flashes', None)
+    ok = response.status_code == expected_status and (
+        not expected_location or response.location.endswith(expected_location))
+    return elapsed, ok
+
+
+def run_route_benchmark(app, routes=None, requests=100, warmup=5, concurrency=1):
+    """量測各路由，回傳 [RouteResult]；延遲為毫秒，queries 為每個請求的平均查詢數
+
+    以 Flask test client 在程序內送出請求（不含網路與 WSGI 伺服器），close / delete 的暖身
+    也會用掉團購，因此每個路由需要 requests + warmup 個進行中的團購。
+    concurrency > 1 時以同樣數量的執行緒（各自登入的 client）同時送出請求，量測負載下的延遲與吞吐量
+    """
+    routes = list(routes or ROUTE_EXPECTATIONS)
+    fixture = _route_fixture(app, routes, requests + warmup)
+    fixtures = [fixture] + [_client_fixture(app, fixture) for _ in range(concurrency - 1)]
+
+    statements = [0]
+    statements_lock = threading.Lock()
+
+    def count_statement(*args):
+        with statements_lock:
+            statements[0] += 1
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+    def client_loop(worker_fixture, route, indices):
+        return [_send_route_request(worker_fixture, route, i) for i in indices]
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='route-bench') as pool:
+            for route in routes:
+                for i in range(warmup):
+                    _send_route_request(fixture, route, i)
+
+                before = statements[0]
+                started = time.perf_counter()
+                # 第 w 個 client 負責第 warmup + w、warmup + w + concurrency … 個請求
+                futures = [
+                    pool.submit(client_loop, worker_fixture, route, range(warmup + w, warmup + requests, concurrency))
+                    for w, worker_fixture in enumerate(fixtures)
+                ]
+                outcomes = [outcome for future in futures for outcome in future.result()]
+                total = time.perf_counter() - started
+
+                samples = [elapsed for elapsed, _ in outcomes]
+                errors = sum(1 for _, ok in outcomes if not ok)
+                results.append(RouteResult(
+                    route, requests, requests / total,
+                    percentile(samples, 50), percentile(samples, 95), percentile(samples, 99),
+                    (statements[0] - before) / requests, errors, concurrency
+                ))
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', count_statement)
+    return results
+
+
+# --- 基準線 ---
+def save_baseline(path, results, scale, dialect):
+    """把結果寫成 JSON 基準線"""
+    baseline = {
+        'recorded_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'database': dialect,
+        'scale': scale,
+        'concurrency': results[0].concurrency if results else 1,
+        'routes': {
+            result.route: {
+                'rps': round(result.rps, 1), 'p50': round(result.p50, 2), 'p95': round(result.p95, 2),
+                'p99': round(result.p99, 2), 'queries': round(result.queries, 2),
+            }
+            for result in results
+        },
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    return baseline
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_delta_ms=2.0, query_margin=0.5):
+    """回傳退步項目的說明列表（空列表表示沒有退步）
+
+    - 查詢數：與硬體無關，超過基準線 query_margin 以上即視為退步
+    - p50 / p95：超過基準線 (1 + tolerance) 倍且至少慢 min_delta_ms 毫秒
+    - 吞吐量：低於基準線 (1 - tolerance) 倍
+    - 任何非預期的回應
+    基準線中沒有的路由不比較；併發數與基準線不同時只比較查詢數與回應
+    """
+    regressions = []
+    for result in results:
+        base = baseline['routes'].get(result.route)
+        if result.errors:
+            regressions.append(f'{result.route}: {result.errors} 個非預期的回應')
+        if base is None:
+            continue
+        if result.queries > base['queries'] + query_margin:
+            regressions.append(f"{result.route}: 查詢數 {result.queries:.1f}（基準線 {base['queries']}）")
+        if result.concurrency != baseline.get('concurrency', 1):
+            continue
+        for name in ('p50', 'p95'):
+            value = getattr(result, name)
+            if value > base[name] * (1 + tolerance) and value - base[name] >= min_delta_ms:
+                regressions.append(f'{result.route}: {name} {value:.1f}ms（基準線 {base[name]}ms）')
+        if result.rps < base['rps'] * (1 - tolerance):
+            regressions.append(f"{result.route}: 吞吐量 {result.rps:.1f} req/s（基準線 {base['rps']}）")
+    return regressions
@@ -0,0 +1,180 @@
+"""
+應用層讀取快取
+快取團購卡片，並在寫入路徑上精準失效
+後端可選 in-process LRU（預設）或 Redis 相容的伺服器（CACHE_URL=redis://...）
+每個應用程式的後端由 init_app() 建立並存在 app.extensions['cache']
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+try:
+    import redis
+except ImportError:  # Redis 後端為選用
+    redis = None
+
+
+DEFAULT_TTL = 300  # 秒
+
+cache_metrics = {
+    'hits': 0,
+    'misses': 0,
+}
+
+
+def hit_ratio():
+    """命中率（尚無請求時為 0）"""
+    total = cache_metrics['hits'] + cache_metrics['misses']
+    return cache_metrics['hits'] / total if total else 0.0
+
+
+# --- 後端 ---
+class MemoryCache:
+    """程序內 LRU + TTL 快取"""
+
+    def __init__(self, maxsize=10000, default_ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                item = self._data.get(key)
+                if item is None:
+                    continue
+                expires, value = item
+                if expires <= now:
+                    del self._data[key]
+                    continue
+                self._data.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, mapping, ttl=None):
+        now = time.monotonic()
+        expires = now + (ttl or self.default_ttl)
+        with self._lock:
+            for key, value in mapping.items():
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            # 超過上限時淘汰最久未使用的項目，最久未使用端已過期的項目也一併移除
+            while self._data:
+                oldest_expires, _ = next(iter(self._data.values()))
+                if len(self._data) <= self.maxsize and oldest_expires > now:
+                    break
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    """Redis 相容後端；client 只需提供 mget / set / delete / scan_iter（可用 fakeredis 等替代）"""
+
+    def __init__(self, client, prefix='groupbuy:', default_ttl=DEFAULT_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self.prefix + key for key in keys])
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping, ttl=None):
+        for key, value in mapping.items():
+            self.client.set(self.prefix + key, json.dumps(value), ex=ttl or self.default_ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_backend(url=None):
+    """依 CACHE_URL 建立後端：memory://（預設）或 redis://host:port/db"""
+    if not url or url.startswith('memory://'):
+        return MemoryCache()
+    if url.startswith(('redis://', 'rediss://')):
+        if redis is None:
+            raise RuntimeError('使用 Redis 快取需要安裝 redis 套件')
+        return RedisCache(redis.Redis.from_url(url))
+    raise ValueError(f'不支援的 CACHE_URL: {url}')
+
+
+# 沒有 app context 時（腳本）使用的後端
+_default_backend = MemoryCache()
+
+
+def init_app(app, client=None):
+    """依 CACHE_URL 建立應用程式的快取後端；傳入 client 時直接包裝成 RedisCache"""
+    app.extensions['cache'] = RedisCache(client) if client is not None else create_backend(app.config.get('CACHE_URL'))
+    return app.extensions['cache']
+
+
+def get_backend():
+    """目前應用程式的快取後端"""
+    if has_app_context():
+        return current_app.extensions.get('cache', _default_backend)
+    return _default_backend
+
+
+# --- 讀取 ---
+def get_many(keys, loader, ttl=None, is_fresh=None):
+    """批次讀取；未命中（或 is_fresh(key, value) 為 False）的 key 交給 loader(missing_keys) -> {key: value} 載入並寫回"""
+    keys = list(keys)
+    backend = get_backend()
+    found = backend.get_many(keys)
+    if is_fresh is not None:
+        found = {key: value for key, value in found.items() if is_fresh(key, value)}
+    missing = [key for key in keys if key not in found]
+
+    cache_metrics['hits'] += len(found)
+    cache_metrics['misses'] += len(missing)
+
+    if missing:
+        loaded = loader(missing)
+        if loaded:
+            backend.set_many(loaded, ttl)
+            found.update(loaded)
+    return found
+
+
+def get_or_set(key, loader, ttl=None):
+    """讀取單一 key，未命中時呼叫 loader() 載入"""
+    return get_many([key], lambda missing: {key: loader()}, ttl)[key]
+
+
+# --- key 與失效 ---
+def group_card_key(group_id):
+    return f'group_card:{group_id}'
+
+
+def fragment_key(name, *version):
+    """模板片段的 key；版本改變時自然換成新的 key，不需要主動失效"""
+    return 'fragment:' + ':'.join([name] + [str(part) for part in version])
+
+
+def invalidate_groups(*group_ids):
+    """團購進度、狀態或內容改變時呼叫"""
+    get_backend().delete(*[group_card_key(group_id) for group_id in group_ids])
@@ -0,0 +1,255 @@
+"""
+商品目錄批次匯入與匯出
+- 匯入：逐行解析 CSV 或 JSON Lines，驗證後每 chunk_size 筆以批次 INSERT / UPDATE 寫入一次；
+  有 sku 的列以 sku 比對既有商品，只有 id 的列更新該商品，兩者皆無則新增。
+  錯誤的列記錄行號與原因後略過，不影響其他列
+- 匯出：以 id 做 keyset 分頁逐批讀取並輸出，不會一次載入整個目錄
+兩者記憶體用量都與檔案大小無關（只保留一個 chunk 與最多 MAX_REPORTED_ERRORS 筆錯誤）
+"""
+
+import csv
+import io
+import itertools
+import json
+import math
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, select, update
+
+from models import db, GroupBuying, Product
+
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_COLUMNS = ('id', 'sku', 'name', 'price', 'stock_quantity', 'description', 'image_url')
+# 新增的列補齊所有欄位，executemany 的每一列必須有相同的參數
+INSERT_DEFAULTS = {'stock_quantity': 0, 'description': None, 'image_url': None, 'image_key': None}
+MAX_REPORTED_ERRORS = 1000
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class ImportReport:
+    """匯入結果；errors 只保留前 MAX_REPORTED_ERRORS 筆 (行號, 原因)"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': [{'line': line, 'error': message} for line, message in self.errors],
+        }
+
+
+def format_for(filename=None, content_type=None):
+    """依副檔名或 Content-Type 判斷格式（無法判斷時回傳 None）"""
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if filename.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    if filename.endswith(('.jsonl', '.ndjson')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'jsonl'
+    return None
+
+
+# --- 驗證 ---
+def validate_product(body, partial=False):
+    """驗證商品欄位，回傳要寫入的值；格式錯誤時拋出 ValueError（訊息可直接顯示給使用者）"""
+    values = {}
+    if 'name' in body or not partial:
+        name = (body.get('name') or '').strip()
+        if not name:
+            raise ValueError('商品名稱不可為空')
+        values['name'] = name[:200]
+    if 'price' in body or not partial:
+        try:
+            values['price'] = float(body.get('price'))
+        except (TypeError, ValueError):
+            raise ValueError('價格格式錯誤')
+        if not math.isfinite(values['price']):
+            raise ValueError('價格格式錯誤')
+        if values['price'] < 0:
+            raise ValueError('價格不可為負數')
+    if body.get('stock_quantity') not in (None, ''):
+        try:
+            values['stock_quantity'] = int(body['stock_quantity'])
+        except (TypeError, ValueError):
+            raise ValueError('庫存格式錯誤')
+    for field in ('description', 'image_url'):
+        if field in body:
+            values[field] = body[field] or None
+    if values.get('image_url') and len(values['image_url']) > 500:
+        raise ValueError('圖片網址過長')
+    if 'image_url' in values:
+        # 網址改變後重新下載（內容相同時鍵也相同，不會重複儲存）
+        values['image_key'] = None
+    return values
+
+
+def _import_row(body):
+    """回傳 (sku, id, values)；sku / id 皆為 None 時為新增"""
+    if not isinstance(body, dict):
+        raise ValueError('每一列必須是 JSON 物件')
+    sku = str(body.get('sku') or '').strip() or None
+    if sku and len(sku) > 64:
+        raise ValueError('sku 過長')
+    product_id = None
+    if not sku and body.get('id') not in (None, ''):
+        try:
+            product_id = int(body['id'])
+        except (TypeError, ValueError):
+            raise ValueError('id 格式錯誤')
+    # sku 是否已存在要到寫入時才知道，先以部分欄位驗證，新增時再檢查必要欄位
+    values = validate_product(body, partial=bool(sku or product_id))
+    return sku, product_id, values
+
+
+# --- 解析 ---
+def parse_rows(stream, fmt):
+    """逐列產生 (行號, dict 或 ValueError)；stream 為二進位或文字檔案物件"""
+    if fmt not in FORMATS:
+        raise ValueError(f'不支援的格式 {fmt}')
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except (csv.Error, UnicodeDecodeError) as e:
+            yield reader.line_num, ValueError(f'CSV 格式錯誤：{e}')
+        return
+
+    line = 0
+    try:
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except json.JSONDecodeError as e:
+                yield line, ValueError(f'JSON 格式錯誤：{e.msg}')
+    except UnicodeDecodeError as e:
+        yield line + 1, ValueError(f'編碼錯誤：{e.reason}')
+
+
+# --- 匯入 ---
+def _write_chunk(chunk, report):
+    """寫入一批已驗證的列：[(行號, sku, id, values)]；行號對應的錯誤加入 report"""
+    skus = {sku for _, sku, _, _ in chunk if sku}
+    existing = dict(db.session.execute(
+        select(Product.sku, Product.id).where(Product.sku.in_(skus))
+    ).all()) if skus else {}
+    ids = {product_id for _, _, product_id, _ in chunk if product_id is not None}
+    known_ids = set(db.session.execute(
+        select(Product.id).where(Product.id.in_(ids))
+    ).scalars()) if ids else set()
+
+    inserts, updates = {}, {}
+    for line, sku, product_id, values in chunk:
+        if sku and sku in existing:
+            product_id = existing[sku]
+        elif product_id is not None and product_id not in known_ids:
+            report.add_error(line, f'找不到商品 {product_id}')
+            continue
+        if product_id is not None:
+            updates.setdefault(product_id, {}).update(values)
+        elif 'name' not in values or 'price' not in values:
+            report.add_error(line, '新增商品需要名稱與價格')
+        else:
+            # 同一批中重複的 sku 以最後一列為準
+            inserts[sku or ('line', line)] = dict(INSERT_DEFAULTS, **values, sku=sku)
+
+    now = datetime.utcnow()
+    if inserts:
+        db.session.execute(insert(Product.__table__), [dict(row, created_at=now) for row in inserts.values()])
+    # 欄位不同的更新分開執行，executemany 的每一列必須有相同的參數
+    by_columns = {}
+    for product_id, values in updates.items():
+        by_columns.setdefault(tuple(sorted(values)), []).append(dict(values, b_id=product_id))
+    for columns, rows in by_columns.items():
+        db.session.execute(
+            update(Product.__table__).where(Product.__table__.c.id == bindparam('b_id'))
+            .values({column: bindparam(column) for column in columns}),
+            rows,
+        )
+    if updates:
+        # 團購卡片內含商品資料：更新相關團購的版本戳記，讓快取與 ETag 失效
+        db.session.execute(
+            update(GroupBuying)
+            .where(GroupBuying.product_id.in_(updates))
+            .values(updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    report.inserted += len(inserts)
+    report.updated += len(updates)
+
+
+def import_products(stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """匯入商品，回傳 ImportReport（每個 chunk 一個交易，錯誤的列不會中止匯入）"""
+    report = ImportReport()
+    rows = parse_rows(stream, fmt)
+    while True:
+        chunk, seen = [], 0
+        for line, body in itertools.islice(rows, chunk_size):
+            seen += 1
+            try:
+                if isinstance(body, ValueError):
+                    raise body
+                chunk.append((line, *_import_row(body)))
+            except ValueError as e:
+                report.add_error(line, str(e))
+        if chunk:
+            _write_chunk(chunk, report)
+        if seen < chunk_size:
+            break
+    report.errors.sort()
+    return report
+
+
+# --- 匯出 ---
+def iter_products(batch_size=DEFAULT_CHUNK_SIZE):
+    """依 id 順序逐批產生商品列（dict）"""
+    last_id = 0
+    columns = [getattr(Product, name) for name in EXPORT_COLUMNS]
+    while True:
+        batch = db.session.execute(
+            select(*columns).where(Product.id > last_id).order_by(Product.id).limit(batch_size)
+        ).mappings().all()
+        if not batch:
+            return
+        for row in batch:
+            yield dict(row)
+        last_id = batch[-1]['id']
+
+
+def export_products(fmt, batch_size=DEFAULT_CHUNK_SIZE):
+    """產生匯出檔的文字片段（CSV 含標題列；JSON Lines 每列一個商品）"""
+    if fmt not in FORMATS:
+        raise ValueError(f'不支援的格式 {fmt}')
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, lineterminator='\n')
+    if fmt == 'csv':
+        writer.writeheader()
+
+    for count, row in enumerate(iter_products(batch_size), start=1):
+        if fmt == 'csv':
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
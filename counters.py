@@ -0,0 +1,162 @@
+"""
+團購數量計數器一致性
+GroupBuying.current_quantity 是未取消訂單數量的快取總和：
+- 增量維護：ORM flush 時依訂單新增、刪除、取消調整計數器
+- 批次對帳：reconcile_counters() 以集合式 UPDATE 修正所有偏差
+以 Query.delete() / bulk 操作繞過 ORM 的修改不會觸發增量維護，需執行對帳
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, case, event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+import cache
+from models import db, GroupBuying, Order
+
+
+# 最近一次對帳的偏差統計
+counter_metrics = {
+    'reconciles': 0,
+    'groups_checked': 0,
+    'drifted_groups': 0,
+    'total_drift': 0,
+    'max_drift': 0,
+    'last_reconcile_at': None,
+}
+
+
+def _counts(order, status=None):
+    """訂單是否計入計數器（已取消的不計）"""
+    return (status or order.payment_status) != 'CANCELLED'
+
+
+def mark_counted(order):
+    """標記訂單數量已由呼叫端計入計數器（例如 reserve_slots），flush 時不再重複增加"""
+    order._already_counted = True
+
+
+def _apply_deltas(connection, deltas):
+    """依 {group_id: delta} 調整計數器；低於目標的 SUCCESS 團購在截止前重新開放"""
+    now = datetime.utcnow()
+    for group_id, delta in deltas.items():
+        if not delta:
+            continue
+        new_quantity = GroupBuying.current_quantity + delta
+        connection.execute(
+            update(GroupBuying)
+            .where(GroupBuying.id == group_id)
+            .values(
+                current_quantity=new_quantity,
+                status=case(
+                    (and_(GroupBuying.status == 'SUCCESS',
+                          new_quantity < GroupBuying.target_quantity,
+                          GroupBuying.deadline > now), 'ACTIVE'),
+                    else_=GroupBuying.status,
+                ),
+            )
+        )
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_order_changes(session, flush_context):
+    """flush 後依訂單異動計算各團購的數量變化"""
+    deltas = defaultdict(int)
+    deleted_groups = {obj.id for obj in session.deleted if isinstance(obj, GroupBuying)}
+
+    for obj in session.new:
+        if isinstance(obj, Order) and _counts(obj) and not getattr(obj, '_already_counted', False):
+            deltas[obj.group_buying_id] += obj.quantity
+
+    for obj in session.deleted:
+        if isinstance(obj, Order) and _counts(obj) and obj.group_buying_id not in deleted_groups:
+            deltas[obj.group_buying_id] -= obj.quantity
+
+    for obj in session.dirty:
+        if not isinstance(obj, Order):
+            continue
+        state = inspect(obj)
+        status = state.attrs.payment_status.history
+        quantity = state.attrs.quantity.history
+        if not status.has_changes() and not quantity.has_changes():
+            continue
+        old_status = status.deleted[0] if status.deleted else obj.payment_status
+        old_quantity = quantity.deleted[0] if quantity.deleted else obj.quantity
+        old = old_quantity if _counts(obj, old_status) else 0
+        new = obj.quantity if _counts(obj) else 0
+        deltas[obj.group_buying_id] += new - old
+
+    if deltas:
+        _apply_deltas(session.connection(), deltas)
+        session.info.setdefault('stale_groups', set()).update(deltas)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_stale_groups(session, flush_context):
+    """已載入的團購計數器在資料庫中被更新，讓下次讀取時重新載入"""
+    stale = session.info.pop('stale_groups', None)
+    if not stale:
+        return
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, GroupBuying) and obj.id in stale:
+            session.expire(obj, ['current_quantity', 'status'])
+    session.info.setdefault('uncached_groups', set()).update(stale)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_cached_groups(session):
+    """交易提交後才讓快取失效，避免其他請求重新快取未提交前的資料"""
+    changed = session.info.pop('uncached_groups', None)
+    if changed:
+        cache.invalidate_groups(*changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_cached_groups(session):
+    session.info.pop('uncached_groups', None)
+
+
+def _expected_quantities():
+    """各團購未取消訂單的數量總和（子查詢）"""
+    return select(
+        Order.group_buying_id.label('group_id'),
+        func.sum(Order.quantity).label('quantity')
+    ).where(Order.payment_status != 'CANCELLED') \
+     .group_by(Order.group_buying_id).subquery()
+
+
+def reconcile_counters(dry_run=False):
+    """重新計算所有團購的 current_quantity，回傳 [(group_id, 計數器, 實際)]"""
+    expected = _expected_quantities()
+    actual = func.coalesce(expected.c.quantity, 0)
+
+    drifted = db.session.execute(
+        select(GroupBuying.id, GroupBuying.current_quantity, actual)
+        .outerjoin(expected, expected.c.group_id == GroupBuying.id)
+        .where(func.coalesce(GroupBuying.current_quantity, 0) != actual)
+    ).all()
+    checked = db.session.execute(select(func.count(GroupBuying.id))).scalar()
+
+    if drifted and not dry_run:
+        correct = select(func.coalesce(func.sum(Order.quantity), 0)).where(
+            Order.group_buying_id == GroupBuying.id,
+            Order.payment_status != 'CANCELLED'
+        ).scalar_subquery()
+        db.session.execute(
+            update(GroupBuying)
+            .where(func.coalesce(GroupBuying.current_quantity, 0) != correct)
+            .values(current_quantity=correct)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+
+    drifts = [abs((row[1] or 0) - row[2]) for row in drifted]
+    counter_metrics['reconciles'] += 1
+    counter_metrics['groups_checked'] = checked
+    counter_metrics['drifted_groups'] = len(drifted)
+    counter_metrics['total_drift'] = sum(drifts)
+    counter_metrics['max_drift'] = max(drifts, default=0)
+    counter_metrics['last_reconcile_at'] = datetime.utcnow()
+
+    return [tuple(row) for row in drifted]
@@ -0,0 +1,311 @@
+"""
+訂單匯出與結算報表
+團長在團購成團後依訂單收款；匯出以 server-side cursor（yield_per）逐批讀取，邊讀邊輸出：
+- CSV：每批寫成一段文字
+- XLSX：以 zipfile 串流寫入最簡的 SpreadsheetML（字串用 inlineStr，不需要 sharedStrings 與 styles），
+  第二張工作表為依付款狀態彙總的結算表
+匯出期間會佔用一條資料庫連線，因此每個 worker 同時進行的匯出數以 EXPORT_MAX_CONCURRENT
+（預設 MAX_CONCURRENT_EXPORTS）限制，超過時拋出 ExportBusy
+"""
+
+import csv
+import io
+import threading
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from flask import current_app
+from sqlalchemy import case, func, select
+
+from models import db, GroupBuying, Order, User
+
+
+FORMATS = ('csv', 'xlsx')
+CHUNK_SIZE = 1000
+MAX_CONCURRENT_EXPORTS = 2
+PRICE_DECIMALS = 2
+
+# 試算表會把這些字元開頭的儲存格當成公式，使用者輸入的團購、商品名稱前面加上 ' 當成文字
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+COLUMNS = (
+    ('order_id', '訂單編號'),
+    ('group_id', '團購編號'),
+    ('group_name', '團購名稱'),
+    ('group_status', '團購狀態'),
+    ('username', '帳號'),
+    ('buyer', '姓名'),
+    ('email', 'Email'),
+    ('quantity', '數量'),
+    ('total_price', '金額'),
+    ('payment_status', '付款狀態'),
+    ('created_at', '下單時間'),
+)
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+class ExportBusy(Exception):
+    """同時進行的匯出過多"""
+
+
+_slots_lock = threading.Lock()
+
+
+def get_slots(app=None):
+    """應用程式的匯出名額（EXPORT_MAX_CONCURRENT），第一次匯出時建立並存在 app.extensions['export_slots']
+
+    模組在匯出路由中才載入，因此不在 create_app() 中建立
+    """
+    app = app or current_app
+    with _slots_lock:
+        if 'export_slots' not in app.extensions:
+            max_concurrent = int(app.config.get('EXPORT_MAX_CONCURRENT') or MAX_CONCURRENT_EXPORTS)
+            app.extensions['export_slots'] = threading.BoundedSemaphore(max_concurrent)
+        return app.extensions['export_slots']
+
+
+# --- 查詢 ---
+def _filters(group_id=None, leader_id=None, status=None):
+    conditions = []
+    if group_id is not None:
+        conditions.append(Order.group_buying_id == group_id)
+    if leader_id is not None:
+        conditions.append(GroupBuying.leader_id == leader_id)
+    if status:
+        conditions.append(GroupBuying.status == status)
+    return conditions
+
+
+def order_rows(group_id=None, leader_id=None, status=None, chunk_size=CHUNK_SIZE):
+    """逐列產生匯出的訂單（Row，欄位順序與 COLUMNS 相同），依團購、下單時間排序
+
+    yield_per 讓 PostgreSQL 使用 server-side cursor，每次只從資料庫取 chunk_size 列
+    """
+    query = select(
+        Order.id.label('order_id'), GroupBuying.id.label('group_id'),
+        GroupBuying.name.label('group_name'), GroupBuying.status.label('group_status'),
+        User.username, User.name.label('buyer'), User.email,
+        Order.quantity, Order.total_price, Order.payment_status, Order.created_at,
+    ).join(GroupBuying, Order.group_buying_id == GroupBuying.id) \
+     .join(User, Order.user_id == User.id) \
+     .where(*_filters(group_id, leader_id, status)) \
+     .order_by(GroupBuying.id, Order.created_at, Order.id) \
+     .execution_options(yield_per=chunk_size)
+
+    result = db.session.execute(query)
+    try:
+        for partition in result.partitions():
+            yield from partition
+    finally:
+        result.close()
+
+
+def settlement_summary(group_id=None, leader_id=None, status=None):
+    """依團購與付款狀態彙總：[(group_id, group_name, payment_status, 訂單數, 數量, 金額)]"""
+    return db.session.execute(
+        select(
+            GroupBuying.id, GroupBuying.name, Order.payment_status,
+            func.count(Order.id), func.sum(Order.quantity), func.sum(Order.total_price),
+        ).join(GroupBuying, Order.group_buying_id == GroupBuying.id)
+        .where(*_filters(group_id, leader_id, status))
+        .group_by(GroupBuying.id, GroupBuying.name, Order.payment_status)
+        .order_by(GroupBuying.id, case((Order.payment_status == 'PAID', 0), else_=1), Order.payment_status)
+    ).all()
+
+
+# --- CSV ---
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, float):
+        return round(value, PRICE_DECIMALS)
+    return value
+
+
+def _csv_cell(value):
+    value = _cell(value)
+    if isinstance(value, float):
+        return f'{value:.{PRICE_DECIMALS}f}'
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(rows):
+    """CSV 文字片段（UTF-8 BOM 讓 Excel 正確辨識中文）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+    buffer.write('\ufeff')
+    writer.writerow([title for _, title in COLUMNS])
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_csv_cell(value) for value in row])
+        if count % CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+# --- XLSX ---
+class _ChunkWriter(io.RawIOBase):
+    """zipfile 的輸出目標：寫入的位元組暫存起來，由 drain() 取出（不可 seek，zipfile 改用資料描述區）"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_XLSX_STATIC = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet2.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="訂單" sheetId="1" r:id="rId1"/><sheet name="結算" sheetId="2" r:id="rId2"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet2.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+_SHEET_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+               '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+_SHEET_TAIL = '</sheetData></worksheet>'
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        value = _cell(value)
+        if value is None:
+            cells.append('<c/>')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c><v>{value}</v></c>')
+        else:
+            cells.append(f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def iter_xlsx(rows, summary):
+    """XLSX 位元組片段；summary 為回傳 settlement_summary() 結果的函式，在訂單寫完後才查詢"""
+    output = _ChunkWriter()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_STATIC.items():
+            workbook.writestr(name, content)
+        yield output.drain()
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((_SHEET_HEAD + _xlsx_row(title for _, title in COLUMNS)).encode('utf-8'))
+            lines = []
+            for row in rows:
+                lines.append(_xlsx_row(row))
+                if len(lines) == CHUNK_SIZE:
+                    sheet.write(''.join(lines).encode('utf-8'))
+                    lines = []
+                    yield output.drain()
+            sheet.write(''.join(lines).encode('utf-8'))
+            sheet.write(_SHEET_TAIL.encode('utf-8'))
+        yield output.drain()
+
+        lines = [_xlsx_row(('團購編號', '團購名稱', '付款狀態', '訂單數', '數量', '金額'))]
+        lines += [_xlsx_row(row) for row in summary()]
+        workbook.writestr('xl/worksheets/sheet2.xml', _SHEET_HEAD + ''.join(lines) + _SHEET_TAIL)
+    yield output.drain()
+
+
+# --- 匯出 ---
+class _Export:
+    """匯出檔的位元組片段；結束、close() 或被回收時釋放名額（回應未開始傳送就中斷也不會遺漏）"""
+
+    def __init__(self, chunks, slots):
+        self._chunks = chunks
+        self._slots = slots
+
+    def __iter__(self):
+        try:
+            yield from self._chunks
+        finally:
+            self.close()
+
+    def close(self):
+        slots, self._slots = self._slots, None
+        if slots is not None:
+            self._chunks.close()
+            slots.release()
+
+    def __del__(self):
+        self.close()
+
+
+def export_orders(fmt, group_id=None, leader_id=None, status=None):
+    """回傳匯出檔的位元組片段（可迭代）；同時進行的匯出過多時拋出 ExportBusy"""
+    if fmt not in FORMATS:
+        raise ValueError(f'不支援的格式 {fmt}')
+    slots = get_slots()
+    if not slots.acquire(blocking=False):
+        raise ExportBusy()
+
+    def generate():
+        rows = order_rows(group_id, leader_id, status)
+        if fmt == 'csv':
+            yield from iter_csv(rows)
+        else:
+            yield from iter_xlsx(rows, lambda: settlement_summary(group_id, leader_id, status))
+
+    return _Export(generate(), slots)
+
+
+def export_filename(fmt, group_id=None):
+    stamp = datetime.utcnow().strftime('%Y%m%d')
+    scope = f'group-{group_id}' if group_id is not None else 'all'
+    return f'orders-{scope}-{stamp}.{fmt}'
@@ -0,0 +1,67 @@
+"""
+gunicorn 設定：gunicorn -c gunicorn.conf.py app:app
+worker 數、執行緒與連線池大小由 serving.py 依 CPU 核心數與 DB_MAX_CONNECTIONS 計算
+"""
+
+import os
+import signal
+
+import pubsub
+import serving
+import warmup
+
+
+_profile = serving.worker_profile()
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+worker_class = _profile['worker_class']
+workers = _profile['workers']
+threads = _profile['threads']
+worker_connections = _profile['worker_connections']
+
+# worker 啟動後才載入應用程式，連線池在 fork 之後建立；讓 create_app() 依實際 worker 數分配連線
+os.environ['WEB_CONCURRENCY'] = str(workers)
+os.environ['WEB_THREADS'] = str(threads)
+os.environ.setdefault('WEB_WORKER_CLASS', worker_class)
+
+timeout = 30            # 同步請求的上限；SSE 由 gevent worker 處理，不受 heartbeat 影響
+graceful_timeout = 30   # 收到 SIGTERM 後等待進行中請求完成的時間
+keepalive = 5
+
+# 定期重啟 worker，避免長時間執行累積記憶體；jitter 避免所有 worker 同時重啟
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    """worker 就緒後預熱樣板與資料庫連線，並在收到 SIGTERM 時先結束 SSE 串流"""
+    if worker_class == 'gevent':
+        serving.cooperative_psycopg2()
+    # 預熱完成前 worker 不會接受請求：樣板、ORM mapper 與連線池都在第一個請求之前準備好
+    state = warmup.warm(worker.wsgi)
+    if state.ready:
+        worker.log.info('warmed up in %.1f ms: %d templates, %d database connections',
+                        state.duration_ms, state.templates, state.connections)
+    else:
+        worker.log.warning('warm-up failed (%s); /readyz will retry', state.error)
+
+    # SSE 連線不會自行結束；先中斷訂閱，讓 graceful_timeout 只需等待一般請求
+    handle_exit = worker.handle_exit
+
+    def close_streams_then_exit(sig, frame):
+        pubsub.get_broker(worker.wsgi).close_all()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, close_streams_then_exit)
+
+
+def worker_int(worker):
+    """SIGINT / SIGQUIT：立即結束前仍釋放資源"""
+    serving.drain(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    """正常結束（SIGTERM、max_requests）：結束 SSE 串流並關閉連線"""
+    serving.drain(worker.wsgi)
@@ -0,0 +1,429 @@
+"""
+商品圖片
+瀏覽器不再直接向外部網站（Unsplash 等）載入原圖：
+- 來源：image_url 在第一次顯示（或執行 flask fetch-images）時下載一次，上傳的檔案直接存入；
+  原圖以內容雜湊為鍵存在 IMAGE_DIR，Product.image_key 記錄這個鍵
+- 尺寸：thumb / card / detail 三種寬度各輸出 WebP 與 JPEG，第一次請求時產生並存檔（需要 Pillow，
+  未安裝時所有尺寸都回傳原圖）
+- /images/<鍵>/<尺寸>.<格式> 的內容不會改變，設定一年 immutable 快取；樣板以 srcset 讓瀏覽器挑選尺寸
+- 尚未下載的商品先指向 /images/product/<id>/<尺寸>.<格式>，下載後 302 轉到正式網址
+儲存目錄與下載函式為各應用程式的設定（app.extensions['images']）；IMAGE_FETCHER 可為 callable，
+IMAGE_FETCHER=stub 時不連外，改為產生單色佔位圖（測試與壓測用）
+"""
+
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from flask import abort, current_app, has_app_context, redirect, send_file, url_for
+from sqlalchemy import update
+
+from models import db, GroupBuying, Product
+
+# 選用：沒有 Pillow 時不產生縮圖，直接回傳原圖；載入 Pillow 需要數十 ms，第一次用到時才 import
+HAS_PILLOW = importlib.util.find_spec('PIL') is not None
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_DIR = os.path.join(BASE_DIR, 'media', 'images')
+
+# 尺寸 -> 寬度（px）；卡片約 350px 寬、詳情頁約 700px 寬，較大的尺寸供高解析度螢幕使用
+VARIANTS = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 960,
+}
+FORMATS = {
+    'webp': 'image/webp',
+    'jpg': 'image/jpeg',
+}
+QUALITY = {'webp': 80, 'jpg': 82}
+
+KEY_LENGTH = 32
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_PIXELS = 40_000_000
+FETCH_TIMEOUT = 10  # 秒
+FAILURE_RETRY = 300  # 下載失敗的網址在這段時間內不再重試（秒）
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+REDIRECT_MAX_AGE = 60
+USER_AGENT = 'groupbuy-image-fetcher/1.0'
+
+_KEY = re.compile(rf'^[0-9a-f]{{{KEY_LENGTH}}}$')
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+image_metrics = {
+    'fetches': 0,
+    'fetch_failures': 0,
+    'uploads': 0,
+    'variants_generated': 0,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ImageError(ValueError):
+    """圖片無法下載或不是支援的格式（訊息可直接顯示給使用者）"""
+
+
+# --- 下載 ---
+def http_fetch(url):
+    """下載圖片原檔（只接受 http / https，超過 MAX_IMAGE_BYTES 拋出 ImageError）"""
+    if urlsplit(url).scheme not in ('http', 'https'):
+        raise ImageError('只支援 http / https 圖片網址')
+    import urllib.request  # 連帶載入 http.client 與 email，只有實際下載時才需要
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT, 'Accept': 'image/*'})
+    with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+        data = response.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ImageError('圖片過大')
+    return data
+
+
+def _solid_png(width, height, rgb):
+    """單色 PNG（不需要 Pillow）"""
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+    row = b'\x00' + bytes(rgb) * width
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height))
+            + chunk(b'IEND', b''))
+
+
+def stub_fetch(url):
+    """不連外的下載函式：依網址產生固定顏色的佔位圖，同一網址每次結果相同"""
+    digest = hashlib.sha256(url.encode('utf-8')).digest()
+    return _solid_png(VARIANTS['detail'], VARIANTS['detail'] * 3 // 4, digest[:3])
+
+
+FETCHERS = {
+    'http': http_fetch,
+    'stub': stub_fetch,
+}
+
+# 同一張圖的縮圖只產生一次；以固定數量的鎖分擔，不必為每個鍵建立一個
+_locks = [threading.Lock() for _ in range(16)]
+# 下載中的商品圖片 (商品 id, 網址) -> Future；同時到達的第一次請求只下載一次，其他請求等待結果
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class ImageSettings:
+    """應用程式的儲存目錄、下載函式（'http'、'stub' 或 callable(url) -> bytes）與最近下載失敗的網址"""
+
+    def __init__(self, directory=None, fetcher=None):
+        if isinstance(fetcher, str):
+            if fetcher not in FETCHERS:
+                raise ValueError(f'不支援的 IMAGE_FETCHER {fetcher}')
+            fetcher = FETCHERS[fetcher]
+        self.directory = directory or IMAGE_DIR
+        self.fetcher = fetcher or http_fetch
+        self.failures = {}
+
+
+# 沒有 app context 時（腳本）使用的設定
+_default_settings = ImageSettings()
+
+
+def _settings():
+    if has_app_context():
+        return current_app.extensions.get('images', _default_settings)
+    return _default_settings
+
+
+# --- 儲存 ---
+def sniff(data):
+    """依檔頭判斷圖片格式，回傳 mimetype（不支援時為 None）"""
+    for signature, mimetype in _SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def _validate(data):
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ImageError('圖片過大')
+    if sniff(data) is None:
+        raise ImageError('不支援的圖片格式（請使用 JPEG、PNG、GIF 或 WebP）')
+    if HAS_PILLOW:
+        from PIL import Image
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+                image.verify()
+        except Exception:
+            raise ImageError('圖片檔案損毀') from None
+        if width * height > MAX_PIXELS:
+            raise ImageError('圖片尺寸過大')
+
+
+def _image_dir(key):
+    return os.path.join(_settings().directory, key[:2], key)
+
+
+def _write_atomic(path, data):
+    """先寫暫存檔再改名，其他 worker 不會讀到寫到一半的檔案"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def store(data):
+    """驗證並儲存原圖，回傳內容雜湊的鍵（相同內容只存一份）"""
+    _validate(data)
+    key = hashlib.sha256(data).hexdigest()[:KEY_LENGTH]
+    path = os.path.join(_image_dir(key), 'original')
+    if not os.path.isfile(path):
+        _write_atomic(path, data)
+    return key
+
+
+def fetch(url):
+    """下載 url 並儲存，回傳鍵；失敗時拋出 ImageError"""
+    image_metrics['fetches'] += 1
+    try:
+        data = _settings().fetcher(url)
+    except ImageError:
+        image_metrics['fetch_failures'] += 1
+        raise
+    except (OSError, ValueError) as e:  # urllib.error.URLError 是 OSError
+        image_metrics['fetch_failures'] += 1
+        raise ImageError(f'無法下載圖片：{e}') from None
+    try:
+        return store(data)
+    except ImageError:
+        image_metrics['fetch_failures'] += 1
+        raise
+
+
+def store_upload(upload):
+    """儲存上傳的圖片（werkzeug FileStorage 或檔案物件），回傳鍵"""
+    stream = getattr(upload, 'stream', upload)
+    data = stream.read(MAX_IMAGE_BYTES + 1)
+    key = store(data)
+    image_metrics['uploads'] += 1
+    return key
+
+
+# --- 縮圖 ---
+def _resize(data, width, fmt):
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            height = max(round(image.height * width / image.width), 1)
+            image = image.resize((width, height), Image.LANCZOS)
+        if fmt == 'jpg' or image.mode not in ('RGB', 'RGBA'):
+            if image.mode in ('RGBA', 'LA', 'P'):
+                # JPEG 沒有透明度：疊在白色背景上
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            else:
+                image = image.convert('RGB')
+        output = io.BytesIO()
+        if fmt == 'webp':
+            image.save(output, 'WEBP', quality=QUALITY['webp'], method=4)
+        else:
+            image.save(output, 'JPEG', quality=QUALITY['jpg'], optimize=True, progressive=True)
+        return output.getvalue()
+
+
+def variant_path(key, variant, fmt):
+    """回傳 (檔案路徑, mimetype)，縮圖不存在時產生；原圖不存在時為 (None, None)"""
+    directory = _image_dir(key)
+    original = os.path.join(directory, 'original')
+    if not HAS_PILLOW:
+        if not os.path.isfile(original):
+            return None, None
+        with open(original, 'rb') as f:
+            return original, sniff(f.read(16))
+
+    path = os.path.join(directory, f'{variant}.{fmt}')
+    if os.path.isfile(path):
+        return path, FORMATS[fmt]
+    with _locks[hash(key) % len(_locks)]:
+        if os.path.isfile(path):
+            return path, FORMATS[fmt]
+        try:
+            with open(original, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, None
+        _write_atomic(path, _resize(data, VARIANTS[variant], fmt))
+        image_metrics['variants_generated'] += 1
+    return path, FORMATS[fmt]
+
+
+def prepare(key):
+    """預先產生所有尺寸與格式"""
+    for variant in VARIANTS:
+        for fmt in FORMATS:
+            variant_path(key, variant, fmt)
+
+
+# --- 商品 ---
+def _field(product, name):
+    return product.get(name) if isinstance(product, dict) else getattr(product, name, None)
+
+
+def set_product_image(product_id, key, url=None):
+    """記錄商品的圖片鍵；url 不為 None 時只在 image_url 仍是該網址時寫入（避免覆寫期間被修改的網址）"""
+    conditions = [Product.id == product_id]
+    values = {'image_key': key}
+    if url is not None:
+        conditions.append(Product.image_url == url)
+    else:
+        values['image_url'] = None
+    result = db.session.execute(
+        update(Product).where(*conditions).values(values).execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        # 團購卡片內含商品資料：更新相關團購的版本戳記，讓快取與 ETag 失效
+        db.session.execute(
+            update(GroupBuying)
+            .where(GroupBuying.product_id == product_id)
+            .values(updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return bool(result.rowcount)
+
+
+def _download_product_image(product_id, url):
+    try:
+        key = fetch(url)
+    except ImageError as e:
+        failures = _settings().failures
+        if len(failures) > 1000:
+            failures.clear()
+        failures[url] = time.monotonic()
+        logger.warning('商品 %s 的圖片 %s 下載失敗：%s', product_id, url, e)
+        return None
+    set_product_image(product_id, key, url)
+    return key
+
+
+def ensure_product_image(product):
+    """回傳商品的圖片鍵，尚未下載時下載 image_url 並記錄；沒有圖片或下載失敗時回傳 None
+
+    同一商品同時只下載一次，其他請求等待同一個結果
+    """
+    key = _field(product, 'image_key')
+    url = _field(product, 'image_url')
+    if key or not url:
+        return key
+    failed_at = _settings().failures.get(url)
+    if failed_at is not None and time.monotonic() - failed_at < FAILURE_RETRY:
+        return None
+
+    inflight_key = (_field(product, 'id'), url)
+    with _inflight_lock:
+        future = _inflight.get(inflight_key)
+        leader = future is None
+        if leader:
+            future = _inflight[inflight_key] = Future()
+    if not leader:
+        return future.result()
+    try:
+        future.set_result(_download_product_image(*inflight_key))
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[inflight_key]
+    return future.result()
+
+
+def image_url(key, variant='card', fmt='jpg'):
+    return url_for('image', key=key, name=f'{variant}.{fmt}')
+
+
+def image_sources(product, variant='card'):
+    """樣板用：{'src', 'webp', 'jpg'}（後兩者為 srcset），商品沒有圖片時回傳 None"""
+    key = _field(product, 'image_key')
+    if key:
+        return {
+            'src': image_url(key, variant, 'jpg'),
+            'webp': ', '.join(f'{image_url(key, name, "webp")} {width}w' for name, width in VARIANTS.items()),
+            'jpg': ', '.join(f'{image_url(key, name, "jpg")} {width}w' for name, width in VARIANTS.items()),
+        }
+    if _field(product, 'image_url'):
+        # 尚未下載：只提供單一尺寸，第一次請求時下載後轉到正式網址
+        product_id = _field(product, 'id')
+        return {
+            'src': url_for('product_image', product_id=product_id, name=f'{variant}.jpg'),
+            'webp': url_for('product_image', product_id=product_id, name=f'{variant}.webp'),
+            'jpg': None,
+        }
+    return None
+
+
+# --- 服務 ---
+def _parse_name(name):
+    variant, _, fmt = name.partition('.')
+    if variant not in VARIANTS or fmt not in FORMATS:
+        abort(404)
+    return variant, fmt
+
+
+def serve_image(key, name):
+    """縮圖：網址含內容雜湊，一年 immutable 快取"""
+    variant, fmt = _parse_name(name)
+    if not _KEY.match(key):
+        abort(404)
+    path, mimetype = variant_path(key, variant, fmt)
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def serve_product_image(product_id, name):
+    """尚未下載的商品圖片：下載並記錄後轉到正式網址"""
+    variant, fmt = _parse_name(name)
+    product = db.session.get(Product, product_id) or abort(404)
+    key = ensure_product_image(product)
+    if key is None:
+        abort(404)
+    response = redirect(image_url(key, variant, fmt))
+    response.cache_control.public = True
+    response.cache_control.max_age = REDIRECT_MAX_AGE
+    return response
+
+
+def init_app(app):
+    """設定儲存目錄與下載函式（IMAGE_DIR、IMAGE_FETCHER），註冊 /images 與樣板函式"""
+    app.extensions['images'] = ImageSettings(app.config.get('IMAGE_DIR'), app.config.get('IMAGE_FETCHER'))
+    app.add_url_rule('/images/<key>/<name>', 'image', serve_image)
+    app.add_url_rule('/images/product/<int:product_id>/<name>', 'product_image', serve_product_image)
+    app.jinja_env.globals['image_sources'] = image_sources
@@ -87,8 +87,8 @@ echo.
 echo 請在瀏覽器中訪問：
 echo   http://localhost:5000
 echo.
-echo 首次使用請訪問：
-echo   http://localhost:5000/init-db
+echo 首次使用請先執行：
+echo   flask --app app init-db
 echo.
 echo 測試帳號：
 echo   用戶名: admin
@@ -126,8 +126,8 @@ echo ""
 echo "請在瀏覽器中訪問："
 echo -e "${GREEN}http://localhost:5000${NC}"
 echo ""
-echo "首次使用請訪問："
-echo -e "${GREEN}http://localhost:5000/init-db${NC}"
+echo "首次使用請先執行："
+echo -e "${GREEN}flask --app app init-db${NC}"
 echo ""
 echo "測試帳號："
 echo "  用戶名: admin"
@@ -0,0 +1,323 @@
+"""
+請求層級的效能量測
+- SQL：以 SQLAlchemy 的 cursor 事件計時每個查詢；超過 SLOW_QUERY_MS 的查詢記錄到日誌並附上 EXPLAIN
+  （同一個查詢每 EXPLAIN_INTERVAL 秒最多 EXPLAIN 一次，在請求結束時以另一條連線執行）
+- 樣板：以 Flask 的 before_render_template / template_rendered 訊號計時（含樣板中觸發的查詢）
+- 請求：抽樣的請求（SAMPLE_RATE）累計 DB 時間、查詢數、樣板時間與總時間，
+  回應加上 Server-Timing 標頭，超過 SLOW_REQUEST_MS 時記錄到日誌
+- /metrics：Prometheus 文字格式，包含上述統計與各模組的 *_metrics
+指標存在各 worker 的記憶體中，多個 worker 時每次抓取只會看到其中一個 worker 的數值；
+抽樣比例與門檻為各應用程式的設定（INSTRUMENT_SAMPLE_RATE、SLOW_QUERY_MS、SLOW_REQUEST_MS）
+"""
+
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, namedtuple
+
+from flask import (before_render_template, current_app, g, has_app_context, has_request_context,
+                   request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+SAMPLE_RATE = 0.1       # 抽樣比例，0 關閉請求分解，1 量測每個請求
+SLOW_QUERY_MS = 100
+SLOW_REQUEST_MS = 500
+
+Settings = namedtuple('Settings', 'sample_rate slow_query_ms slow_request_ms')
+# 沒有 app context 時（例如背景執行緒的查詢）使用的預設值
+_default_settings = Settings(SAMPLE_RATE, SLOW_QUERY_MS, SLOW_REQUEST_MS)
+EXPLAIN_INTERVAL = 60   # 秒，同一個 SQL 在這段時間內只 EXPLAIN 一次
+EXPLAIN_MAX_STATEMENTS = 1000  # 記錄上次 EXPLAIN 時間的 SQL 數上限（LRU）
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """依標籤分組的累積直方圖（Prometheus histogram）"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {label: (list(counts), total) for label, (counts, total) in self._series.items()}
+
+
+request_counts = defaultdict(int)  # (endpoint, method, status) -> 次數（所有請求）
+request_duration = Histogram()
+request_db_time = Histogram()
+request_render_time = Histogram()
+request_queries = defaultdict(int)  # endpoint -> 抽樣請求的查詢總數
+
+instrument_metrics = {
+    'sampled_requests': 0,
+    'slow_requests': 0,
+    'slow_queries': 0,
+    'explains': 0,
+}
+
+_counts_lock = threading.Lock()
+_explained = OrderedDict()  # SQL -> 上次 EXPLAIN 的時間，依最近使用排序，最多 EXPLAIN_MAX_STATEMENTS 筆
+_explained_lock = threading.Lock()
+
+
+class RequestStats:
+    """一個抽樣請求的時間分解"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = 0
+        self.render_time = 0.0
+        self.render_depth = 0
+        self.render_started = 0.0
+
+
+def _setting(app, name, default):
+    value = app.config.get(name)
+    return default if value is None or value == '' else float(value)
+
+
+def _settings():
+    if has_app_context():
+        return current_app.extensions.get('instrumentation', _default_settings)
+    return _default_settings
+
+
+# --- SQL ---
+def _instrumented(conn):
+    return conn.get_execution_options().get('instrumented', True)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _instrumented(conn):
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+
+    stats = g.get('request_stats') if has_request_context() else None
+    if stats is not None:
+        stats.db_time += elapsed
+        stats.queries += 1
+
+    if elapsed * 1000 >= _settings().slow_query_ms:
+        instrument_metrics['slow_queries'] += 1
+        slow = (conn.engine, statement, None if executemany else parameters, elapsed)
+        if has_request_context():
+            g.setdefault('slow_queries', []).append(slow)
+        else:
+            _log_slow_query(*slow)
+
+
+def explain_sql(conn, sql, parameters=None):
+    """回傳查詢計畫的文字行（SQLite 使用 EXPLAIN QUERY PLAN）"""
+    if conn.dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, parameters or ()).fetchall()
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql('EXPLAIN ' + sql, parameters or {}).fetchall()
+    return [row[0] for row in rows]
+
+
+def _should_explain(statement, parameters):
+    if parameters is None or not statement.lstrip().upper().startswith('SELECT'):
+        return False
+    now = time.monotonic()
+    with _explained_lock:
+        if now - _explained.get(statement, -EXPLAIN_INTERVAL) < EXPLAIN_INTERVAL:
+            _explained.move_to_end(statement)
+            return False
+        _explained[statement] = now
+        _explained.move_to_end(statement)
+        # IN (...) 展開等產生大量不同的 SQL 時，淘汰最久沒有出現的語句
+        while len(_explained) > EXPLAIN_MAX_STATEMENTS:
+            _explained.popitem(last=False)
+    return True
+
+
+def _log_slow_query(engine, statement, parameters, elapsed):
+    plan = None
+    if _should_explain(statement, parameters):
+        try:
+            with engine.connect() as conn:
+                conn.execution_options(instrumented=False)
+                plan = explain_sql(conn, statement, parameters)
+                conn.rollback()
+            instrument_metrics['explains'] += 1
+        except Exception as e:
+            plan = [f'EXPLAIN 失敗：{e}']
+
+    message = 'slow query %.1fms: %s'
+    args = [elapsed * 1000, ' '.join(statement.split())]
+    if plan:
+        message += '\n  %s'
+        args.append('\n  '.join(plan))
+    logger = current_app.logger if has_app_context() else logging.getLogger(__name__)
+    logger.warning(message, *args)
+
+
+# --- 樣板 ---
+def _before_render(sender, template, context, **extra):
+    stats = g.get('request_stats')
+    if stats is None:
+        return
+    if stats.render_depth == 0:
+        stats.render_started = time.perf_counter()
+    stats.render_depth += 1
+
+
+def _after_render(sender, template, context, **extra):
+    stats = g.get('request_stats')
+    if stats is None or stats.render_depth == 0:
+        return
+    stats.render_depth -= 1
+    if stats.render_depth == 0:
+        stats.render_time += time.perf_counter() - stats.render_started
+
+
+# --- 請求 ---
+def _start_request():
+    sample_rate = _settings().sample_rate
+    if sample_rate > 0 and random.random() < sample_rate:
+        g.request_stats = RequestStats()
+
+
+def _finish_request(response):
+    endpoint = request.endpoint or 'unknown'
+    with _counts_lock:
+        request_counts[(endpoint, request.method, response.status_code)] += 1
+
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+
+    total = time.perf_counter() - stats.started
+    instrument_metrics['sampled_requests'] += 1
+    request_duration.observe(endpoint, total)
+    request_db_time.observe(endpoint, stats.db_time)
+    request_render_time.observe(endpoint, stats.render_time)
+    with _counts_lock:
+        request_queries[endpoint] += stats.queries
+
+    response.headers['Server-Timing'] = (
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+        f'render;dur={stats.render_time * 1000:.1f}, total;dur={total * 1000:.1f}'
+    )
+    if total * 1000 >= _settings().slow_request_ms:
+        instrument_metrics['slow_requests'] += 1
+        current_app.logger.warning(
+            'slow request %s %s: total %.1fms, db %.1fms (%d queries), render %.1fms',
+            request.method, request.full_path.rstrip('?'), total * 1000,
+            stats.db_time * 1000, stats.queries, stats.render_time * 1000,
+        )
+    return response
+
+
+def _explain_slow_queries(exc):
+    for slow in g.pop('slow_queries', ()):
+        _log_slow_query(*slow)
+
+
+def init_app(app):
+    """註冊請求與樣板的量測（SQL 事件在模組載入時已註冊到所有 Engine）"""
+    app.extensions['instrumentation'] = Settings(
+        _setting(app, 'INSTRUMENT_SAMPLE_RATE', SAMPLE_RATE),
+        _setting(app, 'SLOW_QUERY_MS', SLOW_QUERY_MS),
+        _setting(app, 'SLOW_REQUEST_MS', SLOW_REQUEST_MS),
+    )
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_explain_slow_queries)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+
+# --- Prometheus 匯出 ---
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram_lines(name, help_text, histogram):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for endpoint, (counts, total) in sorted(histogram.snapshot().items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(endpoint=endpoint, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(endpoint=endpoint)} {total}')
+        lines.append(f'{name}_count{_labels(endpoint=endpoint)} {cumulative}')
+    return lines
+
+
+def _gauge_lines(prefix, metrics):
+    """把模組的 *_metrics 字典匯出為 gauge（datetime 轉為 epoch 秒，None 略過）"""
+    lines = []
+    for key, value in metrics.items():
+        if hasattr(value, 'timestamp'):
+            value = value.timestamp()
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        lines.append(f'# TYPE groupbuy_{prefix}_{key} gauge')
+        lines.append(f'groupbuy_{prefix}_{key} {value}')
+    return lines
+
+
+def _labeled_gauge_lines(name, help_text, label, values):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+    for key, value in sorted(values.items()):
+        if value is not None:
+            lines.append(f'{name}{_labels(**{label: key})} {value}')
+    return lines
+
+
+def render_metrics(module_metrics=None, labeled_gauges=()):
+    """Prometheus 文字格式
+
+    module_metrics 為 {前綴: 指標字典}，labeled_gauges 為 [(名稱, 說明, 標籤名, {標籤值: 數值})]
+    """
+    lines = ['# HELP groupbuy_requests_total 請求數', '# TYPE groupbuy_requests_total counter']
+    with _counts_lock:
+        counts = sorted(request_counts.items())
+        queries = sorted(request_queries.items())
+    for (endpoint, method, status), count in counts:
+        lines.append(f'groupbuy_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+    lines += _histogram_lines('groupbuy_request_duration_seconds', '抽樣請求的總時間', request_duration)
+    lines += _histogram_lines('groupbuy_request_db_seconds', '抽樣請求的 SQL 時間', request_db_time)
+    lines += _histogram_lines('groupbuy_request_render_seconds', '抽樣請求的樣板時間', request_render_time)
+
+    lines += ['# HELP groupbuy_request_queries_total 抽樣請求的查詢數',
+              '# TYPE groupbuy_request_queries_total counter']
+    for endpoint, count in queries:
+        lines.append(f'groupbuy_request_queries_total{_labels(endpoint=endpoint)} {count}')
+
+    lines += _gauge_lines('instrument', instrument_metrics)
+    for prefix, metrics in (module_metrics or {}).items():
+        lines += _gauge_lines(prefix, metrics)
+    for name, help_text, label, values in labeled_gauges:
+        lines += _labeled_gauge_lines(name, help_text, label, values)
+    return '\n'.join(lines) + '\n'
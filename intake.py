@@ -0,0 +1,137 @@
+"""
+跟團請求收集
+熱門團購開團時，同一團購的併發跟團在程序內排隊，由第一個到達的請求（leader）
+把排隊中的請求合併成一批交給 join_group_batch，整批只需一次保留名額與一次 commit；
+其他請求等待 leader 回填結果。leader 只處理一批，之後由佇列中最前面的請求接手處理下一批
+每個應用程式的 JoinBatcher 由 init_app() 依 JOIN_BATCH_WINDOW_MS、JOIN_BATCH_MAX 建立，
+存在 app.extensions['join_batcher']
+"""
+
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from models import db
+from ordering import JoinRequest, join_group_batch
+
+
+# 批次統計
+intake_metrics = {
+    'requests': 0,
+    'batches': 0,
+    'max_batch_size': 0,
+}
+
+
+class _Ticket:
+    """排隊中的一筆請求"""
+
+    def __init__(self, request):
+        self.request = request
+        self.result = None
+        self.leader = False
+        self.done = threading.Event()
+
+    def resolve(self, result):
+        self.result = result
+        self.done.set()
+
+
+class JoinBatcher:
+    """依團購合併併發的跟團請求
+
+    window 為 leader 開始處理前的等待時間（秒），0 表示只合併已在排隊的請求
+    """
+
+    def __init__(self, window=0.0, max_batch=100):
+        self.window = window
+        self.max_batch = max_batch
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, group_id, request):
+        """送出一筆 JoinRequest，回傳 JoinReceipt 或 JoinRejected"""
+        ticket = _Ticket(request)
+        with self._lock:
+            queue = self._queues.get(group_id)
+            ticket.leader = queue is None
+            if ticket.leader:
+                queue = self._queues[group_id] = []
+            queue.append(ticket)
+
+        if ticket.leader:
+            if self.window:
+                time.sleep(self.window)
+        else:
+            ticket.done.wait()
+            if not ticket.leader:
+                return ticket.result
+            # 由前一個 leader 交棒：等待期間已有請求排隊，不再等待 window
+
+        self._flush(group_id)
+        return ticket.result
+
+    def _flush(self, group_id):
+        """處理佇列最前面的一批（leader 自己排在最前面），之後把 leader 交給下一筆排隊的請求
+
+        每個 leader 只處理一批，持續湧入的請求不會讓 leader 自己的回應一直延後
+        """
+        with self._lock:
+            queue = self._queues[group_id]
+            batch = queue[:self.max_batch]
+            del queue[:self.max_batch]
+        self._process(group_id, batch)
+        with self._lock:
+            if queue:
+                successor = queue[0]
+                successor.leader = True
+                successor.done.set()
+            else:
+                del self._queues[group_id]
+
+    def _process(self, group_id, batch):
+        try:
+            results = join_group_batch(group_id, [ticket.request for ticket in batch])
+        except Exception as e:
+            # 讓每個等待者都拿到錯誤（由 submit_join 拋出），而不是永遠等待
+            db.session.rollback()
+            for ticket in batch:
+                ticket.resolve(e)
+            return
+
+        intake_metrics['requests'] += len(batch)
+        intake_metrics['batches'] += 1
+        intake_metrics['max_batch_size'] = max(intake_metrics['max_batch_size'], len(batch))
+        for ticket, result in zip(batch, results):
+            ticket.resolve(result)
+
+
+# 沒有 app context 時（腳本）使用的 JoinBatcher
+_default_batcher = JoinBatcher()
+
+
+def init_app(app):
+    """依 JOIN_BATCH_WINDOW_MS（毫秒）、JOIN_BATCH_MAX 建立應用程式的 JoinBatcher"""
+    app.extensions['join_batcher'] = JoinBatcher(
+        window=float(app.config.get('JOIN_BATCH_WINDOW_MS') or 0) / 1000,
+        max_batch=int(app.config.get('JOIN_BATCH_MAX') or 100),
+    )
+    return app.extensions['join_batcher']
+
+
+def get_batcher(app=None):
+    """應用程式的 JoinBatcher（預設為目前的應用程式）"""
+    if app is None and has_app_context():
+        app = current_app
+    if app is None:
+        return _default_batcher
+    return app.extensions.get('join_batcher', _default_batcher)
+
+
+def submit_join(group_id, user_id, quantity, idempotency_key=None):
+    """跟團（經由批次收集），回傳 JoinReceipt，失敗時拋出 JoinRejected"""
+    result = get_batcher().submit(group_id, JoinRequest(user_id, quantity, idempotency_key))
+    if isinstance(result, Exception):
+        raise result
+    return result
@@ -0,0 +1,217 @@
+"""
+資料庫版本遷移
+依序執行尚未套用的版本，版本號記錄在 schema_version 表
+PostgreSQL 上的索引以 CREATE INDEX CONCURRENTLY 建立，不會鎖住線上資料表
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, select, text
+
+import partitions
+import queries
+import search
+from instrumentation import explain_sql
+from models import db, GroupBuying, Order, ReplicationHeartbeat
+
+
+MIGRATIONS = []
+
+# 避免多個 worker 同時遷移的 advisory lock 編號
+_ADVISORY_LOCK_ID = 5005
+
+
+def migration(version, description, transactional=True):
+    """註冊遷移版本；transactional=False 的版本以 autocommit 執行"""
+    def decorator(f):
+        MIGRATIONS.append((version, description, transactional, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return decorator
+
+
+# --- 版本 ---
+@migration(1, '建立基本資料表')
+def _initial_schema(conn):
+    db.metadata.create_all(conn)
+
+
+@migration(2, '熱門查詢的複合索引與 ACTIVE 截止時間部分索引', transactional=False)
+def _hot_path_indexes(conn):
+    concurrently = 'CONCURRENTLY ' if conn.dialect.name == 'postgresql' else ''
+    statements = [
+        "ix_group_buying_status_created_at ON group_buying (status, created_at DESC, id DESC)",
+        "ix_group_buying_leader_id_created_at ON group_buying (leader_id, created_at DESC)",
+        "ix_group_buying_deadline ON group_buying (deadline)",
+        "ix_group_buying_active_deadline ON group_buying (deadline) WHERE status = 'ACTIVE'",
+        "ix_orders_user_id_created_at ON orders (user_id, created_at DESC)",
+        "ix_orders_group_buying_id ON orders (group_buying_id)",
+    ]
+    for statement in statements:
+        conn.execute(text(f'CREATE INDEX {concurrently}IF NOT EXISTS {statement}'))
+
+
+@migration(3, '團購版本戳記 updated_at')
+def _group_updated_at(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('group_buying')}
+    if 'updated_at' not in columns:
+        conn.execute(text('ALTER TABLE group_buying ADD COLUMN updated_at TIMESTAMP'))
+    conn.execute(text('UPDATE group_buying SET updated_at = created_at WHERE updated_at IS NULL'))
+
+
+@migration(4, '訂單 idempotency_key 與 (user_id, idempotency_key) 唯一索引', transactional=False)
+def _order_idempotency_key(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('orders')}
+    if 'idempotency_key' not in columns:
+        conn.execute(text('ALTER TABLE orders ADD COLUMN idempotency_key VARCHAR(64)'))
+    concurrently = 'CONCURRENTLY ' if conn.dialect.name == 'postgresql' else ''
+    conn.execute(text(
+        f'CREATE UNIQUE INDEX {concurrently}IF NOT EXISTS ix_orders_user_id_idempotency_key '
+        'ON orders (user_id, idempotency_key)'
+    ))
+
+
+@migration(5, '用戶 auth_version（撤銷登入 session）')
+def _user_auth_version(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+    if 'auth_version' not in columns:
+        conn.execute(text('ALTER TABLE users ADD COLUMN auth_version INTEGER NOT NULL DEFAULT 0'))
+
+
+@migration(6, '複製心跳表（量測副本延遲）')
+def _replication_heartbeat(conn):
+    ReplicationHeartbeat.__table__.create(conn, checkfirst=True)
+
+
+@migration(7, '商品 sku 與唯一索引（批次匯入）', transactional=False)
+def _product_sku(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('products')}
+    if 'sku' not in columns:
+        conn.execute(text('ALTER TABLE products ADD COLUMN sku VARCHAR(64)'))
+    concurrently = 'CONCURRENTLY ' if conn.dialect.name == 'postgresql' else ''
+    conn.execute(text(f'CREATE UNIQUE INDEX {concurrently}IF NOT EXISTS ix_products_sku ON products (sku)'))
+
+
+@migration(8, '全文搜尋索引（PostgreSQL pg_trgm、SQLite FTS5 trigram）', transactional=False)
+def _search_indexes(conn):
+    search.create_indexes(conn)
+
+
+@migration(9, '商品圖片鍵 image_key（本機圖片與縮圖）')
+def _product_image_key(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('products')}
+    if 'image_key' not in columns:
+        conn.execute(text('ALTER TABLE products ADD COLUMN image_key VARCHAR(64)'))
+
+
+@migration(10, '訂單依 created_at 按月分割（PostgreSQL）', transactional=False)
+def _partition_orders(conn):
+    partitions.convert(conn)
+
+
+# --- 執行 ---
+def _ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, '
+        'description VARCHAR(200) NOT NULL, '
+        'applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def current_version(conn):
+    """目前資料庫的版本號（未遷移過為 0）"""
+    _ensure_version_table(conn)
+    return conn.execute(text('SELECT COALESCE(MAX(version), 0) FROM schema_version')).scalar()
+
+
+def _record(conn, version, description):
+    conn.execute(
+        text('INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)'),
+        {'v': version, 'd': description, 't': datetime.utcnow()}
+    )
+
+
+def upgrade(engine=None, target=None, echo=print):
+    """套用所有尚未執行的遷移，回傳套用的版本號列表"""
+    engine = engine or db.engine
+    applied = []
+
+    with engine.connect() as lock_conn:
+        is_postgres = engine.dialect.name == 'postgresql'
+        if is_postgres:
+            lock_conn.execute(text('SELECT pg_advisory_lock(:id)'), {'id': _ADVISORY_LOCK_ID})
+            lock_conn.commit()
+        try:
+            with engine.begin() as conn:
+                version = current_version(conn)
+
+            for number, description, transactional, f in MIGRATIONS:
+                if number <= version or (target is not None and number > target):
+                    continue
+                echo(f'套用版本 {number}: {description}')
+                if transactional:
+                    with engine.begin() as conn:
+                        f(conn)
+                        _record(conn, number, description)
+                else:
+                    with engine.connect() as conn:
+                        f(conn.execution_options(isolation_level='AUTOCOMMIT'))
+                    with engine.begin() as conn:
+                        _record(conn, number, description)
+                applied.append(number)
+        finally:
+            if is_postgres:
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': _ADVISORY_LOCK_ID})
+                lock_conn.commit()
+
+    return applied
+
+
+# --- 索引檢查 ---
+def _hot_queries():
+    """各路由的代表性查詢（名稱, statement）"""
+    now = datetime.utcnow()
+    return [
+        ('browse', select(GroupBuying.id).where(
+            GroupBuying.status == 'ACTIVE', GroupBuying.deadline > now
+        ).order_by(GroupBuying.created_at.desc(), GroupBuying.id.desc()).limit(21)),
+        ('admin (leader)', select(GroupBuying.id).where(
+            GroupBuying.leader_id == 1
+        ).order_by(GroupBuying.created_at.desc()).limit(21)),
+        ('group_detail orders', select(Order.id).where(
+            Order.group_buying_id == 1, Order.created_at >= now - timedelta(days=7)
+        )),
+        ('my_orders', select(Order.id).where(
+            Order.user_id == 1, Order.created_at >= queries.recent_orders_since(now)
+        ).order_by(Order.created_at.desc(), Order.id.desc()).limit(queries.PAGE_SIZE + 1)),
+        ('sweep-deadlines', select(GroupBuying.id).where(
+            GroupBuying.status == 'ACTIVE', GroupBuying.deadline < now
+        ).order_by(GroupBuying.deadline).limit(500)),
+    ]
+
+
+def _explain(conn, statement):
+    """回傳查詢計畫的文字行"""
+    compiled = statement.compile(dialect=conn.dialect)
+    if conn.dialect.name == 'sqlite':
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    return explain_sql(conn, str(compiled), params)
+
+
+def explain_hot_queries(engine=None):
+    """以 EXPLAIN 檢查各路由查詢是否使用索引，回傳 [(名稱, 是否使用索引, 計畫)]"""
+    engine = engine or db.engine
+    results = []
+    with engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            # 小資料表上規劃器會偏好循序掃描，關閉後才能確認索引可用
+            conn.execute(text('SET LOCAL enable_seqscan = off'))
+        for name, statement in _hot_queries():
+            plan = _explain(conn, statement)
+            uses_index = any('Index' in line or 'USING' in line for line in plan)
+            results.append((name, uses_index, plan))
+        conn.rollback()
+    return results
@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+import passwords
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     """用戶表 - 儲存帳號資訊、名稱、email、密碼、角色"""
@@ -14,6 +15,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     role = db.Column(db.String(20), default='member')  # 'member' or 'leader'
+    auth_version = db.Column(db.Integer, nullable=False, default=0)  # 遞增時既有的登入 session 失效
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -21,12 +23,12 @@ class User(db.Model):
     orders = db.relationship('Order', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        """設置密碼（加密）"""
-        self.password_hash = generate_password_hash(password)
+        """設置密碼（加密，參數見 passwords.py）"""
+        self.password_hash = passwords.hash_password(password)
     
     def check_password(self, password):
         """驗證密碼"""
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify_password(self.password_hash, password)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -37,16 +39,23 @@ class Product(db.Model):
     __tablename__ = 'products'
     
     id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(64))  # 供應商料號，批次匯入時以此比對既有商品
     name = db.Column(db.String(200), nullable=False)
     price = db.Column(db.Float, nullable=False)
     stock_quantity = db.Column(db.Integer, default=0)
     description = db.Column(db.Text)
     image_url = db.Column(db.String(500))
+    image_key = db.Column(db.String(64))  # 已下載或上傳的圖片（見 images.py），image_url 改變時清空
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     group_buyings = db.relationship('GroupBuying', backref='product', lazy=True)
     
+    # Indexes
+    __table_args__ = (
+        db.Index('ix_products_sku', 'sku', unique=True),
+    )
+    
     def __repr__(self):
         return f'<Product {self.name}>'
 
@@ -65,10 +74,21 @@ class GroupBuying(db.Model):
     deadline = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.String(20), default='ACTIVE')  # ACTIVE, CLOSED, SUCCESS, FAILED
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # 版本戳記
     
     # Relationships
     orders = db.relationship('Order', backref='group_buying', lazy=True, cascade='all, delete-orphan')
     
+    # Indexes（新增索引時也要在 migrations.py 加入對應版本）
+    __table_args__ = (
+        db.Index('ix_group_buying_status_created_at', 'status', created_at.desc(), id.desc()),
+        db.Index('ix_group_buying_leader_id_created_at', 'leader_id', created_at.desc()),
+        db.Index('ix_group_buying_deadline', 'deadline'),
+        db.Index('ix_group_buying_active_deadline', 'deadline',
+                 postgresql_where=db.text("status = 'ACTIVE'"),
+                 sqlite_where=db.text("status = 'ACTIVE'")),
+    )
+    
     @property
     def progress_percentage(self):
         """計算進度百分比"""
@@ -91,10 +111,70 @@ class GroupBuying(db.Model):
         """檢查是否已過期"""
         return datetime.utcnow() > self.deadline
     
+    def to_progress_dict(self):
+        """即時進度推送的資料"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'current_quantity': self.current_quantity,
+            'target_quantity': self.target_quantity,
+            'remaining_slots': self.remaining_slots,
+            'progress_percentage': self.progress_percentage,
+        }
+    
+    def to_card_dict(self):
+        """團購卡片資料（JSON 列表與快取用，只含可序列化的值）"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'status': self.status,
+            'product': {
+                'id': self.product.id,
+                'name': self.product.name,
+                'price': self.product.price,
+                'description': self.product.description,
+                'image_url': self.product.image_url,
+                'image_key': self.product.image_key,
+            },
+            'leader': {'id': self.leader.id, 'name': self.leader.name},
+            'target_quantity': self.target_quantity,
+            'current_quantity': self.current_quantity,
+            'remaining_slots': self.remaining_slots,
+            'progress_percentage': self.progress_percentage,
+            'deadline': self.deadline.isoformat(),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+    
     def __repr__(self):
         return f'<GroupBuying {self.name}>'
 
 
+class GroupCard:
+    """由 to_card_dict() 資料還原的唯讀團購卡片，模板可用與 GroupBuying 相同的屬性讀取"""
+    
+    def __init__(self, data):
+        self.data = data
+        self.deadline = datetime.fromisoformat(data['deadline'])
+        self.created_at = datetime.fromisoformat(data['created_at']) if data['created_at'] else None
+        self.updated_at = datetime.fromisoformat(data['updated_at']) if data['updated_at'] else None
+    
+    def __getattr__(self, name):
+        try:
+            return self.data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+    
+    @property
+    def is_expired(self):
+        """檢查是否已過期"""
+        return datetime.utcnow() > self.deadline
+    
+    def __repr__(self):
+        return f'<GroupCard {self.id}>'
+
+
 class Order(db.Model):
     """訂單表 - 記錄用戶訂單、數量、關聯團購、付款狀態"""
     __tablename__ = 'orders'
@@ -105,7 +185,27 @@ class Order(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
     payment_status = db.Column(db.String(20), default='PENDING')  # PENDING, PAID, CANCELLED
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    idempotency_key = db.Column(db.String(64))  # 跟團請求的重送識別碼
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # PostgreSQL 上為分割鍵
+    
+    # Indexes
+    __table_args__ = (
+        db.Index('ix_orders_user_id_created_at', 'user_id', created_at.desc()),
+        db.Index('ix_orders_group_buying_id', 'group_buying_id'),
+        # PostgreSQL 分割後（partitions.py）此索引不再唯一，由 ordering.py 以 advisory lock 避免重複
+        db.Index('ix_orders_user_id_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+    )
     
     def __repr__(self):
         return f'<Order {self.id}>'
+
+
+class ReplicationHeartbeat(db.Model):
+    """複製心跳 - 主資料庫定期寫入，從副本讀回的時間差即為複製延遲"""
+    __tablename__ = 'replication_heartbeat'
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ReplicationHeartbeat {self.beat_at}>'
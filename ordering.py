@@ -0,0 +1,223 @@
+"""
+跟團下單
+以單一條件式 UPDATE 原子地保留名額，避免併發跟團超賣
+同一團購的多筆跟團可合併成一個交易（join_group_batch，由 intake.py 收集），
+並以 (user_id, idempotency_key) 讓重送的請求回傳原本的訂單
+orders 分割後 (user_id, idempotency_key) 無法建立跨分割區的唯一索引，PostgreSQL 上改以
+transaction 層級的 advisory lock 讓相同 key 的請求依序處理
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, GroupBuying, Order, Product
+import cache
+import pubsub
+from counters import mark_counted
+
+
+# 一筆跟團請求；idempotency_key 為 None 時不做重送判斷
+JoinRequest = namedtuple('JoinRequest', 'user_id quantity idempotency_key')
+
+# 重送判斷只查最近這段時間的訂單（created_at 條件讓 PostgreSQL 只掃描最近的分割區）
+IDEMPOTENCY_WINDOW = timedelta(days=7)
+
+# 跟團結果；replayed 表示是先前以相同 key 建立的訂單
+JoinReceipt = namedtuple('JoinReceipt', 'id group_id quantity total_price payment_status replayed')
+
+
+class JoinRejected(Exception):
+    """跟團被拒絕（reason: not_found / closed / expired / sold_out / invalid_quantity）"""
+
+    def __init__(self, reason, remaining=0):
+        super().__init__(reason)
+        self.reason = reason
+        self.remaining = remaining
+
+
+def reserve_slots(group_id, quantity, now=None):
+    """原子地將 current_quantity 增加 quantity，名額不足時不更新
+
+    成功時回傳更新後的 (current_quantity, target_quantity, status)，失敗回傳 None
+    """
+    now = now or datetime.utcnow()
+    new_quantity = GroupBuying.current_quantity + quantity
+
+    result = db.session.execute(
+        update(GroupBuying)
+        .where(
+            GroupBuying.id == group_id,
+            GroupBuying.status == 'ACTIVE',
+            GroupBuying.deadline > now,
+            new_quantity <= GroupBuying.target_quantity,
+        )
+        .values(
+            current_quantity=new_quantity,
+            status=case(
+                (new_quantity >= GroupBuying.target_quantity, 'SUCCESS'),
+                else_=GroupBuying.status,
+            ),
+        )
+        .returning(GroupBuying.current_quantity, GroupBuying.target_quantity, GroupBuying.status)
+        .execution_options(synchronize_session=False)
+    )
+    return result.first()
+
+
+def _group_state(group_id):
+    """團購目前的狀態、數量與單價"""
+    return db.session.execute(
+        select(GroupBuying.status, GroupBuying.deadline,
+               GroupBuying.target_quantity, GroupBuying.current_quantity, Product.price)
+        .join(Product, GroupBuying.product_id == Product.id)
+        .where(GroupBuying.id == group_id)
+    ).first()
+
+
+def _closed_rejection(group, now):
+    """團購不接受跟團時回傳對應的 JoinRejected，否則回傳 None"""
+    if group is None:
+        return JoinRejected('not_found')
+    if group.status == 'SUCCESS' and group.current_quantity >= group.target_quantity:
+        return JoinRejected('sold_out')
+    if group.status != 'ACTIVE':
+        return JoinRejected('closed')
+    if group.deadline <= now:
+        return JoinRejected('expired')
+    return None
+
+
+def _lock_idempotency_keys(pairs):
+    """PostgreSQL 上依序取得各 (user_id, idempotency_key) 的 advisory lock，直到交易結束
+
+    排序後取得以免兩批請求互相等待；SQLite 的寫入本來就是序列化的，且仍有唯一索引
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for user_id, key in sorted(pairs):
+        db.session.execute(select(func.pg_advisory_xact_lock(func.hashtextextended(f'{user_id}:{key}', 0))))
+
+
+def _existing_receipts(requests, now):
+    """已以相同 (user_id, idempotency_key) 建立的訂單 -> JoinReceipt"""
+    pairs = {(r.user_id, r.idempotency_key) for r in requests if r.idempotency_key}
+    if not pairs:
+        return {}
+    _lock_idempotency_keys(pairs)
+    rows = db.session.execute(
+        select(Order.id, Order.group_buying_id, Order.quantity, Order.total_price,
+               Order.payment_status, Order.user_id, Order.idempotency_key)
+        .where(tuple_(Order.user_id, Order.idempotency_key).in_(pairs),
+               Order.created_at >= now - IDEMPOTENCY_WINDOW)
+    ).all()
+    return {
+        (row.user_id, row.idempotency_key): JoinReceipt(
+            row.id, row.group_buying_id, row.quantity, row.total_price, row.payment_status, True)
+        for row in rows
+    }
+
+
+def join_group_batch(group_id, requests):
+    """在同一交易中處理同一團購的多筆跟團，回傳與 requests 對應的 JoinReceipt 或 JoinRejected
+
+    依送出順序分配名額，整批只更新一次 current_quantity；保留名額仍由 reserve_slots
+    的條件式 UPDATE 把關，其他程序同時跟團導致保留失敗時重新讀取並重新分配
+    """
+    results = [None] * len(requests)
+    pending = []
+    for i, request in enumerate(requests):
+        if request.quantity < 1:
+            results[i] = JoinRejected('invalid_quantity')
+        else:
+            pending.append(i)
+
+    aliases = {}
+    while pending:
+        now = datetime.utcnow()
+
+        # 重送的請求直接回傳原本的訂單；同一批內重複的 key 共用第一筆的結果
+        replayed = _existing_receipts([requests[i] for i in pending], now)
+        fresh, first_by_key, aliases = [], {}, {}
+        for i in pending:
+            request = requests[i]
+            key = (request.user_id, request.idempotency_key) if request.idempotency_key else None
+            if key in replayed:
+                results[i] = replayed[key]
+            elif key in first_by_key:
+                aliases[i] = first_by_key[key]
+            else:
+                if key:
+                    first_by_key[key] = i
+                fresh.append(i)
+
+        group = _group_state(group_id)
+        rejection = _closed_rejection(group, now)
+        if rejection is not None:
+            for i in fresh:
+                results[i] = rejection
+            db.session.rollback()  # 只讀取過資料，結束交易以釋放 advisory lock
+            break
+
+        accepted = []
+        remaining = group.target_quantity - group.current_quantity
+        for i in fresh:
+            if requests[i].quantity <= remaining:
+                accepted.append(i)
+                remaining -= requests[i].quantity
+            else:
+                results[i] = JoinRejected('sold_out', max(remaining, 0))
+        if not accepted:
+            db.session.rollback()
+            break
+
+        reserved = reserve_slots(group_id, sum(requests[i].quantity for i in accepted), now)
+        if reserved is None:
+            db.session.rollback()
+            continue
+
+        orders = []
+        for i in accepted:
+            order = Order(
+                user_id=requests[i].user_id,
+                group_buying_id=group_id,
+                quantity=requests[i].quantity,
+                total_price=group.price * requests[i].quantity,
+                idempotency_key=requests[i].idempotency_key
+            )
+            mark_counted(order)  # 數量已由 reserve_slots 計入
+            orders.append(order)
+        db.session.add_all(orders)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # 其他程序同時以相同的 idempotency key 建立了訂單，重新處理以回傳該訂單
+            db.session.rollback()
+            continue
+
+        for i, order in zip(accepted, orders):
+            results[i] = JoinReceipt(order.id, group_id, order.quantity, order.total_price,
+                                     order.payment_status, False)
+        db.session.commit()
+        cache.invalidate_groups(group_id)
+        pubsub.publish_group_progress(GroupBuying(
+            id=group_id,
+            current_quantity=reserved.current_quantity,
+            target_quantity=reserved.target_quantity,
+            status=reserved.status
+        ))
+        break
+
+    for i, first in aliases.items():
+        results[i] = results[first]
+    return results
+
+
+def join_group_atomic(group_id, user_id, quantity, idempotency_key=None):
+    """保留名額並建立訂單（同一交易），回傳 JoinReceipt，失敗時拋出 JoinRejected"""
+    result = join_group_batch(group_id, [JoinRequest(user_id, quantity, idempotency_key)])[0]
+    if isinstance(result, JoinRejected):
+        raise result
+    return result
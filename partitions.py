@@ -0,0 +1,333 @@
+"""
+訂單分割區（PostgreSQL 依 created_at 按月 RANGE 分割）
+orders 只會成長，分割後帶有 created_at 條件的查詢只掃描涵蓋的月份（partition pruning）：
+- 遷移時將原本的 orders 改名為 orders_legacy，以 ATTACH 掛在新的分割表下，涵蓋遷移當月以前的所有訂單；
+  事先以 NOT VALID + VALIDATE 的 CHECK 條件與 CONCURRENTLY 建立的索引讓 ATTACH 不需重新掃描或建索引，
+  只在最後的改名交易中短暫鎖表
+- 每月一個分割區 orders_pYYYYMM，maintain() 預先建立未來 PREMAKE_MONTHS 個月；
+  另有 orders_default 接住超出範圍的訂單，補建分割區時再搬回對應的月份
+- 封存：超過 ORDERS_ARCHIVE_AFTER_MONTHS 個月、且沒有進行中團購的分割區執行 VACUUM FREEZE
+  （之後不需再做防回捲的清理），設定 ORDERS_ARCHIVE_TABLESPACE 時搬到較便宜的 tablespace；
+  封存的分割區仍掛在 orders 下，Order 模型與我的訂單都能查到
+- 設定 ORDERS_RETENTION_MONTHS 時，更舊的已封存分割區會 DETACH 成獨立資料表（不再經由 orders 查詢），
+  可自行匯出或刪除
+SQLite 不支援分割，所有函式皆不做事
+"""
+
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models import db
+
+
+PARENT_TABLE = 'orders'
+LEGACY_PARTITION = 'orders_legacy'
+DEFAULT_PARTITION = 'orders_default'
+PARTITION_PREFIX = 'orders_p'
+
+PREMAKE_MONTHS = 3
+ARCHIVE_AFTER_MONTHS = 6
+ARCHIVED_COMMENT = 'archived'
+
+# 切換時等待鎖的上限，避免排在長查詢後面時擋住所有訂單寫入
+SWAP_LOCK_TIMEOUT = '5s'
+
+# 分割區：lower 為 None 表示 MINVALUE，default 分割區的 lower、upper 皆為 None
+Partition = namedtuple('Partition', 'name lower upper archived rows tablespace')
+
+partition_metrics = {
+    'partitions': 0,
+    'created': 0,
+    'archived': 0,
+    'detached': 0,
+    'moved_rows': 0,
+    'default_rows': 0,
+    'last_maintenance_at': None,
+}
+
+_BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+# --- 月份 ---
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month:%Y%m}'
+
+
+def _literal(value):
+    # 分割範圍與 CHECK 條件必須是常數，不能使用參數
+    return f"'{value:%Y-%m-%d %H:%M:%S}'"
+
+
+# --- 查詢分割區 ---
+def is_partitioned(conn):
+    """orders 是否已是分割表"""
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))'
+    ), {'name': PARENT_TABLE}).scalar()
+
+
+def _parse_bound(value):
+    if value == 'MINVALUE':
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def list_partitions(conn):
+    """orders 目前的分割區，依範圍排序（default 分割區排在最後）"""
+    if not is_partitioned(conn):
+        return []
+    rows = conn.execute(text(
+        'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), obj_description(c.oid, \'pg_class\'), '
+        'c.reltuples, t.spcname '
+        'FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'LEFT JOIN pg_tablespace t ON t.oid = c.reltablespace '
+        'WHERE i.inhparent = to_regclass(:name)'
+    ), {'name': PARENT_TABLE}).all()
+    partitions = []
+    for name, bound, comment, rows_estimate, tablespace in rows:
+        match = _BOUND.search(bound)
+        lower, upper = (_parse_bound(match.group(1)), _parse_bound(match.group(2))) if match else (None, None)
+        partitions.append(Partition(name, lower, upper, comment == ARCHIVED_COMMENT,
+                                    max(int(rows_estimate), 0), tablespace))
+    partitions.sort(key=lambda p: (p.upper is None, p.upper or datetime.min))
+    return partitions
+
+
+def _covered(partitions, month):
+    return any(p.upper is not None and (p.lower is None or p.lower <= month) and month < p.upper
+               for p in partitions)
+
+
+# --- 轉換 ---
+def convert(conn, now=None):
+    """將 orders 轉為按月分割的資料表（遷移呼叫，需以 autocommit 連線執行），已轉換時回傳 False"""
+    if conn.dialect.name != 'postgresql' or is_partitioned(conn):
+        return False
+    now = now or datetime.utcnow()
+    boundary = add_months(month_start(now), 1)
+
+    # 舊資料表涵蓋到下個月之前；先以 CHECK 條件證明範圍，ATTACH 與 SET NOT NULL 就不需要在鎖表時掃描
+    conn.execute(text('UPDATE orders SET created_at = now() AT TIME ZONE \'UTC\' WHERE created_at IS NULL'))
+    conn.execute(text('ALTER TABLE orders DROP CONSTRAINT IF EXISTS orders_legacy_range'))
+    conn.execute(text(
+        'ALTER TABLE orders ADD CONSTRAINT orders_legacy_range '
+        f'CHECK (created_at IS NOT NULL AND created_at < {_literal(boundary)}) NOT VALID'
+    ))
+    conn.execute(text('ALTER TABLE orders VALIDATE CONSTRAINT orders_legacy_range'))
+
+    # 分割表的主鍵必須包含分割鍵；(user_id, idempotency_key) 無法在各分割區間保證唯一，改由 ordering.py 的
+    # advisory lock 避免重複，這裡建立對應分割表索引的一般索引，ATTACH 時直接沿用
+    conn.execute(text(
+        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS orders_legacy_pkey ON orders (id, created_at)'
+    ))
+    conn.execute(text(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_legacy_user_id_idempotency_key_idx '
+        'ON orders (user_id, idempotency_key)'
+    ))
+
+    with conn.engine.begin() as swap:
+        swap.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+        swap.execute(text('LOCK TABLE orders IN ACCESS EXCLUSIVE MODE'))
+        swap.execute(text('ALTER TABLE orders ALTER COLUMN created_at SET NOT NULL'))
+        swap.execute(text('ALTER TABLE orders DROP CONSTRAINT orders_pkey'))
+        swap.execute(text('ALTER TABLE orders ADD CONSTRAINT orders_legacy_pkey PRIMARY KEY USING INDEX orders_legacy_pkey'))
+        swap.execute(text('DROP INDEX IF EXISTS ix_orders_user_id_idempotency_key'))
+        swap.execute(text('ALTER INDEX IF EXISTS ix_orders_user_id_created_at RENAME TO orders_legacy_user_id_created_at_idx'))
+        swap.execute(text('ALTER INDEX IF EXISTS ix_orders_group_buying_id RENAME TO orders_legacy_group_buying_id_idx'))
+        swap.execute(text(f'ALTER TABLE orders RENAME TO {LEGACY_PARTITION}'))
+
+        # 分割表沿用原本的欄位、預設值（id 序列）、索引名稱與外鍵；分割表上尚無資料，建立索引不需時間
+        swap.execute(text(
+            f'CREATE TABLE orders (LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'
+        ))
+        swap.execute(text('ALTER TABLE orders ADD CONSTRAINT orders_pkey PRIMARY KEY (id, created_at)'))
+        swap.execute(text('ALTER TABLE orders ADD CONSTRAINT orders_user_id_fkey '
+                          'FOREIGN KEY (user_id) REFERENCES users (id)'))
+        swap.execute(text('ALTER TABLE orders ADD CONSTRAINT orders_group_buying_id_fkey '
+                          'FOREIGN KEY (group_buying_id) REFERENCES group_buying (id)'))
+        swap.execute(text('CREATE INDEX ix_orders_user_id_created_at ON orders (user_id, created_at DESC)'))
+        swap.execute(text('CREATE INDEX ix_orders_group_buying_id ON orders (group_buying_id)'))
+        swap.execute(text('CREATE INDEX ix_orders_user_id_idempotency_key ON orders (user_id, idempotency_key)'))
+        swap.execute(text('ALTER SEQUENCE orders_id_seq OWNED BY orders.id'))
+        swap.execute(text(f'ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN id DROP DEFAULT'))
+        swap.execute(text(
+            f'ALTER TABLE orders ATTACH PARTITION {LEGACY_PARTITION} '
+            f'FOR VALUES FROM (MINVALUE) TO ({_literal(boundary)})'
+        ))
+        swap.execute(text(f'ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT orders_legacy_range'))
+
+    ensure_partitions(conn, now)
+    return True
+
+
+# --- 建立分割區 ---
+def _move_from_default(conn, name, month, upper):
+    """default 分割區中已有該月份的訂單時，在同一交易中卸下 default、建立分割區並搬移，回傳搬移筆數"""
+    with conn.engine.begin() as tx:
+        tx.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+        tx.execute(text(f'ALTER TABLE orders DETACH PARTITION {DEFAULT_PARTITION}'))
+        tx.execute(text(
+            f'CREATE TABLE {name} PARTITION OF orders FOR VALUES FROM ({_literal(month)}) TO ({_literal(upper)})'
+        ))
+        moved = tx.execute(text(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :lower AND created_at < :upper '
+            f'RETURNING *) INSERT INTO orders SELECT * FROM moved'
+        ), {'lower': month, 'upper': upper}).rowcount
+        tx.execute(text(f'ALTER TABLE orders ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT'))
+    return moved
+
+
+def _create_partition(conn, name, month, has_default):
+    upper = add_months(month, 1)
+    stray = has_default and conn.execute(text(
+        f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= :lower AND created_at < :upper)'
+    ), {'lower': month, 'upper': upper}).scalar()
+    if stray:
+        partition_metrics['moved_rows'] += _move_from_default(conn, name, month, upper)
+    else:
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF orders '
+            f'FOR VALUES FROM ({_literal(month)}) TO ({_literal(upper)})'
+        ))
+
+
+def ensure_partitions(conn, now=None, months=PREMAKE_MONTHS):
+    """建立到本月後 months 個月為止缺少的分割區與 default 分割區，回傳新建的分割區名稱
+
+    維護中斷過時，從最後一個分割區之後的月份開始補建，落在 default 分割區的訂單搬回對應的月份
+    """
+    if not is_partitioned(conn):
+        return []
+    now = now or datetime.utcnow()
+    partitions = list_partitions(conn)
+    has_default = any(p.name == DEFAULT_PARTITION for p in partitions)
+    created = []
+
+    # 維護中斷過時從最後一個分割區的上限開始補建，否則從本月開始
+    last = add_months(month_start(now), months)
+    uppers = [p.upper for p in partitions if p.upper is not None]
+    month = min(max(uppers), month_start(now)) if uppers else month_start(now)
+    while month <= last:
+        if not _covered(partitions, month):
+            name = partition_name(month)
+            _create_partition(conn, name, month, has_default)
+            partitions.append(Partition(name, month, add_months(month, 1), False, 0, None))
+            created.append(name)
+        month = add_months(month, 1)
+
+    if not has_default:
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF orders DEFAULT'))
+    partition_metrics['created'] += len(created)
+    return created
+
+
+# --- 封存 ---
+def _has_active_orders(conn, partition):
+    return conn.execute(text(
+        f'SELECT EXISTS (SELECT 1 FROM {partition.name} o JOIN group_buying g ON g.id = o.group_buying_id '
+        "WHERE g.status = 'ACTIVE')"
+    )).scalar()
+
+
+def archive_partitions(conn, now=None, after_months=ARCHIVE_AFTER_MONTHS, tablespace=None):
+    """封存超過 after_months 個月且沒有進行中團購的分割區，回傳封存的分割區名稱"""
+    now = now or datetime.utcnow()
+    cutoff = add_months(month_start(now), -after_months)
+    archived = []
+    for partition in list_partitions(conn):
+        if partition.archived or partition.upper is None or partition.upper > cutoff:
+            continue
+        if _has_active_orders(conn, partition):
+            continue
+        if tablespace and partition.tablespace != tablespace:
+            # 分割區已經不再寫入，搬移時的鎖只影響查詢舊訂單的請求
+            conn.execute(text(f'ALTER TABLE {partition.name} SET TABLESPACE {tablespace}'))
+            for index in conn.execute(text('SELECT indexname FROM pg_indexes WHERE tablename = :name'),
+                                      {'name': partition.name}).scalars():
+                conn.execute(text(f'ALTER INDEX {index} SET TABLESPACE {tablespace}'))
+        conn.execute(text(f'VACUUM (FREEZE, ANALYZE) {partition.name}'))
+        conn.execute(text(f"COMMENT ON TABLE {partition.name} IS '{ARCHIVED_COMMENT}'"))
+        archived.append(partition.name)
+    partition_metrics['archived'] += len(archived)
+    return archived
+
+
+def detach_partitions(conn, now=None, retention_months=None):
+    """將超過保存期限的已封存分割區 DETACH 成獨立資料表，回傳分割區名稱（未設定保存期限時不做事）"""
+    if not retention_months:
+        return []
+    now = now or datetime.utcnow()
+    cutoff = add_months(month_start(now), -retention_months)
+    detached = []
+    for partition in list_partitions(conn):
+        if partition.archived and partition.upper is not None and partition.upper <= cutoff:
+            conn.execute(text(f'ALTER TABLE orders DETACH PARTITION {partition.name}'))
+            conn.execute(text(f"COMMENT ON TABLE {partition.name} IS 'detached from orders'"))
+            detached.append(partition.name)
+    partition_metrics['detached'] += len(detached)
+    return detached
+
+
+# --- 維護 ---
+def maintain(engine=None, now=None, months=PREMAKE_MONTHS, archive_after=ARCHIVE_AFTER_MONTHS,
+             tablespace=None, retention_months=None):
+    """建立未來的分割區、封存與卸下舊分割區，回傳 {'created', 'archived', 'detached'}"""
+    engine = engine or db.engine
+    now = now or datetime.utcnow()
+    result = {'created': [], 'archived': [], 'detached': []}
+    if engine.dialect.name != 'postgresql':
+        return result
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        if not is_partitioned(conn):
+            return result
+        result['created'] = ensure_partitions(conn, now, months)
+        if archive_after:
+            result['archived'] = archive_partitions(conn, now, archive_after, tablespace)
+        result['detached'] = detach_partitions(conn, now, retention_months)
+        partitions = list_partitions(conn)
+        partition_metrics['partitions'] = len(partitions)
+        partition_metrics['default_rows'] = conn.execute(
+            text(f'SELECT count(*) FROM {DEFAULT_PARTITION}')
+        ).scalar()
+    partition_metrics['last_maintenance_at'] = now
+    return result
+
+
+def maintenance_options(app):
+    """從設定讀取 maintain() 的參數（ORDERS_ARCHIVE_AFTER_MONTHS 設為 0 停用封存）"""
+    archive_after = app.config.get('ORDERS_ARCHIVE_AFTER_MONTHS')
+    retention = app.config.get('ORDERS_RETENTION_MONTHS')
+    return {
+        'archive_after': ARCHIVE_AFTER_MONTHS if archive_after is None else int(archive_after),
+        'tablespace': app.config.get('ORDERS_ARCHIVE_TABLESPACE') or None,
+        'retention_months': int(retention) if retention else None,
+    }
+
+
+def run_forever(app, interval=3600, months=PREMAKE_MONTHS):
+    """每 interval 秒執行一次 maintain()（flask partition-orders），失敗時記錄後下次重試"""
+    while True:
+        with app.app_context():
+            try:
+                result = maintain(months=months, **maintenance_options(app))
+                app.logger.info('orders partitions: created %s, archived %s, detached %s',
+                                result['created'], result['archived'], result['detached'])
+            except Exception:
+                app.logger.exception('orders partition maintenance failed')
+        time.sleep(interval)
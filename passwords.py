@@ -0,0 +1,220 @@
+"""
+密碼雜湊
+- 雜湊參數可設定（PASSWORD_HASH_METHOD，Werkzeug 格式，例如 scrypt:32768:8:1、pbkdf2:sha256:600000），
+  參數改變後，舊雜湊會在下次登入成功時重新雜湊
+- 雜湊與驗證交給固定大小的執行緒池，排隊過多時直接拒絕（PasswordPoolBusy），
+  避免登入尖峰佔滿 worker 而拖慢瀏覽等其他請求
+- AttemptLimiter 在雜湊之前擋下對同一帳號的大量嘗試
+雜湊參數取自應用程式設定，執行緒池與嘗試次數限制由 init_app() 建立，
+存在 app.extensions['password_pool'] 與 app.extensions['login_limiter']
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    from gevent import get_hub
+    from gevent.monkey import is_module_patched
+except ImportError:  # 未使用 gevent worker
+    get_hub = None
+
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+class PasswordPoolBusy(Exception):
+    """雜湊執行緒池已滿"""
+
+
+# --- 雜湊參數 ---
+# 參數 -> 正規化的參數字串（例如 scrypt -> scrypt:32768:8:1）
+_method_prefixes = {}
+
+
+def current_method():
+    """目前應用程式的雜湊參數（PASSWORD_HASH_METHOD，未設定時為預設值）"""
+    if has_app_context():
+        return current_app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_METHOD
+    return DEFAULT_METHOD
+
+
+def hash_password(password, method=None):
+    return generate_password_hash(password, method or current_method())
+
+
+def verify_password(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """雜湊的參數與目前設定不同"""
+    method = current_method()
+    prefix = _method_prefixes.get(method)
+    if prefix is None:
+        # 以實際產生的雜湊取得正規化的參數字串；第一次檢查時才計算（scrypt 約 100ms，不佔用啟動時間）
+        prefix = _method_prefixes[method] = generate_password_hash('', method).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != prefix
+
+
+# --- 執行緒池 ---
+class HashPool:
+    """固定大小的雜湊執行緒池；執行中加上排隊的工作超過 max_pending 時拋出 PasswordPoolBusy
+
+    使用 gevent worker 時改用 gevent 的原生執行緒池，否則被 monkey patch 的執行緒只是 greenlet，
+    雜湊仍會佔住事件迴圈；hub 的執行緒池與其他工作共用，同時送進去的雜湊以 workers 個名額限制
+    """
+
+    def __init__(self, workers=2, max_pending=32):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._running = threading.BoundedSemaphore(workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _submit(self, f, *args):
+        if get_hub is not None and is_module_patched('threading'):
+            # monkey patch 後的 Semaphore 等待時會交出控制權
+            with self._running:
+                return get_hub().threadpool.spawn(f, *args).get()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='password-hash')
+        return self._executor.submit(f, *args).result()
+
+    def run(self, f, *args):
+        """在池中執行 f(*args) 並等待結果"""
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            return self._submit(f, *args)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# 沒有 app context 時（腳本）使用的執行緒池
+_default_pool = HashPool()
+
+
+def init_app(app):
+    """依 PASSWORD_HASH_WORKERS、PASSWORD_HASH_MAX_PENDING 建立應用程式的執行緒池，
+    依 LOGIN_ATTEMPT_LIMIT、LOGIN_ATTEMPT_WINDOW、LOGIN_ATTEMPT_MAX_KEYS 建立嘗試次數限制
+    """
+    app.extensions['password_pool'] = HashPool(
+        int(app.config.get('PASSWORD_HASH_WORKERS') or 2),
+        int(app.config.get('PASSWORD_HASH_MAX_PENDING') or 32),
+    )
+    app.extensions['login_limiter'] = AttemptLimiter(
+        limit=int(app.config.get('LOGIN_ATTEMPT_LIMIT') or 10),
+        window=int(app.config.get('LOGIN_ATTEMPT_WINDOW') or 60),
+        max_keys=int(app.config.get('LOGIN_ATTEMPT_MAX_KEYS') or 10000),
+    )
+    return app.extensions['password_pool']
+
+
+def get_pool(app=None):
+    """應用程式的執行緒池（預設為目前的應用程式）"""
+    if app is None and has_app_context():
+        app = current_app
+    if app is None:
+        return _default_pool
+    return app.extensions.get('password_pool', _default_pool)
+
+
+def hash_password_offloaded(password):
+    # 參數在目前的執行緒取得：池中的執行緒沒有 app context
+    return get_pool().run(hash_password, password, current_method())
+
+
+def verify_password_offloaded(password_hash, password):
+    return get_pool().run(verify_password, password_hash, password)
+
+
+# --- 嘗試次數限制 ---
+class AttemptLimiter:
+    """每個帳號在 window 秒內最多 limit 次失敗的登入嘗試（程序內）
+
+    每隔 window 秒清掉已過期的帳號；帳號數超過 max_keys 時淘汰最久沒有失敗紀錄的帳號，
+    大量不同帳號的嘗試不會讓記憶體無限成長
+    """
+
+    def __init__(self, limit=10, window=60, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + window
+
+    def _prune(self, attempts, now):
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+
+    def allow(self, key):
+        """還能嘗試時回傳 True（不計入次數）"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                return True
+            self._prune(attempts, now)
+            if not attempts:
+                del self._attempts[key]
+                return True
+            return len(attempts) < self.limit
+
+    def _sweep(self, now):
+        """清掉所有已過期的帳號"""
+        for key in [key for key, attempts in self._attempts.items() if attempts[-1] <= now - self.window]:
+            del self._attempts[key]
+        self._next_sweep = now + self.window
+
+    def record_failure(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            # 重新插入到最後，字典順序即為最近失敗的順序
+            attempts = self._attempts.pop(key, None) or deque()
+            self._prune(attempts, now)
+            attempts.append(now)
+            self._attempts[key] = attempts
+            while len(self._attempts) > self.max_keys:
+                del self._attempts[next(iter(self._attempts))]
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def retry_after(self, key):
+        """距離可再嘗試的秒數"""
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if not attempts or len(attempts) < self.limit:
+                return 0
+            return max(int(attempts[0] + self.window - time.monotonic()) + 1, 0)
+
+
+# 沒有 app context 時（腳本）使用的嘗試次數限制
+_default_limiter = AttemptLimiter()
+
+
+def get_limiter(app=None):
+    """應用程式的嘗試次數限制（預設為目前的應用程式）"""
+    if app is None and has_app_context():
+        app = current_app
+    if app is None:
+        return _default_limiter
+    return app.extensions.get('login_limiter', _default_limiter)
@@ -0,0 +1,341 @@
+"""
+發布 / 訂閱
+寫入路徑（跟團、關閉團購、截止掃描）發布團購進度，/group/<id>/events 以 SSE 推送給觀看者
+- InProcessBroker：同一程序內的訂閱者（預設）
+- HubBroker：連到 `flask pubsub-hub` 啟動的轉發程序，讓多個 worker 之間也能互相推送
+  （換行分隔的 JSON 訊框，連線以 SECRET_KEY 做 HMAC 驗證）
+
+每個訂閱只保留最新一則訊息（進度只需要最新狀態），閒置的觀看者幾乎不佔資源；
+SSE 連線需要搭配 gevent 等非同步 worker，才不會一條連線佔用一個 worker
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import socket
+import threading
+from collections import defaultdict
+
+from flask import current_app, has_app_context
+
+
+# 轉發程序連線的單一訊框上限（進度訊息只有數十位元組）
+MAX_FRAME_BYTES = 64 * 1024
+# 連線與驗證的逾時秒數；驗證後讀取不設逾時
+HANDSHAKE_TIMEOUT = 5
+
+
+class _JsonConnection:
+    """以換行分隔的 JSON 訊框；只使用 socket 模組，gevent monkey patch 後讀寫會交出控制權
+
+    不使用 pickle：連線另一端即使通過驗證也只能送出資料，無法在本程序執行程式碼
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._reader = sock.makefile('rb')
+        self._send_lock = threading.Lock()
+
+    def send(self, frame):
+        data = json.dumps(frame, separators=(',', ':')).encode() + b'\n'
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def recv(self):
+        line = self._reader.readline(MAX_FRAME_BYTES + 1)
+        if not line:
+            raise EOFError
+        if len(line) > MAX_FRAME_BYTES or not line.endswith(b'\n'):
+            raise EOFError('訊框過長')
+        try:
+            frame = json.loads(line)
+        except ValueError:
+            raise EOFError('訊框格式錯誤')
+        if not isinstance(frame, list) or not frame:
+            raise EOFError('訊框格式錯誤')
+        return frame
+
+    def close(self):
+        try:
+            self._reader.close()
+        finally:
+            self.sock.close()
+
+
+def _digest(authkey, challenge):
+    return hmac.new(authkey, challenge.encode(), hashlib.sha256).hexdigest()
+
+
+def _connect(address, authkey):
+    """連到轉發程序並以 HMAC 回應 challenge"""
+    sock = socket.create_connection(address, timeout=HANDSHAKE_TIMEOUT)
+    conn = _JsonConnection(sock)
+    try:
+        frame = conn.recv()
+        if frame[0] != 'challenge' or len(frame) != 2 or not isinstance(frame[1], str):
+            raise EOFError('轉發程序回應格式錯誤')
+        conn.send(['auth', _digest(authkey, frame[1])])
+        if conn.recv() != ['welcome']:
+            raise EOFError('轉發程序拒絕連線')
+    except (EOFError, OSError) as e:
+        conn.close()
+        raise ConnectionError(str(e) or '轉發程序連線中斷')
+    sock.settimeout(None)
+    return conn
+
+
+def _accept(sock, authkey):
+    """驗證新連線；驗證失敗回傳 None"""
+    sock.settimeout(HANDSHAKE_TIMEOUT)
+    conn = _JsonConnection(sock)
+    challenge = os.urandom(16).hex()
+    try:
+        conn.send(['challenge', challenge])
+        frame = conn.recv()
+        if (len(frame) != 2 or frame[0] != 'auth' or not isinstance(frame[1], str)
+                or not hmac.compare_digest(frame[1], _digest(authkey, challenge))):
+            conn.close()
+            return None
+        conn.send(['welcome'])
+    except (EOFError, OSError):
+        conn.close()
+        return None
+    sock.settimeout(None)
+    return conn
+
+
+class Subscription:
+    """單一訂閱；get() 取得最新訊息，逾時回傳 None"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self._latest = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def deliver(self, message):
+        with self._lock:
+            self._latest = message
+            self._ready.set()
+
+    def get(self, timeout=None):
+        if not self._ready.wait(timeout):
+            return None
+        with self._lock:
+            message, self._latest = self._latest, None
+            self._ready.clear()
+        return message
+
+    def close(self):
+        self.closed = True
+        self.broker.unsubscribe(self)
+
+    def interrupt(self):
+        """由 broker 結束訂閱（worker 關閉時），讓等待中的 get() 立即返回"""
+        self.closed = True
+        self._ready.set()
+
+
+class InProcessBroker:
+    """程序內的頻道 -> 訂閱者對應"""
+
+    def __init__(self):
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+    def channels(self):
+        with self._lock:
+            return list(self._channels)
+
+    def close_all(self):
+        """結束所有訂閱（worker 關閉前呼叫，讓 SSE 串流結束、由瀏覽器重新連線到其他 worker）"""
+        with self._lock:
+            subscriptions = [sub for subs in self._channels.values() for sub in subs]
+        for subscription in subscriptions:
+            subscription.interrupt()
+
+
+class HubBroker(InProcessBroker):
+    """經由轉發程序在多個 worker 間 fan-out；本程序的訂閱者仍由 InProcessBroker 管理
+
+    第一次使用時才連線，斷線後下次使用會重新連線並補送目前的訂閱
+    """
+
+    def __init__(self, address, authkey):
+        super().__init__()
+        self.address = address
+        self.authkey = authkey
+        self._conn = None
+        self._send_lock = threading.Lock()
+
+    def _send(self, *frame):
+        with self._send_lock:
+            if self._conn is None:
+                conn = _connect(self.address, self.authkey)
+                for channel in self.channels():
+                    conn.send(['sub', channel])
+                threading.Thread(target=self._read_loop, args=(conn,),
+                                 name='pubsub-hub-reader', daemon=True).start()
+                self._conn = conn
+            try:
+                self._conn.send(list(frame))
+            except OSError:
+                self._conn = None
+                raise
+
+    def subscribe(self, channel):
+        first = channel not in self.channels()
+        subscription = super().subscribe(channel)
+        if first:
+            try:
+                self._send('sub', channel)
+            except OSError:
+                # 轉發程序暫時無法連線：仍可收到本程序的推送，重新連線時補送訂閱
+                pass
+        return subscription
+
+    def unsubscribe(self, subscription):
+        super().unsubscribe(subscription)
+        if subscription.channel not in self.channels():
+            try:
+                self._send('unsub', subscription.channel)
+            except OSError:
+                pass
+
+    def publish(self, channel, message):
+        # 由轉發程序送回所有訂閱了此頻道的程序（包含自己）；無法連線時至少推送給本程序
+        try:
+            self._send('pub', channel, message)
+        except OSError:
+            InProcessBroker.publish(self, channel, message)
+
+    def _read_loop(self, conn):
+        while True:
+            try:
+                channel, message = conn.recv()
+            except (EOFError, OSError, ValueError):
+                with self._send_lock:
+                    if self._conn is conn:
+                        self._conn = None
+                conn.close()
+                return
+            InProcessBroker.publish(self, channel, message)
+
+
+def run_hub(address, authkey, echo=print):
+    """轉發程序：把 pub 訊息送給所有訂閱該頻道的連線
+
+    連線須以 authkey 通過 HMAC challenge；訊框為 JSON，格式不符的連線直接關閉
+    """
+    if not authkey:
+        raise ValueError('轉發程序需要 authkey')
+    listener = socket.create_server(address)
+    subscribers = defaultdict(set)
+    lock = threading.Lock()
+    echo(f'pubsub hub 監聽 {address[0]}:{address[1]}')
+
+    def serve(sock):
+        conn = _accept(sock, authkey)
+        if conn is None:
+            return
+        try:
+            while True:
+                frame = conn.recv()
+                if len(frame) < 2 or not isinstance(frame[1], str):
+                    break
+                if frame[0] == 'sub':
+                    with lock:
+                        subscribers[frame[1]].add(conn)
+                elif frame[0] == 'unsub':
+                    with lock:
+                        subscribers[frame[1]].discard(conn)
+                elif frame[0] == 'pub' and len(frame) == 3:
+                    with lock:
+                        targets = list(subscribers.get(frame[1], ()))
+                    for target in targets:
+                        try:
+                            target.send([frame[1], frame[2]])
+                        except OSError:
+                            pass
+        except (EOFError, OSError):
+            pass
+        finally:
+            with lock:
+                for conns in subscribers.values():
+                    conns.discard(conn)
+            conn.close()
+
+    while True:
+        sock, _ = listener.accept()
+        threading.Thread(target=serve, args=(sock,), daemon=True).start()
+
+
+def parse_hub_url(url):
+    """hub://host:port -> (host, port)"""
+    host, _, port = url[len('hub://'):].partition(':')
+    return host or '127.0.0.1', int(port or 5006)
+
+
+# 沒有 app context 時（腳本）使用的 broker
+_default_broker = InProcessBroker()
+
+
+def create_broker(url=None, authkey=b''):
+    """未設定為程序內，hub://host:port 連到轉發程序（authkey 需與轉發程序相同）"""
+    return HubBroker(parse_hub_url(url), authkey) if url else InProcessBroker()
+
+
+def init_app(app):
+    """依 PUBSUB_URL 建立應用程式的 broker，以 SECRET_KEY 向轉發程序驗證"""
+    app.extensions['pubsub'] = create_broker(app.config.get('PUBSUB_URL'), app.secret_key.encode())
+    return app.extensions['pubsub']
+
+
+def get_broker(app=None):
+    """應用程式的 broker（預設為目前的應用程式）"""
+    if app is None and has_app_context():
+        app = current_app
+    if app is None:
+        return _default_broker
+    return app.extensions.get('pubsub', _default_broker)
+
+
+# --- 團購進度 ---
+def group_channel(group_id):
+    return f'group:{group_id}'
+
+
+def subscribe_group(group_id):
+    return get_broker().subscribe(group_channel(group_id))
+
+
+def publish_group_progress(group):
+    """推送團購進度（group 可為 GroupBuying 或含相同欄位的暫存物件）"""
+    try:
+        get_broker().publish(group_channel(group.id), group.to_progress_dict())
+    except OSError:
+        # 推送失敗不影響寫入本身，觀看者重新連線時會取得最新狀態
+        pass
@@ -0,0 +1,330 @@
+"""
+共用查詢
+以 joinedload 一次載入頁面需要的關聯資料，避免模板中逐筆觸發 lazy 查詢（N+1）
+列表查詢使用 keyset 分頁，篩選與排序都在 SQL 中完成
+"""
+
+import base64
+import json
+from datetime import datetime, timedelta
+
+from flask import abort
+from sqlalchemy import Float, and_, case, cast, or_, select
+from sqlalchemy.orm import joinedload
+
+import cache
+import search
+from models import db, GroupBuying, GroupCard, Order, Product
+
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# 我的訂單預設只列出最近幾天（PostgreSQL 上只掃描涵蓋的月份分割區），更早的訂單以游標往前翻
+RECENT_ORDER_DAYS = 90
+
+GROUP_STATUSES = ('ACTIVE', 'SUCCESS', 'FAILED', 'CLOSED')
+
+# 排序方式 -> 是否遞減（同值時以 id 同方向排序，確保游標穩定）
+GROUP_SORTS = {
+    'newest': True,     # 最新開團
+    'closing': False,   # 即將截止
+    'progress': True,   # 進度最高
+}
+
+
+# --- 篩選與分頁 ---
+def _parse_datetime(value):
+    """解析 YYYY-MM-DD 或 YYYY-MM-DDTHH:MM，失敗回傳 None"""
+    for fmt in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_group_filters(args):
+    """從 query string 解析團購篩選、排序與分頁參數"""
+    status = (args.get('status') or '').upper()
+    sort = args.get('sort', 'newest')
+    limit = _parse_int(args.get('limit')) or PAGE_SIZE
+
+    return {
+        'status': status if status in GROUP_STATUSES else None,
+        'product_id': _parse_int(args.get('product_id')),
+        'leader_id': _parse_int(args.get('leader_id')),
+        'deadline_from': _parse_datetime(args.get('deadline_from')),
+        'deadline_to': _parse_datetime(args.get('deadline_to')),
+        'sort': sort if sort in GROUP_SORTS else 'newest',
+        'cursor': args.get('cursor') or None,
+        'limit': max(1, min(limit, MAX_PAGE_SIZE)),
+        'q': search.parse_query(args.get('q')),
+    }
+
+
+def _progress_expr():
+    """進度比例（target_quantity 為 0 時視為 1 避免除以零）"""
+    target = case((GroupBuying.target_quantity > 0, GroupBuying.target_quantity), else_=1)
+    return cast(GroupBuying.current_quantity, Float) / target
+
+
+def _sort_column(sort):
+    if sort == 'closing':
+        return GroupBuying.deadline
+    if sort == 'progress':
+        return _progress_expr()
+    return GroupBuying.created_at
+
+
+def _encode_key(key, last_id):
+    raw = json.dumps([key, last_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_key(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key, last_id = json.loads(raw)
+        return key, int(last_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError('invalid cursor') from e
+
+
+def encode_cursor(sort, group):
+    """將最後一筆的排序鍵與 id 編碼成游標字串"""
+    if sort == 'closing':
+        key = group.deadline.isoformat()
+    elif sort == 'progress':
+        key = group.current_quantity / (group.target_quantity or 1)
+    else:
+        key = group.created_at.isoformat()
+    return _encode_key(key, group.id)
+
+
+def decode_cursor(sort, cursor):
+    """解析游標，格式錯誤時拋出 ValueError"""
+    key, last_id = _decode_key(cursor)
+    try:
+        if sort == 'progress':
+            return float(key), last_id
+        return datetime.fromisoformat(key), last_id
+    except (TypeError, ValueError) as e:
+        raise ValueError('invalid cursor') from e
+
+
+def _apply_filters(query, filters):
+    if filters.get('status'):
+        query = query.filter(GroupBuying.status == filters['status'])
+    if filters.get('product_id'):
+        query = query.filter(GroupBuying.product_id == filters['product_id'])
+    if filters.get('leader_id'):
+        query = query.filter(GroupBuying.leader_id == filters['leader_id'])
+    if filters.get('deadline_from'):
+        query = query.filter(GroupBuying.deadline >= filters['deadline_from'])
+    if filters.get('deadline_to'):
+        query = query.filter(GroupBuying.deadline <= filters['deadline_to'])
+    return query
+
+
+def _paginate(query, filters):
+    """keyset 分頁，回傳 (groups, next_cursor)"""
+    sort = filters.get('sort', 'newest')
+    descending = GROUP_SORTS[sort]
+    column = _sort_column(sort)
+    limit = filters.get('limit', PAGE_SIZE)
+
+    if filters.get('cursor'):
+        key, last_id = decode_cursor(sort, filters['cursor'])
+        if descending:
+            query = query.filter(or_(column < key, and_(column == key, GroupBuying.id < last_id)))
+        else:
+            query = query.filter(or_(column > key, and_(column == key, GroupBuying.id > last_id)))
+
+    if descending:
+        query = query.order_by(column.desc(), GroupBuying.id.desc())
+    else:
+        query = query.order_by(column.asc(), GroupBuying.id.asc())
+
+    # 多取一筆判斷是否還有下一頁
+    rows = query.limit(limit + 1).all()
+    next_cursor = encode_cursor(sort, rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# --- 團購 ---
+def _with_product_and_leader(query):
+    """團購附帶商品與團長"""
+    return query.options(
+        joinedload(GroupBuying.product),
+        joinedload(GroupBuying.leader),
+    )
+
+
+def _load_cards(keys):
+    """快取未命中時，以一次 joined 查詢載入團購卡片"""
+    ids = [int(key.rsplit(':', 1)[1]) for key in keys]
+    groups = _with_product_and_leader(GroupBuying.query).filter(GroupBuying.id.in_(ids)).all()
+    return {cache.group_card_key(group.id): group.to_card_dict() for group in groups}
+
+
+def group_cards(groups):
+    """依順序回傳團購卡片（GroupCard）
+
+    groups 為含 id 與 updated_at 的列（例如分頁查詢結果）；快取中版本較舊的卡片
+    視為未命中重新載入，因此其他 worker 的寫入也不會讓本機快取顯示舊資料
+    """
+    versions = {
+        cache.group_card_key(group.id): group.updated_at.isoformat() if group.updated_at else None
+        for group in groups
+    }
+    found = cache.get_many(
+        versions, _load_cards,
+        is_fresh=lambda key, card: card.get('updated_at') == versions[key]
+    )
+    return [GroupCard(found[key]) for key in versions if key in found]
+
+
+def active_group_page(filters=None, now=None):
+    """瀏覽頁的一頁團購（預設只列出進行中且未過期），回傳 (groups, next_cursor)
+
+    只查 group_buying 本身，商品與團長由 group_cards() 從快取補上；
+    有搜尋字串 q 時依相關度排序，只回傳第一頁
+    """
+    filters = dict(filters or {})
+    filters['status'] = filters.get('status') or 'ACTIVE'
+    now = now or datetime.utcnow()
+
+    query = _apply_filters(GroupBuying.query, filters)
+    if filters['status'] == 'ACTIVE':
+        query = query.filter(GroupBuying.deadline > now)
+    if filters.get('q'):
+        return search.search(query, GroupBuying, filters['q'], filters.get('limit', PAGE_SIZE)), None
+    return _paginate(query, filters)
+
+
+def group_version_or_404(group_id):
+    """團購的 (id, updated_at, deadline, created_at)，不存在時回傳 404"""
+    row = db.session.execute(
+        select(GroupBuying.id, GroupBuying.updated_at, GroupBuying.deadline, GroupBuying.created_at)
+        .where(GroupBuying.id == group_id)
+    ).first()
+    if row is None:
+        abort(404)
+    return row
+
+
+def groups_for_dashboard(leader_id=None, filters=None):
+    """後台團購列表；指定 leader_id 時只列出該團長的團購，回傳 (groups, next_cursor)"""
+    filters = dict(filters or {})
+    if leader_id is not None:
+        filters['leader_id'] = leader_id
+
+    query = _apply_filters(_with_product_and_leader(GroupBuying.query), filters)
+    return _paginate(query, filters)
+
+
+# --- 商品 ---
+def product_page(cursor=None, limit=PAGE_SIZE):
+    """商品目錄的一頁（API 用），依 id 排序的 keyset 分頁，回傳 (rows, next_cursor)
+
+    cursor 格式錯誤時拋出 ValueError
+    """
+    query = select(Product.id, Product.name, Product.price, Product.description)
+    if cursor:
+        _, last_id = _decode_key(cursor)
+        query = query.where(Product.id > last_id)
+    rows = db.session.execute(query.order_by(Product.id).limit(limit + 1)).all()
+    next_cursor = _encode_key(None, rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# --- 訂單 ---
+def orders_for_group_with_user(group_id, since=None):
+    """團購的所有訂單附帶下單用戶（詳情頁成員列表）
+
+    since 為團購建立時間：訂單不會早於團購，加上這個條件後只掃描開團以後的分割區
+    """
+    query = Order.query.options(joinedload(Order.user)).filter_by(group_buying_id=group_id)
+    if since is not None:
+        query = query.filter(Order.created_at >= since)
+    return query.order_by(Order.created_at).all()
+
+
+def order_rows_for_user(user_id, cursor=None, limit=PAGE_SIZE):
+    """用戶訂單的一頁（API 用），只選取需要的欄位，依建立時間新到舊，回傳 (rows, next_cursor)
+
+    cursor 格式錯誤時拋出 ValueError
+    """
+    query = select(
+        Order.id, Order.quantity, Order.total_price, Order.payment_status, Order.created_at,
+        GroupBuying.id.label('group_id'), GroupBuying.name.label('group_name'),
+        GroupBuying.status.label('group_status'), GroupBuying.deadline.label('group_deadline'),
+        Product.name.label('product_name'),
+    ).join(GroupBuying, Order.group_buying_id == GroupBuying.id) \
+     .join(Product, GroupBuying.product_id == Product.id) \
+     .where(Order.user_id == user_id)
+
+    if cursor:
+        query = query.where(_before_order_cursor(cursor))
+
+    rows = db.session.execute(
+        query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1)
+    ).all()
+    return rows[:limit], _next_order_cursor(rows, limit)
+
+
+def _before_order_cursor(cursor):
+    """游標之前（較舊）的訂單條件；created_at 是分割鍵，PostgreSQL 會略過游標之後的分割區"""
+    key, last_id = _decode_key(cursor)
+    try:
+        created_at = datetime.fromisoformat(key)
+    except (TypeError, ValueError) as e:
+        raise ValueError('invalid cursor') from e
+    return or_(Order.created_at < created_at, and_(Order.created_at == created_at, Order.id < last_id))
+
+
+def _next_order_cursor(rows, limit):
+    if len(rows) <= limit:
+        return None
+    last = rows[limit - 1]
+    return _encode_key(last.created_at.isoformat(), last.id)
+
+
+def orders_for_user_with_group_tree(user_id, cursor=None, since=None, limit=PAGE_SIZE):
+    """用戶的一頁訂單附帶團購、商品與團長（我的訂單），依建立時間新到舊，回傳 (orders, next_cursor)
+
+    since 限制只查該時間以後的訂單；這段期間的訂單已全部列出時，next_cursor 指向 since 之前
+    （只在確實有更早的訂單時），cursor 格式錯誤時拋出 ValueError
+    """
+    group = joinedload(Order.group_buying)
+    query = Order.query.options(
+        group.joinedload(GroupBuying.product),
+        group.joinedload(GroupBuying.leader),
+    ).filter(Order.user_id == user_id)
+    if cursor:
+        query = query.filter(_before_order_cursor(cursor))
+    if since is not None:
+        query = query.filter(Order.created_at >= since)
+
+    orders = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).all()
+    next_cursor = _next_order_cursor(orders, limit)
+    if next_cursor is None and since is not None:
+        older = db.session.execute(
+            select(Order.id).where(Order.user_id == user_id, Order.created_at < since).limit(1)
+        ).first()
+        if older is not None:
+            next_cursor = _encode_key(since.isoformat(), 0)
+    return orders[:limit], next_cursor
+
+
+def recent_orders_since(now=None):
+    """我的訂單預設顯示範圍的起點"""
+    return (now or datetime.utcnow()) - timedelta(days=RECENT_ORDER_DAYS)
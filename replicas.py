@@ -0,0 +1,111 @@
+"""
+副本延遲監控
+主資料庫定期寫入 replication_heartbeat，再從每個副本讀回：
+副本上的心跳已是最新值時延遲為 0，否則延遲 = 現在時間 - 副本上的心跳時間。
+結果寫入應用程式的副本狀態（routing.get_replica_state），超過 MAX_REPLICA_LAG 或無法連線的副本不再接收讀取
+（量測精度約為一個 interval，MAX_REPLICA_LAG 應明顯大於 interval）
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+
+import routing
+from models import db, ReplicationHeartbeat
+
+
+def replica_keys(app):
+    """設定中的副本 bind 名稱"""
+    binds = app.config.get('SQLALCHEMY_BINDS') or {}
+    return sorted(key for key in binds if key.startswith(routing.REPLICA_PREFIX))
+
+
+def _read_beat(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            select(ReplicationHeartbeat.beat_at).where(ReplicationHeartbeat.id == 1)
+        ).scalar()
+
+
+def _write_beat(engine, now):
+    with engine.begin() as conn:
+        changed = conn.execute(
+            update(ReplicationHeartbeat).where(ReplicationHeartbeat.id == 1).values(beat_at=now)
+        ).rowcount
+        if not changed:
+            conn.execute(insert(ReplicationHeartbeat).values(id=1, beat_at=now))
+
+
+def measure_replica_lag(keys, max_lag=routing.MAX_REPLICA_LAG, now=None):
+    """量測每個副本的延遲並更新目前應用程式的副本狀態，回傳 {bind_key: 秒或 None}"""
+    now = now or datetime.utcnow()
+    primary_beat = _read_beat(db.engine)
+
+    lags = {}
+    for key in keys:
+        try:
+            replica_beat = _read_beat(db.engines[key])
+        except Exception:
+            replica_beat = None
+        if replica_beat is None:
+            lag = None
+        elif primary_beat is not None and replica_beat >= primary_beat:
+            lag = 0.0
+        else:
+            lag = max((now - replica_beat).total_seconds(), 0.0)
+        routing.update_replica(key, lag, max_lag)
+        lags[key] = lag
+
+    _write_beat(db.engine, now)
+    return lags
+
+
+class ReplicaMonitor:
+    """在背景執行緒中定期執行 measure_replica_lag"""
+
+    def __init__(self, app, interval=2, max_lag=routing.MAX_REPLICA_LAG):
+        self.app = app
+        self.interval = interval
+        self.max_lag = max_lag
+        self.keys = replica_keys(app)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def run_once(self):
+        """執行一次量測"""
+        with self.app.app_context():
+            return measure_replica_lag(self.keys, self.max_lag)
+
+    def run_forever(self):
+        """持續量測直到 stop() 被呼叫；主資料庫無法寫入心跳時所有副本視為不可用"""
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception:
+                self.app.logger.exception('replica lag check failed')
+                for key in self.keys:
+                    routing.update_replica(key, None, self.max_lag, app=self.app)
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(self.interval - elapsed, 0))
+
+    def start(self):
+        """以 daemon 執行緒啟動"""
+        self._thread = threading.Thread(target=self.run_forever, name='replica-monitor', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def ensure_started(self):
+        """第一次呼叫時啟動；在請求中呼叫，讓執行緒建立在 gunicorn fork 之後"""
+        with self._start_lock:
+            if self._thread is None:
+                self.start()
+
+    def stop(self, timeout=None):
+        """停止量測並等待執行緒結束"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,106 @@
+"""
+讀寫分離
+標記為 @read_only 的路由把 SELECT 送到延遲在容許範圍內的唯讀副本，其餘一律使用主資料庫：
+- 寫入（flush、INSERT / UPDATE / DELETE、text()）與未標記的路由都走主資料庫
+- 請求中一旦有寫入，之後的查詢也留在主資料庫
+- 用戶自己寫入後 PIN_SECONDS 秒內，該用戶的唯讀路由也讀主資料庫（read-your-writes）
+- 副本延遲由 replicas.ReplicaMonitor 量測，超過 MAX_REPLICA_LAG 或無法連線時退回主資料庫
+副本以 SQLALCHEMY_BINDS 中 replica_ 開頭的 bind 設定（見 app.create_app），
+各副本的量測結果由 init_app() 建立並存在 app.extensions['replica_state']
+"""
+
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
+
+
+REPLICA_PREFIX = 'replica_'
+MAX_REPLICA_LAG = 10.0  # 秒
+PIN_SECONDS = 15  # 需大於 MAX_REPLICA_LAG，固定期間結束時副本必定已追上
+
+_state_lock = threading.Lock()
+
+routing_metrics = {
+    'replica_reads': 0,
+    'primary_reads': 0,
+    'fallbacks': 0,  # 想讀副本但沒有可用副本
+}
+
+
+def init_app(app):
+    """建立應用程式的副本狀態：{bind_key: {'lag': 秒或 None, 'healthy': bool, 'checked_at': epoch}}"""
+    app.extensions['replica_state'] = {}
+    app.after_request(pin_after_write)
+    return app.extensions['replica_state']
+
+
+def get_replica_state(app=None):
+    """各副本最近一次量測（預設為目前的應用程式）"""
+    return (app or current_app).extensions['replica_state']
+
+
+def update_replica(key, lag, max_lag=MAX_REPLICA_LAG, app=None):
+    """記錄副本的延遲（lag 為 None 表示無法量測）"""
+    with _state_lock:
+        get_replica_state(app)[key] = {
+            'lag': lag,
+            'healthy': lag is not None and lag <= max_lag,
+            'checked_at': time.time(),
+        }
+
+
+def healthy_replicas(app=None):
+    with _state_lock:
+        return [key for key, state in get_replica_state(app).items() if state['healthy']]
+
+
+# --- 路由標記 ---
+def read_only(f):
+    """裝飾器：此路由的查詢可以由唯讀副本回答"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_replica = not _pinned_to_primary()
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _pinned_to_primary():
+    return session.get('primary_until', 0) > time.time()
+
+
+def pin_to_primary():
+    """讓目前用戶接下來 PIN_SECONDS 秒的唯讀路由讀主資料庫"""
+    session['primary_until'] = time.time() + PIN_SECONDS
+
+
+def pin_after_write(response):
+    """after_request：請求中有寫入時，固定目前用戶到主資料庫"""
+    if g.get('db_wrote'):
+        pin_to_primary()
+    return response
+
+
+# --- Session ---
+class RoutingSession(Session):
+    """依路由標記與語句種類選擇主資料庫或副本"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if self._flushing or not isinstance(clause, Select):
+                g.db_wrote = g.get('db_wrote') or self._flushing or clause is not None
+            elif g.get('read_replica') and not g.get('db_wrote'):
+                replicas = healthy_replicas()
+                if replicas:
+                    routing_metrics['replica_reads'] += 1
+                    return self._db.engines[random.choice(replicas)]
+                if get_replica_state():
+                    routing_metrics['fallbacks'] += 1
+                routing_metrics['primary_reads'] += 1
+            else:
+                routing_metrics['primary_reads'] += 1
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
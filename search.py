@@ -0,0 +1,151 @@
+"""
+全文搜尋（商品與團購的名稱、描述）
+中文沒有空白斷詞，因此以 trigram 建立索引，任意連續三個字以上的片段都能以索引查詢：
+- PostgreSQL：pg_trgm 的 GIN 索引，ILIKE 直接使用索引，依 similarity 排序
+- SQLite：FTS5 trigram tokenizer 的 external content 表，以 trigger 在新增、修改、刪除時同步；
+  名稱命中者優先、名稱越短越相關（bm25 需逐筆讀取文件長度，熱門關鍵字命中數千筆時過慢）
+少於三個字的關鍵字（例如「綠茶」）無法以 trigram 查詢，改為先找名稱以關鍵字開頭的項目（走索引），
+不足時再以 LIKE 補上，查詢不排序、找到足夠筆數即停止
+"""
+
+from sqlalchemy import column, func, literal_column, or_, table, text
+
+from models import db, GroupBuying, Product
+
+
+TRIGRAM_LENGTH = 3
+MAX_QUERY_LENGTH = 100
+MAX_TERMS = 8
+TYPEAHEAD_LIMIT = 10
+MAX_TYPEAHEAD_LIMIT = 20
+
+# 資料表 -> SQLite FTS5 索引表
+SEARCH_INDEXES = {
+    Product.__tablename__: 'products_search',
+    GroupBuying.__tablename__: 'group_buying_search',
+}
+
+search_metrics = {
+    'searches': 0,
+    'index_searches': 0,
+    'prefix_searches': 0,
+}
+
+
+def parse_query(value):
+    """整理搜尋字串（去除多餘空白、限制長度），空字串回傳 None"""
+    value = ' '.join((value or '').split())[:MAX_QUERY_LENGTH]
+    return value or None
+
+
+def _terms(query):
+    terms = []
+    for term in query.split()[:MAX_TERMS]:
+        if term.lower() not in (existing.lower() for existing in terms):
+            terms.append(term)
+    return terms
+
+
+# --- 索引 ---
+def create_indexes(conn):
+    """建立搜尋索引（遷移呼叫，需以 autocommit 連線執行）"""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for name in SEARCH_INDEXES:
+            for field in ('name', 'description'):
+                conn.execute(text(
+                    f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{name}_{field}_trgm '
+                    f'ON {name} USING gin ({field} gin_trgm_ops)'
+                ))
+    elif conn.dialect.name == 'sqlite':
+        for name, index in SEARCH_INDEXES.items():
+            _create_fts_index(conn, name, index)
+
+
+def _create_fts_index(conn, name, index):
+    insert_new = f'INSERT INTO {index} (rowid, name, description) VALUES (new.id, new.name, new.description);'
+    delete_old = (f"INSERT INTO {index} ({index}, rowid, name, description) "
+                  f"VALUES ('delete', old.id, old.name, old.description);")
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+        f"name, description, content='{name}', content_rowid='id', tokenize='trigram')"
+    ))
+    conn.execute(text(f'CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {name} BEGIN {insert_new} END'))
+    conn.execute(text(f'CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {name} BEGIN {delete_old} END'))
+    # 團購的數量與狀態經常更新，只在名稱或描述改變時重建索引列
+    conn.execute(text(
+        f'CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF name, description ON {name} '
+        f'BEGIN {delete_old} {insert_new} END'
+    ))
+    conn.execute(text(f"INSERT INTO {index} ({index}) VALUES ('rebuild')"))
+    # 短關鍵字的名稱前綴查詢
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{name}_name ON {name} (name)'))
+
+
+# --- 查詢 ---
+def _like_pattern(term, prefix=False):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%' if prefix else '%' + escaped + '%'
+
+
+def _contains(model, term):
+    pattern = _like_pattern(term)
+    return or_(model.name.ilike(pattern, escape='\\'), model.description.ilike(pattern, escape='\\'))
+
+
+def _name_prefix(model, term, dialect):
+    if dialect == 'sqlite':
+        # BINARY 排序下的範圍查詢可以使用 name 索引（LIKE 不行）
+        return model.name.between(term, term + '\U0010ffff')
+    return model.name.ilike(_like_pattern(term, prefix=True), escape='\\')
+
+
+def _ranked(query, model, query_text, terms, dialect):
+    """以索引查詢並依相關度排序"""
+    indexed = [term for term in terms if len(term) >= TRIGRAM_LENGTH]
+    short = [_contains(model, term) for term in terms if len(term) < TRIGRAM_LENGTH]
+
+    if dialect == 'sqlite':
+        index = SEARCH_INDEXES[model.__tablename__]
+        fts = table(index, column('rowid'))
+        # 每個詞以雙引號包成 phrase，避免使用者輸入被當成 FTS5 語法
+        match = ' AND '.join('"' + term.replace('"', '""') + '"' for term in indexed)
+        name_hit = model.name.like(_like_pattern(indexed[0]), escape='\\')
+        return query.join(fts, fts.c.rowid == model.id) \
+            .filter(literal_column(index).op('MATCH')(match), *short) \
+            .order_by(name_hit.desc(), func.length(model.name), model.id)
+
+    return query.filter(*[_contains(model, term) for term in terms]).order_by(
+        model.name.ilike(_like_pattern(query_text, prefix=True), escape='\\').desc(),
+        func.similarity(model.name, query_text).desc(),
+        func.word_similarity(query_text, func.coalesce(model.description, '')).desc(),
+        model.id,
+    )
+
+
+def search(query, model, query_text, limit):
+    """在 query（已套用其他篩選的 ORM 查詢）中搜尋 model 的名稱與描述，回傳依相關度排序的列"""
+    search_metrics['searches'] += 1
+    terms = _terms(query_text)
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite') and any(len(term) >= TRIGRAM_LENGTH for term in terms):
+        search_metrics['index_searches'] += 1
+        return _ranked(query, model, query_text, terms, dialect).limit(limit).all()
+
+    # 所有詞都太短：單一詞時名稱以該詞開頭者優先，其餘以 LIKE 依 id 掃描，找到足夠筆數即停止
+    search_metrics['prefix_searches'] += 1
+    rows = []
+    if len(terms) == 1:
+        rows = query.filter(_name_prefix(model, terms[0], dialect)) \
+            .order_by(model.name, model.id).limit(limit).all()
+    if len(rows) < limit:
+        found = [row.id for row in rows]
+        rows += query.filter(*[_contains(model, term) for term in terms], model.id.notin_(found)) \
+            .order_by(model.id).limit(limit - len(rows)).all()
+    return rows
+
+
+def typeahead_products(query_text, limit=TYPEAHEAD_LIMIT):
+    """開團表單的商品自動完成：[(id, name, price)]"""
+    query = db.session.query(Product.id, Product.name, Product.price)
+    return search(query, Product, query_text, limit)
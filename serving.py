@@ -0,0 +1,117 @@
+"""
+正式環境的服務設定
+依 CPU 核心數決定 gunicorn 的 worker / thread 數，並依 worker 數分配資料庫連線池，
+讓所有 worker 的連線總數不超過 PostgreSQL 的 max_connections（gunicorn.conf.py 使用）
+"""
+
+import os
+
+import passwords
+import pubsub
+from models import db
+
+
+DEFAULT_MAX_CONNECTIONS = 100  # PostgreSQL 預設 max_connections
+RESERVED_CONNECTIONS = 10      # 保留給遷移、截止掃描器、psql 等非 web 連線
+
+
+def cpu_count():
+    return os.cpu_count() or 1
+
+
+def worker_profile(worker_class=None, cores=None):
+    """回傳 {'worker_class', 'workers', 'threads', 'worker_connections'}
+
+    - gevent（預設）：每核心一個 worker，每個 worker 以 greenlet 服務大量連線（含 SSE）
+    - gthread：每核心一個 worker 加上數個執行緒，等待資料庫時釋放 GIL
+    - sync：傳統的 2 * 核心數 + 1
+    WEB_CONCURRENCY / WEB_THREADS 可覆寫計算結果
+    """
+    worker_class = worker_class or os.environ.get('WEB_WORKER_CLASS', 'gevent')
+    cores = cores or cpu_count()
+
+    if worker_class == 'gevent':
+        workers, threads = cores, 1
+    elif worker_class == 'gthread':
+        workers, threads = cores, 4
+    else:
+        workers, threads = 2 * cores + 1, 1
+
+    return {
+        'worker_class': worker_class,
+        'workers': int(os.environ.get('WEB_CONCURRENCY', workers)),
+        'threads': int(os.environ.get('WEB_THREADS', threads)),
+        'worker_connections': int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000)),
+    }
+
+
+def connection_budget(workers, max_connections=None, reserved=RESERVED_CONNECTIONS):
+    """每個 worker 可使用的連線數上限（至少 1）"""
+    max_connections = max_connections or int(os.environ.get('DB_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+    return max((max_connections - reserved) // max(workers, 1), 1)
+
+
+def engine_options(database_url, profile=None):
+    """SQLALCHEMY_ENGINE_OPTIONS：pool_size + max_overflow 不超過每個 worker 的連線預算
+
+    同步 worker 同時最多使用 threads 條連線；gevent worker 的併發由連線池上限控制，
+    超過時在 pool_timeout 內排隊等待
+    """
+    if database_url.startswith('sqlite'):
+        return {}
+
+    profile = profile or worker_profile()
+    budget = connection_budget(profile['workers'])
+    if profile['worker_class'] == 'gevent':
+        pool_size = min(budget, 10)
+    else:
+        pool_size = min(budget, profile['threads'])
+
+    return {
+        'pool_size': pool_size,
+        'max_overflow': budget - pool_size,
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # 早於防火牆或 PgBouncer 的閒置斷線
+        'pool_pre_ping': True,
+    }
+
+
+def cooperative_psycopg2():
+    """gevent worker：讓 psycopg2 等待資料庫回應時交出控制權（與 psycogreen 相同的做法）
+
+    psycopg2 是 C 擴充，monkey patch 對它無效；設定 wait callback 後，慢查詢與串流匯出的每批讀取
+    不會卡住同一個 worker 的其他請求。未安裝 psycopg2 時回傳 False
+    """
+    try:
+        import psycopg2.extensions
+        import psycopg2.extras
+    except ImportError:
+        return False
+    psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
+    return True
+
+
+def prewarm(engine, count=None):
+    """預先建立連線池中的連線，讓 worker 的第一批請求不必等待連線建立"""
+    if count is None:
+        count = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def drain(app):
+    """worker 結束前：結束 SSE 串流、停止副本監控、關閉雜湊執行緒池並關閉所有資料庫連線"""
+    pubsub.get_broker(app).close_all()
+    monitor = app.extensions.get('replica_monitor')
+    if monitor is not None:
+        monitor.stop(timeout=5)
+    passwords.get_pool(app).shutdown()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
@@ -238,7 +238,7 @@ def main():
     print("1. 複製上面的連接字串")
     print("2. 編輯 app.py 第 11 行，替換 DATABASE_URL")
     print("3. 執行: python3 app.py")
-    print("4. 訪問: http://localhost:5000/init-db")
+    print("4. 執行: flask --app app init-db")
     
     # 詢問是否自動更新 app.py
     print("\n" + "="*50)
@@ -159,7 +159,7 @@ main() {
     echo "下一步："
     echo "1. 確認 app.py 中的 DATABASE_URL 設定正確"
     echo "2. 執行：python3 app.py"
-    echo "3. 訪問：http://localhost:5000/init-db"
+    echo "3. 執行：flask --app app init-db"
     echo ""
 }
 
@@ -8,5 +8,9 @@ echo ""
 echo "請稍候..."
 echo ""
 
-# 啟動應用
-python3 app.py
+# 啟動應用（已安裝 gunicorn 時使用正式環境設定，否則使用開發伺服器）
+if command -v gunicorn >/dev/null 2>&1; then
+    gunicorn -c gunicorn.conf.py app:app
+else
+    python3 app.py
+fi
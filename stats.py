@@ -0,0 +1,124 @@
+"""
+統計彙總
+以 GROUP BY / COUNT / SUM FILTER 在資料庫中計算後台與我的訂單的統計數據
+結果以短 TTL 快取，避免每次頁面瀏覽都重新彙總
+"""
+
+from datetime import datetime, timedelta
+from functools import wraps
+
+from sqlalchemy import func
+
+import cache
+from models import db, User, Product, GroupBuying, Order
+
+
+STATS_TTL = 30  # 秒
+STATS_MAX_KEYS = 1000
+
+# 程序內的 LRU + TTL 快取（與 cache.py 的記憶體後端相同），不同參數的結果最多保留 STATS_MAX_KEYS 筆
+_cache = cache.MemoryCache(maxsize=STATS_MAX_KEYS, default_ttl=STATS_TTL)
+_MISSING = object()
+
+
+def cached(ttl=STATS_TTL):
+    """以函式名稱與參數為 key 的 TTL 快取"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = (f.__name__, args, tuple(sorted(kwargs.items())))
+            value = _cache.get_many([key]).get(key, _MISSING)
+            if value is _MISSING:
+                value = f(*args, **kwargs)
+                _cache.set_many({key: value}, ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+def clear_cache():
+    """清除所有統計快取"""
+    _cache.clear()
+
+
+# 已取消的訂單不計入營收
+_not_cancelled = Order.payment_status != 'CANCELLED'
+
+
+@cached()
+def group_status_counts(leader_id=None):
+    """團購總數與各狀態數量"""
+    query = db.session.query(
+        func.count(GroupBuying.id),
+        func.count(GroupBuying.id).filter(GroupBuying.status == 'ACTIVE'),
+        func.count(GroupBuying.id).filter(GroupBuying.status == 'SUCCESS'),
+    )
+    if leader_id is not None:
+        query = query.filter(GroupBuying.leader_id == leader_id)
+    total, active, success = query.one()
+    return {'total': total, 'active': active, 'success': success}
+
+
+def order_summary(user_id, since=None):
+    """用戶訂單數、總金額、總件數與待付款數（走 user_id 索引，不快取以免跟團後顯示舊資料）
+
+    指定 since 時只統計該時間以後的訂單（只掃描涵蓋的分割區）
+    """
+    query = db.session.query(
+        func.count(Order.id),
+        func.coalesce(func.sum(Order.total_price), 0),
+        func.coalesce(func.sum(Order.quantity), 0),
+        func.count(Order.id).filter(Order.payment_status == 'PENDING'),
+    ).filter(Order.user_id == user_id)
+    if since is not None:
+        query = query.filter(Order.created_at >= since)
+    count, amount, quantity, pending = query.one()
+    return {'count': count, 'amount': amount, 'quantity': quantity, 'pending': pending}
+
+
+@cached()
+def leader_revenue(limit=10):
+    """營收最高的團長"""
+    revenue = func.sum(Order.total_price)
+    rows = db.session.query(
+        User.id, User.name, func.count(Order.id), revenue
+    ).join(GroupBuying, GroupBuying.leader_id == User.id) \
+     .join(Order, Order.group_buying_id == GroupBuying.id) \
+     .filter(_not_cancelled) \
+     .group_by(User.id, User.name) \
+     .order_by(revenue.desc()).limit(limit).all()
+    return [{'id': r[0], 'name': r[1], 'orders': r[2], 'revenue': r[3]} for r in rows]
+
+
+@cached()
+def product_revenue(limit=10):
+    """營收最高的商品"""
+    revenue = func.sum(Order.total_price)
+    rows = db.session.query(
+        Product.id, Product.name, func.sum(Order.quantity), revenue
+    ).join(GroupBuying, GroupBuying.product_id == Product.id) \
+     .join(Order, Order.group_buying_id == GroupBuying.id) \
+     .filter(_not_cancelled) \
+     .group_by(Product.id, Product.name) \
+     .order_by(revenue.desc()).limit(limit).all()
+    return [{'id': r[0], 'name': r[1], 'quantity': r[2], 'revenue': r[3]} for r in rows]
+
+
+@cached()
+def daily_order_volume(days=14):
+    """最近幾天每日的訂單數與金額（沒有訂單的日期補 0）"""
+    start = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    day = func.date(Order.created_at)
+    rows = db.session.query(
+        day, func.count(Order.id), func.coalesce(func.sum(Order.total_price), 0)
+    ).filter(Order.created_at >= start, _not_cancelled) \
+     .group_by(day).all()
+
+    # SQLite 回傳字串、PostgreSQL 回傳 date，統一成字串
+    by_day = {str(r[0]): (r[1], r[2]) for r in rows}
+    series = []
+    for i in range(days):
+        key = str(start + timedelta(days=i))
+        count, amount = by_day.get(key, (0, 0))
+        series.append({'date': key, 'orders': count, 'amount': amount})
+    return series
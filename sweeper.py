@@ -0,0 +1,129 @@
+"""
+團購截止掃描器
+定期將已過截止時間的團購批次轉為 SUCCESS / FAILED，讓 /browse 不再負責寫入
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import case, func, select, update
+
+import cache
+import pubsub
+from models import db, GroupBuying
+
+
+# 最近一次與累計的掃描統計
+sweep_metrics = {
+    'sweeps': 0,
+    'last_transitions': 0,
+    'total_transitions': 0,
+    'last_lag_seconds': 0.0,
+    'last_sweep_at': None,
+}
+
+
+def sweep_expired_groups(batch_size=500, now=None):
+    """將過期的 ACTIVE 團購以批次 UPDATE 轉換狀態，回傳本次轉換數量"""
+    now = now or datetime.utcnow()
+
+    # 延遲 = 現在時間 - 最早一筆尚未處理的截止時間
+    oldest_deadline = db.session.execute(
+        select(func.min(GroupBuying.deadline)).where(
+            GroupBuying.status == 'ACTIVE',
+            GroupBuying.deadline < now,
+        )
+    ).scalar()
+    lag = (now - oldest_deadline).total_seconds() if oldest_deadline else 0.0
+
+    transitions = 0
+    while True:
+        batch_ids = select(GroupBuying.id).where(
+            GroupBuying.status == 'ACTIVE',
+            GroupBuying.deadline < now,
+        ).order_by(GroupBuying.deadline).limit(batch_size).scalar_subquery()
+
+        # 選出後到更新前可能已被關閉或成團，UPDATE 再檢查一次狀態與截止時間，避免覆寫
+        changed = db.session.execute(
+            update(GroupBuying)
+            .where(
+                GroupBuying.id.in_(batch_ids),
+                GroupBuying.status == 'ACTIVE',
+                GroupBuying.deadline < now,
+            )
+            .values(status=case(
+                (GroupBuying.current_quantity >= GroupBuying.target_quantity, 'SUCCESS'),
+                else_='FAILED',
+            ))
+            .returning(GroupBuying.id, GroupBuying.current_quantity,
+                       GroupBuying.target_quantity, GroupBuying.status)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        cache.invalidate_groups(*[row.id for row in changed])
+        for row in changed:
+            pubsub.publish_group_progress(GroupBuying(
+                id=row.id,
+                current_quantity=row.current_quantity,
+                target_quantity=row.target_quantity,
+                status=row.status
+            ))
+
+        transitions += len(changed)
+        if len(changed) < batch_size:
+            break
+
+    sweep_metrics['sweeps'] += 1
+    sweep_metrics['last_transitions'] = transitions
+    sweep_metrics['total_transitions'] += transitions
+    sweep_metrics['last_lag_seconds'] = lag
+    sweep_metrics['last_sweep_at'] = now
+
+    return transitions
+
+
+class DeadlineSweeper:
+    """在背景執行緒中定期執行 sweep_expired_groups"""
+
+    def __init__(self, app, interval=30, batch_size=500):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """執行一次掃描"""
+        with self.app.app_context():
+            try:
+                return sweep_expired_groups(batch_size=self.batch_size)
+            finally:
+                db.session.remove()
+
+    def run_forever(self):
+        """持續掃描直到 stop() 被呼叫"""
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                transitions = self.run_once()
+                self.app.logger.info(
+                    'deadline sweep: %d transitions, lag %.1fs',
+                    transitions, sweep_metrics['last_lag_seconds'],
+                )
+            except Exception:
+                self.app.logger.exception('deadline sweep failed')
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(self.interval - elapsed, 0))
+
+    def start(self):
+        """以 daemon 執行緒啟動"""
+        self._thread = threading.Thread(target=self.run_forever, name='deadline-sweeper', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        """停止掃描並等待執行緒結束"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,61 @@
+"""
+測試共用設定
+每個測試以 create_app() 建立獨立的應用程式與 SQLite 資料庫；不需要 PostgreSQL 或外部網路
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py 匯入時會以環境變數建立模組層級的應用程式，先指向暫存的 SQLite，避免連到 PostgreSQL
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='groupbuy-test-'), 'import.db')
+os.environ.pop('DATABASE_REPLICA_URLS', None)
+os.environ.pop('CACHE_URL', None)
+os.environ.pop('PUBSUB_URL', None)
+# 測試不需要正式的雜湊強度，scrypt 每次約 100ms
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+import app as appmod  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """建立應用程式並初始化資料庫（管理員與測試商品）；config 覆寫預設設定"""
+    created = []
+
+    def make(config=None):
+        application = appmod.create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "primary.db"}',
+            'IMAGE_DIR': str(tmp_path / 'images'),
+            'IMAGE_FETCHER': 'stub',
+            **(config or {}),
+        })
+        with application.app_context():
+            appmod.initialize_database(echo=lambda *args: None)
+        created.append(application)
+        return application
+
+    yield make
+    for application in created:
+        with application.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
@@ -0,0 +1,61 @@
+"""create_app() 的狀態存在各自的 app.extensions，建立第二個應用程式不影響第一個"""
+
+import pytest
+
+import cache
+import exports
+import passwords
+import pubsub
+
+
+def test_apps_do_not_share_state(make_app, tmp_path):
+    first = make_app({'PASSWORD_HASH_WORKERS': 1, 'EXPORT_MAX_CONCURRENT': 1})
+    extensions = dict(first.extensions)
+    second = make_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "second.db"}',
+        'PASSWORD_HASH_WORKERS': 3,
+        'IMAGE_FETCHER': 'http',
+    })
+
+    for name in ('cache', 'pubsub', 'password_pool', 'images', 'instrumentation'):
+        assert first.extensions[name] is extensions[name]
+        assert second.extensions[name] is not first.extensions[name]
+    # 匯出名額在第一次匯出時才建立
+    assert exports.get_slots(first) is exports.get_slots(first)
+    assert exports.get_slots(second) is not exports.get_slots(first)
+    assert passwords.get_pool(first).workers == 1
+    assert passwords.get_pool(second).workers == 3
+
+    with first.app_context():
+        assert cache.get_backend() is first.extensions['cache']
+        assert pubsub.get_broker() is first.extensions['pubsub']
+        assert passwords.get_pool() is first.extensions['password_pool']
+        assert first.extensions['images'].fetcher is not second.extensions['images'].fetcher
+    with second.app_context():
+        assert cache.get_backend() is second.extensions['cache']
+
+
+def test_broker_is_per_app(make_app, tmp_path):
+    first = make_app()
+    second = make_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "second.db"}'})
+
+    with first.app_context():
+        subscription = pubsub.subscribe_group(1)
+    with second.app_context():
+        pubsub.get_broker().publish(pubsub.group_channel(1), {'id': 1})
+    assert subscription.get(timeout=0) is None
+
+    with first.app_context():
+        pubsub.get_broker().publish(pubsub.group_channel(1), {'id': 1})
+    assert subscription.get(timeout=0) == {'id': 1}
+    subscription.close()
+
+
+def test_export_slots_follow_config(make_app):
+    app = make_app({'EXPORT_MAX_CONCURRENT': 1})
+    with app.app_context():
+        first = exports.export_orders('csv')
+        with pytest.raises(exports.ExportBusy):
+            exports.export_orders('csv')
+        first.close()
+        exports.export_orders('csv').close()
@@ -0,0 +1,134 @@
+"""商品圖片：縮圖、無 Pillow 的退路、<name> 路徑安全與下載快取"""
+
+import io
+import threading
+import time
+
+import pytest
+
+import images
+from models import db, Product
+
+
+@pytest.fixture
+def product_id(app):
+    with app.app_context():
+        return Product.query.filter(Product.image_url.isnot(None)).order_by(Product.id).first().id
+
+
+@pytest.fixture
+def key(app):
+    with app.app_context():
+        return images.store(images._solid_png(400, 300, (10, 20, 30)))
+
+
+@pytest.mark.skipif(not images.HAS_PILLOW, reason='需要 Pillow')
+@pytest.mark.parametrize('variant', list(images.VARIANTS))
+@pytest.mark.parametrize('fmt', list(images.FORMATS))
+def test_variants_generated_once(client, key, variant, fmt):
+    from PIL import Image
+
+    before = images.image_metrics['variants_generated']
+    response = client.get(f'/images/{key}/{variant}.{fmt}')
+    assert response.status_code == 200
+    assert response.mimetype == images.FORMATS[fmt]
+    assert 'immutable' in response.headers['Cache-Control']
+    with Image.open(io.BytesIO(response.data)) as image:
+        assert image.width == min(images.VARIANTS[variant], 400)
+
+    assert client.get(f'/images/{key}/{variant}.{fmt}').status_code == 200
+    assert images.image_metrics['variants_generated'] == before + 1
+
+
+def test_without_pillow_serves_original(client, key, monkeypatch):
+    monkeypatch.setattr(images, 'HAS_PILLOW', False)
+    before = images.image_metrics['variants_generated']
+    response = client.get(f'/images/{key}/card.webp')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.data.startswith(b'\x89PNG')
+    assert images.image_metrics['variants_generated'] == before
+
+
+@pytest.mark.parametrize('name', [
+    'original',
+    '..',
+    '..%2Foriginal',
+    '..%2F..%2F..%2Fapp.py',
+    'card',
+    'card.png',
+    'card.jpg.webp',
+    '.card.jpg',
+    'huge.jpg',
+])
+def test_name_path_safety(client, key, name):
+    assert client.get(f'/images/{key}/{name}').status_code == 404
+
+
+@pytest.mark.parametrize('bad_key', ['..', 'zz', '0' * 32, ('../' * 3) + 'etc'])
+def test_unknown_or_invalid_key(client, bad_key):
+    assert client.get(f'/images/{bad_key}/card.jpg').status_code == 404
+
+
+def test_product_image_fetched_once(app, client, product_id):
+    before = images.image_metrics['fetches']
+    first = client.get(f'/images/product/{product_id}/card.jpg')
+    assert first.status_code == 302
+    second = client.get(f'/images/product/{product_id}/card.webp')
+    assert second.status_code == 302
+    assert images.image_metrics['fetches'] == before + 1
+
+    with app.app_context():
+        key = db.session.get(Product, product_id).image_key
+    assert first.headers['Location'].endswith(f'/images/{key}/card.jpg')
+    assert second.headers['Location'].endswith(f'/images/{key}/card.webp')
+    assert client.get(second.headers['Location']).status_code == 200
+
+
+def test_concurrent_first_hits_fetch_once(make_app):
+    calls = []
+
+    def slow_fetch(url):
+        calls.append(url)
+        time.sleep(0.2)
+        return images.stub_fetch(url)
+
+    app = make_app({'IMAGE_FETCHER': slow_fetch})
+    with app.app_context():
+        product = Product.query.filter(Product.image_url.isnot(None)).order_by(Product.id).first()
+        product_id = product.id
+        snapshot = {'id': product.id, 'image_url': product.image_url, 'image_key': None}
+
+    keys = []
+
+    def hit():
+        with app.app_context():
+            keys.append(images.ensure_product_image(snapshot))
+            db.session.remove()
+
+    threads = [threading.Thread(target=hit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(keys) == 8 and len(set(keys)) == 1 and keys[0]
+    with app.app_context():
+        assert db.session.get(Product, product_id).image_key == keys[0]
+
+
+def test_failed_fetch_not_retried(make_app):
+    calls = []
+
+    def failing_fetch(url):
+        calls.append(url)
+        raise OSError('connection refused')
+
+    app = make_app({'IMAGE_FETCHER': failing_fetch})
+    client = app.test_client()
+    with app.app_context():
+        product_id = Product.query.filter(Product.image_url.isnot(None)).order_by(Product.id).first().id
+    assert client.get(f'/images/product/{product_id}/card.jpg').status_code == 404
+    assert client.get(f'/images/product/{product_id}/card.jpg').status_code == 404
+    assert len(calls) == 1
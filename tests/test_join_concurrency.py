@@ -0,0 +1,165 @@
+"""併發跟團：名額不超賣，current_quantity 與訂單數量一致"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+import intake
+from models import db, GroupBuying, Order, Product, User
+from ordering import JoinRejected, JoinRequest
+
+THREADS = 24
+TARGET = 10
+
+
+@pytest.fixture
+def app(make_app):
+    # SQLite 的寫入互斥：等待其他連線的交易而不是立即回報 database is locked
+    return make_app({'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}}})
+
+
+@pytest.fixture
+def setup(app):
+    """建立 THREADS 個用戶與一個目標 TARGET 件的團購，回傳 (團購 id, 用戶 id 列表)"""
+    with app.app_context():
+        users = [User(username=f'buyer{i}', email=f'buyer{i}@example.com', name=f'buyer{i}',
+                      password_hash='x') for i in range(THREADS)]
+        group = GroupBuying(name='熱門團購', product_id=db.session.scalar(select(Product.id).limit(1)),
+                            leader_id=1, target_quantity=TARGET,
+                            deadline=datetime.utcnow() + timedelta(days=1))
+        db.session.add_all(users + [group])
+        db.session.commit()
+        return group.id, [user.id for user in users]
+
+
+def _run(app, submit, group_id, user_ids):
+    """每個用戶一個執行緒同時跟團 1 件，回傳各執行緒的結果（JoinReceipt 或 JoinRejected）"""
+    barrier = threading.Barrier(len(user_ids))
+    results = []
+    lock = threading.Lock()
+
+    def worker(user_id):
+        with app.app_context():
+            barrier.wait()
+            try:
+                result = submit(group_id, user_id)
+            except JoinRejected as e:
+                result = e
+            finally:
+                db.session.remove()
+        with lock:
+            results.append(result)
+
+    threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _assert_consistent(app, group_id, results):
+    successes = [r for r in results if not isinstance(r, Exception)]
+    rejections = [r for r in results if isinstance(r, Exception)]
+    assert len(results) == THREADS
+    assert len(successes) == TARGET
+    assert all(isinstance(r, JoinRejected) and r.reason == 'sold_out' for r in rejections)
+
+    with app.app_context():
+        group = db.session.get(GroupBuying, group_id)
+        ordered = db.session.scalar(
+            select(func.coalesce(func.sum(Order.quantity), 0)).where(Order.group_buying_id == group_id))
+        assert group.current_quantity == ordered == TARGET
+        assert group.status == 'SUCCESS'
+        assert {r.id for r in successes} == set(
+            db.session.scalars(select(Order.id).where(Order.group_buying_id == group_id)))
+
+
+def test_batched_joins_do_not_oversell(app, setup):
+    group_id, user_ids = setup
+    results = _run(app, lambda group_id, user_id: intake.submit_join(group_id, user_id, 1, f'k{user_id}'),
+                   group_id, user_ids)
+    _assert_consistent(app, group_id, results)
+
+
+def test_one_transaction_per_join_does_not_oversell(app, setup):
+    # max_batch=1：每筆跟團各自一個交易，名額只靠 reserve_slots 的條件式 UPDATE 把關
+    batcher = intake.JoinBatcher(max_batch=1)
+    group_id, user_ids = setup
+
+    def submit(group_id, user_id):
+        result = batcher.submit(group_id, JoinRequest(user_id, 1, None))
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    results = _run(app, submit, group_id, user_ids)
+    _assert_consistent(app, group_id, results)
+
+
+def test_retried_joins_are_not_double_counted(app, setup):
+    group_id, user_ids = setup
+    first = _run(app, lambda group_id, user_id: intake.submit_join(group_id, user_id, 1, f'k{user_id}'),
+                 group_id, user_ids)
+    retried = _run(app, lambda group_id, user_id: intake.submit_join(group_id, user_id, 1, f'k{user_id}'),
+                   group_id, user_ids)
+    _assert_consistent(app, group_id, first)
+
+    receipts = {r.id for r in first if not isinstance(r, Exception)}
+    assert {r.id for r in retried if not isinstance(r, Exception)} == receipts
+    assert all(r.replayed for r in retried if not isinstance(r, Exception))
+
+
+class _RecordingBatcher(intake.JoinBatcher):
+    """只記錄每一批的請求與處理的執行緒，第一批處理到 release 被設定為止（不使用資料庫）"""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+        self.flushed_by = []
+        self.first_started = threading.Event()
+        self.release = threading.Event()
+
+    def _process(self, group_id, batch):
+        self.batches.append([ticket.request for ticket in batch])
+        self.flushed_by.append(threading.current_thread().name)
+        if len(self.batches) == 1:
+            self.first_started.set()
+            self.release.wait(5)
+        for ticket in batch:
+            ticket.resolve(ticket.request)
+
+    def queued(self, group_id):
+        with self._lock:
+            return len(self._queues.get(group_id, ()))
+
+
+def test_leader_flushes_one_batch_then_hands_off():
+    batcher = _RecordingBatcher()
+    results = {}
+
+    def submit(name):
+        results[name] = batcher.submit(1, name)
+
+    leader = threading.Thread(target=submit, args=('leader',), name='leader')
+    leader.start()
+    assert batcher.first_started.wait(5)
+    # leader 處理第一批時到達的請求排成下一批，由其中最前面的請求接手
+    followers = [threading.Thread(target=submit, args=(f'follower{i}',), name=f'follower{i}') for i in range(3)]
+    for thread in followers:
+        thread.start()
+    while batcher.queued(1) < len(followers):
+        time.sleep(0.01)
+    batcher.release.set()
+
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert batcher.batches[0] == ['leader']
+    assert sorted(batcher.batches[1]) == ['follower0', 'follower1', 'follower2']
+    # 第二批由排在最前面的 follower 處理，leader 不必等到佇列清空才回應
+    assert batcher.flushed_by == ['leader', batcher.batches[1][0]]
+    assert results == {name: name for name in ['leader', 'follower0', 'follower1', 'follower2']}
+    assert batcher.queued(1) == 0
@@ -0,0 +1,73 @@
+"""各路由的查詢數不隨資料量成長（N+1 回歸測試）
+
+以 instrumentation 的請求量測（INSTRUMENT_SAMPLE_RATE=1 時 Server-Timing 帶有查詢數）計算每個請求的查詢數，
+資料量增加數倍後查詢數必須相同
+"""
+
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+import cache
+import queries
+import stats
+from models import db, GroupBuying, Order, User
+
+# 兩種資料量都在一頁之內：每列多一個查詢時，查詢數的差距就是兩者的列數差
+SMALL = 2
+LARGE = queries.PAGE_SIZE - 1
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app({'INSTRUMENT_SAMPLE_RATE': 1})
+
+
+@pytest.fixture
+def client(client):
+    assert client.post('/login', data={'username': 'admin', 'password': 'admin123'}).status_code == 302
+    return client
+
+
+def _seed(app, count):
+    """新增 count 個團購（各有一位團主），admin 跟每個團購、每位團主跟第一個團購"""
+    with app.app_context():
+        first_id = db.session.query(db.func.min(GroupBuying.id)).scalar()
+        start = db.session.query(User).count()
+        for i in range(start, start + count):
+            leader = User(username=f'leader{i}', email=f'leader{i}@example.com', name=f'團主{i}', password_hash='x')
+            db.session.add(leader)
+            db.session.flush()
+            group = GroupBuying(name=f'團購{i}', product_id=1 + i % 3, leader_id=leader.id, target_quantity=10000,
+                                deadline=datetime.utcnow() + timedelta(days=1))
+            db.session.add(group)
+            db.session.flush()
+            first_id = first_id or group.id
+            db.session.add(Order(user_id=1, group_buying_id=group.id, quantity=1, total_price=1))
+            db.session.add(Order(user_id=leader.id, group_buying_id=first_id, quantity=1, total_price=1))
+        db.session.commit()
+        return first_id
+
+
+def _query_count(client, path):
+    stats.clear_cache()
+    with client.application.app_context():
+        cache.get_backend().clear()
+    response = client.get(path)
+    assert response.status_code == 200, path
+    match = re.search(r'desc="(\d+) queries"', response.headers.get('Server-Timing', ''))
+    assert match, response.headers.get('Server-Timing')
+    return int(match.group(1))
+
+
+@pytest.mark.parametrize('path', ['/browse', '/group/{group_id}', '/my-orders', '/admin'])
+def test_query_count_does_not_grow_with_rows(app, client, path):
+    group_id = _seed(app, SMALL)
+    path = path.format(group_id=group_id)
+    small = _query_count(client, path)
+
+    _seed(app, LARGE - SMALL)
+    large = _query_count(client, path)
+
+    assert large == small, f'{path}：{SMALL} 筆資料 {small} 個查詢，{LARGE} 筆資料 {large} 個查詢'
@@ -0,0 +1,169 @@
+"""讀寫分離：RoutingSession.get_bind 與 ReplicaMonitor（主資料庫與副本各為一個 SQLite 檔案）"""
+
+import shutil
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from flask import g
+from sqlalchemy import select, update
+
+import cache
+import intake
+import routing
+from models import db, GroupBuying, Product, User
+
+REPLICA = f'{routing.REPLICA_PREFIX}0'
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {'primary': tmp_path / 'primary.db', 'replica': tmp_path / 'replica.db'}
+
+
+@pytest.fixture
+def app(make_app, paths):
+    return make_app({
+        'SQLALCHEMY_BINDS': {REPLICA: f'sqlite:///{paths["replica"]}'},
+        'REPLICA_MONITOR_INTERVAL': 0,
+        'REPLICA_MAX_LAG': 5,
+        'JOIN_BATCH_WINDOW_MS': 300,
+    })
+
+
+@pytest.fixture
+def monitor(app):
+    return app.extensions['replica_monitor']
+
+
+@pytest.fixture
+def group_id(app):
+    with app.app_context():
+        group = GroupBuying(name='主資料庫', product_id=db.session.scalar(select(Product.id).limit(1)),
+                            leader_id=1, target_quantity=5, deadline=datetime.utcnow() + timedelta(days=1))
+        user = User(username='bob', email='bob@example.com', name='Bob')
+        user.set_password('pw')
+        db.session.add_all([group, user])
+        db.session.commit()
+        return group.id
+
+
+@pytest.fixture
+def replicated(app, paths, monitor, group_id):
+    """寫入心跳後把主資料庫複製成副本，副本的團購名稱改為「副本」以辨別讀取來源"""
+    monitor.run_once()
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    shutil.copy(paths['primary'], paths['replica'])
+    with sqlite3.connect(paths['replica']) as conn:
+        conn.execute("UPDATE group_buying SET name = '副本'")
+    assert monitor.run_once() == {REPLICA: 0.0}
+    with app.app_context():
+        cache.get_backend().clear()
+    return group_id
+
+
+def _age_replica(paths, seconds):
+    with sqlite3.connect(paths['replica']) as conn:
+        conn.execute('UPDATE replication_heartbeat SET beat_at = ?',
+                     ((datetime.utcnow() - timedelta(seconds=seconds)).isoformat(' '),))
+
+
+def test_replica_without_heartbeat_is_unhealthy(app, monitor):
+    assert monitor.run_once() == {REPLICA: None}
+    assert routing.healthy_replicas(app) == []
+
+
+def test_get_bind_routes_reads_and_writes(app, replicated):
+    read = select(GroupBuying.name)
+    write = update(GroupBuying).values(name='x')
+
+    with app.test_request_context():
+        primary, replica = db.engine, db.engines[REPLICA]
+        # 未標記 @read_only 的路由一律讀主資料庫
+        assert db.session.get_bind(clause=read) is primary
+
+        g.read_replica = True
+        assert db.session.get_bind(clause=read) is replica
+        assert db.session.get_bind(clause=write) is primary
+        # 寫入後同一請求的讀取也留在主資料庫
+        assert g.db_wrote
+        assert db.session.get_bind(clause=read) is primary
+
+
+def test_read_only_route_reads_replica(app, replicated):
+    before = routing.routing_metrics['replica_reads']
+    response = app.test_client().get(f'/api/v1/groups/{replicated}')
+    assert response.get_json()['name'] == '副本'
+    assert routing.routing_metrics['replica_reads'] > before
+
+
+def test_read_after_write_goes_to_primary(app, replicated):
+    client = app.test_client()
+    assert client.post('/login', data={'username': 'bob', 'password': 'pw'}).status_code == 302
+    assert client.post(f'/join_group/{replicated}', data={'quantity': '2'}).status_code == 302
+
+    # 副本沒有這筆訂單：寫入後固定讀主資料庫才看得到
+    assert len(client.get('/api/v1/orders').get_json()['data']) == 1
+    with client.session_transaction() as session:
+        session.pop('primary_until')
+    assert client.get('/api/v1/orders').get_json()['data'] == []
+
+
+def test_batched_join_followers_read_their_writes(app, replicated):
+    # JOIN_BATCH_WINDOW_MS 讓三筆跟團合併成一批：leader 的請求寫入所有訂單，followers 的請求本身沒有寫入
+    clients = []
+    with app.app_context():
+        for i in range(3):
+            user = User(username=f'buyer{i}', email=f'buyer{i}@example.com', name=f'buyer{i}')
+            user.set_password('pw')
+            db.session.add(user)
+        db.session.commit()
+    for i in range(3):
+        client = app.test_client()
+        assert client.post('/login', data={'username': f'buyer{i}', 'password': 'pw'}).status_code == 302
+        with client.session_transaction() as session:
+            session.pop('primary_until', None)
+        clients.append(client)
+
+    barrier = threading.Barrier(len(clients))
+    statuses = []
+
+    def join(client):
+        barrier.wait()
+        statuses.append(client.post(f'/join_group/{replicated}', data={'quantity': '1'}).status_code)
+
+    threads = [threading.Thread(target=join, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [302] * len(clients)
+    assert intake.intake_metrics['max_batch_size'] >= 2
+
+    for client in clients:
+        with client.session_transaction() as session:
+            assert 'primary_until' in session
+        assert len(client.get('/api/v1/orders').get_json()['data']) == 1
+
+
+def test_lagging_replica_falls_back_to_primary(app, paths, monitor, replicated):
+    _age_replica(paths, 60)
+    lag = monitor.run_once()[REPLICA]
+    assert lag > monitor.max_lag
+    assert routing.healthy_replicas(app) == []
+
+    before = routing.routing_metrics['fallbacks']
+    response = app.test_client().get(f'/api/v1/groups/{replicated}')
+    assert response.get_json()['name'] == '主資料庫'
+    assert routing.routing_metrics['fallbacks'] > before
+
+    # 副本追上後恢復讀取副本
+    _age_replica(paths, 1)
+    assert monitor.run_once()[REPLICA] <= monitor.max_lag
+    with app.app_context():
+        cache.get_backend().clear()
+    assert app.test_client().get(f'/api/v1/groups/{replicated}').get_json()['name'] == '副本'
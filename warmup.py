@@ -0,0 +1,139 @@
+"""
+啟動預熱與就緒檢查
+新 worker 的第一個請求原本要編譯 base.html 與頁面樣板、設定 ORM mapper 並建立資料庫連線，
+自動擴展出來的機器前幾個請求明顯較慢：
+- 樣板編譯結果存成 Jinja bytecode cache（TEMPLATE_CACHE_DIR，預設 instance/jinja）；
+  flask compile-templates 在建置映像時先編譯好，worker 啟動時只需讀取
+- warm() 載入所有樣板、設定 mapper 並建立連線池中的連線；gunicorn 在 worker 開始接受請求前呼叫
+- /readyz 在預熱完成且資料庫可連線時回傳 200，否則 503（尚未預熱時在背景開始預熱）；
+  /healthz 只表示程序還活著，負載平衡器與自動擴展的健康檢查應使用 /readyz
+"""
+
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, jsonify
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
+
+import serving
+from models import db
+
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupState:
+    """一個應用程式的預熱狀態（存在 app.extensions['warmup']）"""
+
+    def __init__(self):
+        self.ready = False
+        self.templates = 0
+        self.connections = 0
+        self.duration_ms = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_background(self, app):
+        """在背景執行緒預熱（已在進行或已完成時不重複）"""
+        with self._lock:
+            if self.ready or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=warm, args=(app,), name='warmup', daemon=True)
+            self._thread.start()
+
+    def to_dict(self):
+        return {
+            'ready': self.ready,
+            'templates': self.templates,
+            'connections': self.connections,
+            'duration_ms': self.duration_ms,
+            'error': self.error,
+        }
+
+
+# --- 樣板 ---
+def bytecode_cache(directory):
+    """目錄可寫入時回傳 FileSystemBytecodeCache，否則為 None（唯讀的映像檔中不啟用，改為每次編譯）"""
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return None
+    if not os.access(directory, os.W_OK):
+        return None
+    return FileSystemBytecodeCache(directory)
+
+
+def compile_templates(app):
+    """載入（編譯）所有 .html 樣板，回傳樣板數；有 bytecode cache 時同時寫入"""
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith('.html')]
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+# --- 預熱 ---
+def warm(app):
+    """預熱樣板、ORM mapper 與資料庫連線池，回傳 WarmupState；失敗時記錄錯誤，下次就緒檢查會重試"""
+    state = app.extensions['warmup']
+    if state.ready:
+        return state
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            state.templates = compile_templates(app)
+            configure_mappers()
+            state.connections = sum(serving.prewarm(engine) for engine in db.engines.values())
+    except Exception as e:
+        state.error = str(e)
+        logger.exception('預熱失敗')
+        return state
+    state.duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    state.error = None
+    state.ready = True
+    logger.info('預熱完成：%d 個樣板、%d 條連線，%.1f ms', state.templates, state.connections, state.duration_ms)
+    return state
+
+
+# --- 健康檢查 ---
+def _no_store(response, status=200):
+    response.status_code = status
+    response.cache_control.no_store = True
+    return response
+
+
+def liveness():
+    return _no_store(jsonify({'status': 'ok'}))
+
+
+def readiness():
+    """預熱完成且主資料庫可連線時 200，否則 503"""
+    app = current_app._get_current_object()
+    state = app.extensions['warmup']
+    if not state.ready:
+        state.start_background(app)
+        return _no_store(jsonify(dict(state.to_dict(), database=None)), 503)
+    try:
+        db.session.execute(text('SELECT 1'))
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return _no_store(jsonify(dict(state.to_dict(), database=False, error=str(e.__class__.__name__))), 503)
+    return _no_store(jsonify(dict(state.to_dict(), database=True)))
+
+
+def init_app(app):
+    """設定樣板 bytecode cache（TEMPLATE_CACHE_DIR，設為空字串停用）並註冊 /healthz、/readyz"""
+    directory = app.config.get('TEMPLATE_CACHE_DIR')
+    if directory is None:
+        directory = os.path.join(app.instance_path, 'jinja')
+    if directory:
+        app.jinja_env.bytecode_cache = bytecode_cache(directory)
+    app.extensions['warmup'] = WarmupState()
+    app.add_url_rule('/healthz', 'healthz', liveness)
+    app.add_url_rule('/readyz', 'readyz', readiness)